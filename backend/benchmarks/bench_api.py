@@ -0,0 +1,374 @@
+"""Benchmark da API com dados sintéticos de vários usuários
+
+Popula um banco dedicado com usuários × meses × lançamentos, dispara
+requisições HTTP concorrentes contra os endpoints principais e grava
+percentis de latência e vazão em JSON.
+
+Uso:
+    python benchmarks/bench_api.py [--usuarios 5] [--meses 12] [--lancamentos 40]
+                                   [--requisicoes 50] [--concorrencia 4]
+                                   [--mongomock] [--sem-cache]
+                                   [--saida resultado.json]
+                                   [--comparar base.json --tolerancia 0.2]
+
+Sem --url o servidor sobe neste processo (uvicorn em uma thread). Com
+--mongomock o banco é um mongomock em memória (pacote mongomock-motor);
+senão usa MONGO_URL com o banco --db, que é APAGADO antes de popular.
+Com --url, --db precisa ser o mesmo banco usado pelo servidor externo.
+
+Com --comparar, termina com código 1 se o p95 de algum cenário piorar
+mais que a tolerância em relação ao resultado base.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+SENHA = "benchmark123"
+CATEGORIAS_RECEITA = ["Salário", "Freelance", "Investimentos"]
+CATEGORIAS_DESPESA = ["Alimentação", "Transporte", "Moradia", "Saúde", "Lazer"]
+DESCRICOES_DESPESA = ["Mercado", "Uber", "Aluguel", "Farmácia", "Cinema", "Padaria", "Netflix"]
+FORMAS = ["pix", "cartão", "dinheiro", "boleto"]
+PERCENTIS = (50, 90, 95, 99)
+
+
+# ========== DADOS SINTÉTICOS ==========
+
+def meses_recentes(quantidade: int, hoje: datetime):
+    """(ano, mes) dos últimos `quantidade` meses, do mais antigo ao atual"""
+    ano, mes = hoje.year, hoje.month
+    meses = []
+    for _ in range(quantidade):
+        meses.append((ano, mes))
+        mes -= 1
+        if mes == 0:
+            ano, mes = ano - 1, 12
+    return list(reversed(meses))
+
+def gerar_lancamentos(server, user_id: str, meses, por_mes: int, rnd: random.Random):
+    """Receitas e despesas do usuário no formato gravado pela API (~20% receitas)"""
+    receitas, despesas = [], []
+    for ano, mes in meses:
+        for _ in range(por_mes):
+            data = f"{ano}-{mes:02d}-{rnd.randint(1, 28):02d}"
+            if rnd.random() < 0.2:
+                obj = server.Receita(
+                    user_id=user_id, data=data, descricao="Recebimento",
+                    categoria=rnd.choice(CATEGORIAS_RECEITA), forma_recebimento=rnd.choice(FORMAS),
+                    valor=round(rnd.uniform(500, 5000), 2), mes=mes, ano=ano
+                )
+                receitas.append(server.documento_lancamento(obj))
+            else:
+                obj = server.Despesa(
+                    user_id=user_id, data=data, descricao=rnd.choice(DESCRICOES_DESPESA),
+                    categoria=rnd.choice(CATEGORIAS_DESPESA), forma_pagamento=rnd.choice(FORMAS),
+                    valor=round(rnd.uniform(5, 800), 2), mes=mes, ano=ano
+                )
+                despesas.append(server.documento_lancamento(obj))
+    return receitas, despesas
+
+async def popular_banco(server, args) -> list:
+    """Apaga o banco de benchmark e grava usuários, categorias e lançamentos"""
+    db = server.db
+    for nome in await db.list_collection_names():
+        await db.drop_collection(nome)
+
+    rnd = random.Random(args.semente)
+    senha_hash = server.hash_senha(SENHA)  # um único hash: bcrypt é caro e o login mede a verificação
+    meses = meses_recentes(args.meses, datetime.now())
+    usuarios = []
+    for i in range(args.usuarios):
+        usuario = server.Usuario(nome=f"Benchmark {i}", email=f"benchmark{i}@example.com", senha_hash=senha_hash)
+        await db.usuarios.insert_one(usuario.dict())
+        categorias = [server.Categoria(user_id=usuario.id, nome=nome, tipo="receita") for nome in CATEGORIAS_RECEITA]
+        categorias += [server.Categoria(user_id=usuario.id, nome=nome, tipo="despesa") for nome in CATEGORIAS_DESPESA]
+        await db.categorias.insert_many([c.dict() for c in categorias])
+
+        receitas, despesas = gerar_lancamentos(server, usuario.id, meses, args.lancamentos, rnd)
+        if receitas:
+            await db.receitas.insert_many(receitas)
+        if despesas:
+            await db.despesas.insert_many(despesas)
+        usuarios.append({"id": usuario.id, "email": usuario.email})
+
+    await server.reconstruir_resumos()
+    # Os dados já nascem no formato atual: as migrações não têm o que fazer
+    for nome, _ in server.MIGRACOES:
+        await db.migracoes.insert_one({"_id": nome, "aplicada_em": datetime.utcnow(), "documentos": 0})
+    return usuarios
+
+
+# ========== SERVIDOR ==========
+
+def porta_livre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ServidorLocal:
+    """Sobe server.app com uvicorn em uma thread do próprio processo"""
+
+    def __init__(self, app):
+        import uvicorn
+        self.porta = porta_livre()
+        self.url = f"http://127.0.0.1:{self.porta}"
+        self.servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.porta, log_level="warning"))
+        self.thread = threading.Thread(target=self.servidor.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        limite = time.monotonic() + 30
+        while not self.servidor.started:
+            if not self.thread.is_alive() or time.monotonic() > limite:
+                raise RuntimeError("Servidor de benchmark não iniciou")
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc):
+        self.servidor.should_exit = True
+        self.thread.join(timeout=10)
+
+
+# ========== CENÁRIOS ==========
+
+class Cliente:
+    """Uma sessão HTTP por thread, com o token de cada usuário"""
+
+    def __init__(self, url: str, usuarios: list):
+        self.url = url.rstrip("/") + "/api"
+        self.usuarios = usuarios
+        self.tokens = {}
+        self._local = threading.local()
+
+    @property
+    def sessao(self) -> requests.Session:
+        if not hasattr(self._local, "sessao"):
+            self._local.sessao = requests.Session()
+        return self._local.sessao
+
+    def chamar(self, metodo: str, caminho: str, usuario: dict = None, **kwargs) -> requests.Response:
+        headers = {}
+        if usuario is not None:
+            headers["Authorization"] = f"Bearer {self.tokens[usuario['id']]}"
+        resposta = self.sessao.request(metodo, self.url + caminho, headers=headers, timeout=120, **kwargs)
+        resposta.raise_for_status()
+        return resposta
+
+    def autenticar(self):
+        for usuario in self.usuarios:
+            resposta = self.chamar("POST", "/auth/login", json={"email": usuario["email"], "senha": SENHA})
+            self.tokens[usuario["id"]] = resposta.json()["access_token"]
+
+def nova_despesa(i: int) -> dict:
+    hoje = datetime.now()
+    return {
+        "data": hoje.strftime("%Y-%m-%d"),
+        "descricao": f"Benchmark {i}",
+        "categoria": "Lazer",
+        "forma_pagamento": "pix",
+        "valor": 10.0 + i % 50,
+    }
+
+def montar_cenarios(cliente: Cliente) -> list:
+    """(nome, função(i)) na ordem de execução; criar/atualizar/excluir dependem um do outro"""
+    criadas = {}
+    lock = threading.Lock()
+
+    def usuario(i):
+        return cliente.usuarios[i % len(cliente.usuarios)]
+
+    def login(i):
+        u = usuario(i)
+        cliente.chamar("POST", "/auth/login", json={"email": u["email"], "senha": SENHA})
+
+    def criar_despesa(i):
+        despesa = cliente.chamar("POST", "/despesas", usuario(i), json=nova_despesa(i)).json()
+        with lock:
+            criadas[i] = despesa["id"]
+
+    def atualizar_despesa(i):
+        dados = {**nova_despesa(i), "valor": 99.0}
+        cliente.chamar("PUT", f"/despesas/{criadas[i]}", usuario(i), json=dados)
+
+    def excluir_despesa(i):
+        cliente.chamar("DELETE", f"/despesas/{criadas[i]}", usuario(i))
+
+    def get(caminho):
+        return lambda i: cliente.chamar("GET", caminho, usuario(i))
+
+    return [
+        ("login", login),
+        ("listar_despesas", get("/despesas")),
+        ("listar_despesas_pagina", get("/despesas/pagina?limite=50")),
+        ("criar_despesa", criar_despesa),
+        ("atualizar_despesa", atualizar_despesa),
+        ("excluir_despesa", excluir_despesa),
+        ("dashboard", get("/dashboard")),
+        ("resumo_mensal", get("/resumo-mensal")),
+        ("projecoes", get("/projecoes")),
+        ("gastos_recorrentes", get("/gastos-recorrentes")),
+        ("export_excel", get("/export-excel")),
+    ]
+
+def percentil(ordenados: list, p: float) -> float:
+    """Percentil por interpolação linear (ordenados em ordem crescente)"""
+    if len(ordenados) == 1:
+        return ordenados[0]
+    pos = (len(ordenados) - 1) * p / 100
+    base = int(pos)
+    prox = min(base + 1, len(ordenados) - 1)
+    return ordenados[base] + (ordenados[prox] - ordenados[base]) * (pos - base)
+
+def executar_cenario(funcao, requisicoes: int, concorrencia: int) -> dict:
+    """Roda `requisicoes` chamadas com `concorrencia` threads e resume as latências (ms)"""
+    latencias, erros = [], []
+
+    def medir(i):
+        inicio = time.perf_counter()
+        try:
+            funcao(i)
+        except Exception as e:
+            erros.append(str(e))
+            return
+        latencias.append((time.perf_counter() - inicio) * 1000)
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        list(executor.map(medir, range(requisicoes)))
+    duracao = time.perf_counter() - inicio
+
+    resultado = {
+        "requisicoes": requisicoes,
+        "erros": len(erros),
+        "duracao_s": round(duracao, 4),
+        "vazao_rps": round(len(latencias) / duracao, 2) if duracao else 0.0,
+    }
+    if latencias:
+        ordenadas = sorted(latencias)
+        resultado.update({f"p{p}_ms": round(percentil(ordenadas, p), 3) for p in PERCENTIS})
+        resultado["media_ms"] = round(statistics.fmean(ordenadas), 3)
+        resultado["max_ms"] = round(ordenadas[-1], 3)
+    if erros:
+        resultado["primeiro_erro"] = erros[0]
+    return resultado
+
+
+# ========== RESULTADOS ==========
+
+def comparar(atual: dict, base: dict, tolerancia: float) -> list:
+    """Cenários cujo p95 piorou mais que a tolerância (ou que passaram a ter erros)"""
+    regressoes = []
+    for nome, medida in atual["cenarios"].items():
+        anterior = base.get("cenarios", {}).get(nome)
+        if not anterior or "p95_ms" not in anterior:
+            continue
+        if medida["erros"] > anterior.get("erros", 0):
+            regressoes.append(f"{nome}: {medida['erros']} erros (base: {anterior.get('erros', 0)})")
+        elif "p95_ms" in medida and medida["p95_ms"] > anterior["p95_ms"] * (1 + tolerancia):
+            regressoes.append(f"{nome}: p95 {medida['p95_ms']:.1f} ms (base: {anterior['p95_ms']:.1f} ms)")
+    return regressoes
+
+def imprimir_tabela(cenarios: dict):
+    print(f"{'cenário':<24}{'req/s':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'erros':>7}")
+    for nome, m in cenarios.items():
+        print(f"{nome:<24}{m['vazao_rps']:>9.1f}{m.get('p50_ms', 0):>9.1f}{m.get('p95_ms', 0):>9.1f}{m.get('p99_ms', 0):>9.1f}{m['erros']:>7}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark da API do Controle Financeiro")
+    parser.add_argument("--usuarios", type=int, default=5)
+    parser.add_argument("--meses", type=int, default=12)
+    parser.add_argument("--lancamentos", type=int, default=40, help="Lançamentos por usuário por mês")
+    parser.add_argument("--requisicoes", type=int, default=50, help="Requisições por cenário")
+    parser.add_argument("--concorrencia", type=int, default=4)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--db", default="controle_financeiro_benchmark", help="Banco usado (e apagado) pelo benchmark")
+    parser.add_argument("--url", default=None, help="Servidor externo; sem ele a API sobe neste processo")
+    parser.add_argument("--mongomock", action="store_true", help="Usa mongomock em memória no lugar do MongoDB")
+    parser.add_argument("--sem-cache", action="store_true", help="Desliga o cache de respostas (servidor local)")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON com o resultado")
+    parser.add_argument("--comparar", default=None, help="Resultado base para detectar regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.2, help="Piora aceita no p95 (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = args.db
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    if args.sem_cache:
+        os.environ["RESPONSE_CACHE_TTL"] = "0"
+    import server
+
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            parser.error("--mongomock requer o pacote mongomock-motor")
+        server.client = AsyncMongoMockClient()
+        server.db = server.client[args.db]
+
+    usuarios = asyncio.run(popular_banco(server, args))
+    total = args.usuarios * args.meses * args.lancamentos
+    print(f"{args.usuarios} usuários × {args.meses} meses × {args.lancamentos} lançamentos = {total} lançamentos")
+
+    def medir_tudo(url: str) -> dict:
+        cliente = Cliente(url, usuarios)
+        cliente.autenticar()
+        return {
+            nome: executar_cenario(funcao, args.requisicoes, args.concorrencia)
+            for nome, funcao in montar_cenarios(cliente)
+        }
+
+    if args.url:
+        cenarios = medir_tudo(args.url)
+    else:
+        with ServidorLocal(server.app) as local:
+            cenarios = medir_tudo(local.url)
+
+    resultado = {
+        "gerado_em": datetime.utcnow().isoformat() + "Z",
+        "configuracao": {
+            "usuarios": args.usuarios,
+            "meses": args.meses,
+            "lancamentos_por_mes": args.lancamentos,
+            "lancamentos_total": total,
+            "requisicoes": args.requisicoes,
+            "concorrencia": args.concorrencia,
+            "banco": "mongomock" if args.mongomock else "mongodb",
+            "servidor": args.url or "local",
+            "cache_respostas": not args.sem_cache,
+        },
+        "ambiente": {"python": platform.python_version(), "plataforma": platform.platform()},
+        "cenarios": cenarios,
+    }
+
+    imprimir_tabela(cenarios)
+    if args.saida:
+        Path(args.saida).write_text(json.dumps(resultado, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Resultado gravado em {args.saida}")
+
+    codigo = 1 if any(m["erros"] for m in cenarios.values()) else 0
+    if args.comparar:
+        base = json.loads(Path(args.comparar).read_text(encoding="utf-8"))
+        regressoes = comparar(resultado, base, args.tolerancia)
+        for linha in regressoes:
+            print(f"REGRESSÃO {linha}")
+        if regressoes:
+            codigo = 1
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
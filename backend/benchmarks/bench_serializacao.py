@@ -0,0 +1,89 @@
+"""Custo de serialização das listagens: response_model (Pydantic) x FAST_JSON
+
+Uso:
+    python benchmarks/bench_serializacao.py [--linhas 10000] [--repeticoes 5]
+
+Não acessa o banco: mede apenas a conversão de documentos já lidos em bytes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+
+import server  # noqa: E402
+
+
+def gerar_despesas(linhas: int, semente: int = 42) -> list:
+    """Documentos no formato gravado em db.despesas (já sem _id/data_lancamento)"""
+    rnd = random.Random(semente)
+    docs = []
+    for i in range(linhas):
+        ano = rnd.choice([2024, 2025])
+        mes = rnd.randint(1, 12)
+        docs.append({
+            "id": f"desp-{i:08d}",
+            "user_id": "usuario-benchmark",
+            "data": f"{ano}-{mes:02d}-{rnd.randint(1, 28):02d}",
+            "descricao": rnd.choice(["Mercado", "Uber", "Farmácia", "Aluguel", "Padaria"]),
+            "categoria": rnd.choice(["Alimentação", "Transporte", "Saúde", "Moradia"]),
+            "forma_pagamento": rnd.choice(["pix", "cartão", "dinheiro"]),
+            "valor": round(rnd.uniform(1, 500), 2),
+            "mes": mes,
+            "ano": ano,
+        })
+    return docs
+
+async def caminho_modelo(docs: list, campo) -> bytes:
+    """Caminho padrão: Despesa(**doc) por linha + validação do response_model + render"""
+    conteudo = [server.Despesa(**doc) for doc in docs]
+    serializado = await serialize_response(field=campo, response_content=conteudo)
+    return JSONResponse(serializado).body
+
+async def caminho_rapido(docs: list, campo) -> bytes:
+    """Caminho FAST_JSON: dicts projetados direto para bytes"""
+    return server.codificar_json(docs)
+
+async def medir(func, docs: list, campo, repeticoes: int) -> float:
+    """Menor tempo (s) entre as repetições"""
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        await func(docs, campo)
+        tempos.append(time.perf_counter() - inicio)
+    return min(tempos)
+
+
+async def main_async(args) -> int:
+    docs = gerar_despesas(args.linhas)
+    rota = next(r for r in server.app.routes if getattr(r, "path", "") == "/api/despesas" and "GET" in r.methods)
+    
+    antes = await medir(caminho_modelo, docs, rota.response_field, args.repeticoes)
+    depois = await medir(caminho_rapido, docs, rota.response_field, args.repeticoes)
+    escala = 10000 / args.linhas
+    
+    encoder = "orjson" if server.orjson is not None else "json (stdlib)"
+    print(f"linhas={args.linhas} repetições={args.repeticoes} encoder={encoder}")
+    print(f"response_model: {antes * escala * 1000:8.1f} ms / 10k linhas")
+    print(f"FAST_JSON:      {depois * escala * 1000:8.1f} ms / 10k linhas")
+    print(f"ganho:          {antes / depois:8.1f}x")
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de serialização das listagens")
+    parser.add_argument("--linhas", type=int, default=10000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    return asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Comandos de manutenção do backend
+
+Uso:
+    python manage.py reconstruir-resumos [--user-id ID]
+    python manage.py verificar-resumos [--user-id ID]
+    python manage.py migrar-datas
+    python manage.py precalcular [--user-id ID] [--concorrencia N]
+    python manage.py expirar-assinaturas
+    python manage.py migrar
+    python manage.py indices
+
+precalcular é o batch noturno (cron) que grava os snapshots das análises.
+migrar aplica as migrações pendentes (as mesmas do startup da API); rode antes do
+deploy para que os workers não esperem a reconstrução dos resumos mensais.
+indices lista os índices declarados em server.INDICES, as consultas que cada um
+atende e se já existe no banco; sai com código 1 se algum estiver faltando.
+reconstruir-resumos apaga e recria os rollups: com a API recebendo escritas, os
+lançamentos gravados durante a reconstrução podem ficar de fora ou contar duas vezes.
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+import server
+
+
+async def cmd_reconstruir_resumos(args) -> int:
+    gravados = await server.reconstruir_resumos(args.user_id)
+    print(f"{gravados} resumos mensais gravados")
+    return 0
+
+async def cmd_verificar_resumos(args) -> int:
+    divergencias = await server.verificar_resumos(args.user_id)
+    for d in divergencias:
+        print(f"{d['chave']}: esperado={d['esperado']} gravado={d['gravado']}")
+    print(f"{len(divergencias)} divergências encontradas")
+    return 1 if divergencias else 0
+
+async def cmd_migrar_datas(args) -> int:
+    atualizados = await server.migrar_datas_nativas()
+    print(f"{atualizados} lançamentos com data_lancamento preenchida")
+    return 0
+
+async def cmd_precalcular(args) -> int:
+    inicio = time.perf_counter()
+    contagem = await server.precalcular_analytics(args.user_id, args.concorrencia)
+    print(f"{contagem['usuarios']} usuários, {contagem['snapshots']} snapshots gravados, "
+          f"{contagem['erros']} erros em {time.perf_counter() - inicio:.1f}s")
+    return 1 if contagem["erros"] else 0
+
+async def cmd_expirar_assinaturas(args) -> int:
+    expiradas = await server.expirar_assinaturas()
+    print(f"{expiradas['usuarios']} usuários e {expiradas['assinaturas']} assinaturas expirados")
+    return 0
+
+async def cmd_migrar(args) -> int:
+    aplicadas = await server.aplicar_migracoes()
+    print(f"{len(aplicadas)} migrações aplicadas" + (f": {', '.join(aplicadas)}" if aplicadas else ""))
+    return 0
+
+async def cmd_indices(args) -> int:
+    relatorio = await server.relatorio_indices()
+    for indice in relatorio:
+        situacao = "ok" if indice["criado"] else "FALTANDO"
+        unico = " (único)" if indice["unico"] else ""
+        print(f"[{situacao}] {indice['colecao']} {{{indice['chaves']}}}{unico}: {indice['consultas']}")
+    faltando = sum(not indice["criado"] for indice in relatorio)
+    print(f"{len(relatorio)} índices declarados, {faltando} faltando")
+    return 1 if faltando else 0
+
+
+COMANDOS = {
+    "reconstruir-resumos": cmd_reconstruir_resumos,
+    "verificar-resumos": cmd_verificar_resumos,
+    "migrar-datas": cmd_migrar_datas,
+    "precalcular": cmd_precalcular,
+    "expirar-assinaturas": cmd_expirar_assinaturas,
+    "migrar": cmd_migrar,
+    "indices": cmd_indices,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Comandos de manutenção do Controle Financeiro")
+    parser.add_argument("comando", choices=sorted(COMANDOS))
+    parser.add_argument("--user-id", default=None, help="Restringe o comando a um usuário")
+    parser.add_argument("--concorrencia", type=int, default=server.PRECALCULO_CONCORRENCIA,
+                        help="Usuários processados em paralelo (precalcular)")
+    args = parser.parse_args()
+
+    async def executar():
+        try:
+            return await COMANDOS[args.comando](args)
+        finally:
+            server.client.close()
+
+    return asyncio.run(executar())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,32 +1,225 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, UploadFile, File, status
+from fastapi.responses import FileResponse, JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteMany, ReadPreference, ReturnDocument, UpdateMany, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from pymongo.read_preferences import Nearest, PrimaryPreferred, Secondary, SecondaryPreferred
 import os
+import time
+import asyncio
 import logging
+import sys
+import random
+import threading
+import contextvars
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, ValidationError
 from typing import List, Optional
 import uuid
+import io
+import csv
+import json
+import re
+import html
+import base64
 from datetime import datetime, timedelta
 from decimal import Decimal
-import io
+import hashlib
 from openpyxl import Workbook
-from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font, PatternFill, Alignment, Border, Side, NamedStyle
 from openpyxl.chart import BarChart, PieChart, LineChart, Reference
 from openpyxl.utils import get_column_letter
 import jwt
 import bcrypt
+import numpy as np
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis é opcional; sem ele o cache de respostas fica em memória
+    redis_asyncio = None
+
+try:
+    import orjson
+except ImportError:  # orjson é opcional; sem ele codificar_json usa o json da stdlib
+    orjson = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ========== INSTRUMENTAÇÃO DO MONGO ==========
+
+class MedicaoRequisicao:
+    """Tempo no banco, consultas, documentos e etapas medidas durante uma requisição"""
+    
+    def __init__(self):
+        self.db_s = 0.0
+        self.consultas = 0
+        self.documentos = 0
+        self.etapas = {}
+        self.comandos = None  # lista apenas quando o profiler acompanha a requisição
+
+# Medição da requisição em andamento; o Motor propaga o contexto para as threads do pymongo
+medicao_atual = contextvars.ContextVar("medicao_atual", default=None)
+_medicao_lock = threading.Lock()
+
+def documentos_retornados(reply) -> int:
+    """Quantidade de documentos na resposta de find/aggregate/getMore/findAndModify"""
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", [])))
+    if "value" in reply:
+        return 1 if reply["value"] else 0
+    return 0
+
+# Comandos cujo plano de execução o profiler de requisições lentas consegue obter
+COMANDOS_EXPLICAVEIS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+PROFILER_MAX_COMANDOS = 50
+
+class MonitorConsultas(monitoring.CommandListener):
+    """Soma na medição da requisição atual o tempo e o volume de cada comando do Mongo"""
+    
+    def _registrar(self, duracao_micros: int, documentos: int):
+        medicao = medicao_atual.get()
+        if medicao is None:
+            return  # comandos fora de requisições (workers, monitoramento do driver)
+        with _medicao_lock:
+            medicao.db_s += duracao_micros / 1e6
+            medicao.consultas += 1
+            medicao.documentos += documentos
+    
+    def started(self, event):
+        medicao = medicao_atual.get()
+        if medicao is None or medicao.comandos is None:
+            return
+        if event.command_name in COMANDOS_EXPLICAVEIS and len(medicao.comandos) < PROFILER_MAX_COMANDOS:
+            medicao.comandos.append((event.database_name, dict(event.command)))
+    
+    def succeeded(self, event):
+        self._registrar(event.duration_micros, documentos_retornados(event.reply))
+    
+    def failed(self, event):
+        self._registrar(event.duration_micros, 0)
+
+@contextmanager
+def medir_etapa(nome: str):
+    """Acumula a duração de um trecho (json, excel, bcrypt...) no Server-Timing da requisição"""
+    medicao = medicao_atual.get()
+    if medicao is None:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        medicao.etapas[nome] = medicao.etapas.get(nome, 0.0) + time.perf_counter() - inicio
+
+class MonitorPool(monitoring.ConnectionPoolListener):
+    """Conexões abertas, em uso e tempo de espera por uma conexão livre no pool do driver"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inicio_checkout = threading.local()  # checkout começa e termina na mesma thread
+        self.metricas = {
+            "pools": 0,
+            "conexoes": 0,
+            "em_uso": 0,
+            "checkouts": 0,
+            "falhas_checkout": 0,
+            "timeouts_checkout": 0,
+            "limpezas": 0,
+            "espera_total_s": 0.0,
+            "espera_max_s": 0.0,
+        }
+    
+    def _somar(self, **deltas):
+        with self._lock:
+            for chave, delta in deltas.items():
+                self.metricas[chave] += delta
+    
+    def _espera(self) -> float:
+        inicio = getattr(self._inicio_checkout, "valor", None)
+        self._inicio_checkout.valor = None
+        return time.perf_counter() - inicio if inicio is not None else 0.0
+    
+    def pool_created(self, event):
+        self._somar(pools=1)
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        self._somar(limpezas=1)
+    
+    def pool_closed(self, event):
+        self._somar(pools=-1)
+    
+    def connection_created(self, event):
+        self._somar(conexoes=1)
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        self._somar(conexoes=-1)
+    
+    def connection_check_out_started(self, event):
+        self._inicio_checkout.valor = time.perf_counter()
+    
+    def connection_checked_out(self, event):
+        espera = self._espera()
+        with self._lock:
+            self.metricas["em_uso"] += 1
+            self.metricas["checkouts"] += 1
+            self.metricas["espera_total_s"] += espera
+            self.metricas["espera_max_s"] = max(self.metricas["espera_max_s"], espera)
+    
+    def connection_check_out_failed(self, event):
+        espera = self._espera()
+        timeout = event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT
+        with self._lock:
+            self.metricas["falhas_checkout"] += 1
+            self.metricas["timeouts_checkout"] += int(timeout)
+            self.metricas["espera_total_s"] += espera
+            self.metricas["espera_max_s"] = max(self.metricas["espera_max_s"], espera)
+    
+    def connection_checked_in(self, event):
+        self._somar(em_uso=-1)
+
+# Pool de conexões do Mongo (por servidor do cluster); variáveis ausentes mantêm o valor da
+# MONGO_URL ou o padrão do driver. MONGO_WAIT_QUEUE_TIMEOUT_MS limita a espera por conexão livre.
+OPCOES_MONGO_ENV = (
+    ("MONGO_MAX_POOL_SIZE", "maxPoolSize", int),
+    ("MONGO_MIN_POOL_SIZE", "minPoolSize", int),
+    ("MONGO_WAIT_QUEUE_TIMEOUT_MS", "waitQueueTimeoutMS", int),
+    ("MONGO_SERVER_SELECTION_TIMEOUT_MS", "serverSelectionTimeoutMS", int),
+)
+
+def opcoes_mongo() -> dict:
+    return {opcao: tipo(os.environ[env]) for env, opcao, tipo in OPCOES_MONGO_ENV if os.environ.get(env)}
+
+# Tempo (segundos) que o startup espera o banco responder antes de desistir
+MONGO_AQUECIMENTO_TIMEOUT = float(os.environ.get('MONGO_AQUECIMENTO_TIMEOUT', '30'))
+# Limite (segundos) do ping feito por /ready
+MONGO_READY_TIMEOUT = float(os.environ.get('MONGO_READY_TIMEOUT', '2'))
+
+monitor_pool = MonitorPool()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MonitorConsultas(), monitor_pool], **opcoes_mongo())
+# CRUD, auth e escritas sempre no primário, mesmo com readPreference na MONGO_URL;
+# só as leituras de análise vão para secundários (ANALYTICS_READ_PREFERENCE)
+db = client.get_database(os.environ['DB_NAME'], read_preference=ReadPreference.PRIMARY)
+# Valores efetivos (env > MONGO_URL > padrão do driver), usados no log e em /health
+MONGO_MAX_POOL_SIZE = client.options.pool_options.max_pool_size
+MONGO_MIN_POOL_SIZE = client.options.pool_options.min_pool_size
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -34,12 +227,73 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+@app.on_event("startup")
+async def aquecer_mongo():
+    """Primeiro hook de startup: espera o banco responder antes de migrações, índices e workers.
+    
+    O ping abre a primeira conexão e descobre a topologia; o driver completa o pool até
+    MONGO_MIN_POOL_SIZE em segundo plano.
+    """
+    inicio = time.monotonic()
+    while True:
+        restante = MONGO_AQUECIMENTO_TIMEOUT - (time.monotonic() - inicio)
+        try:
+            await asyncio.wait_for(client.admin.command("ping"), timeout=max(restante, 0.1))
+            logger.info(f"MongoDB pronto em {time.monotonic() - inicio:.2f}s "
+                        f"(pool {MONGO_MIN_POOL_SIZE}-{MONGO_MAX_POOL_SIZE}, análises em {ANALYTICS_READ_PREFERENCE})")
+            return
+        except Exception as e:
+            if time.monotonic() - inicio >= MONGO_AQUECIMENTO_TIMEOUT:
+                raise RuntimeError(f"MongoDB indisponível após {MONGO_AQUECIMENTO_TIMEOUT:.0f}s: {e!r}") from e
+            logger.warning(f"Aguardando o MongoDB: {e}")
+            await asyncio.sleep(1)
+
+@app.on_event("startup")
+async def preparar_banco():
+    """Migrações e índices (seções no fim do arquivo) antes dos hooks registrados depois:
+    workers da Hotmart e varredura de expirações dependem do índice único de idempotência
+    e não podem rodar junto com o preenchimento de assinatura_atual."""
+    await aplicar_migracoes()
+    await criar_indices()
+
 # Security
 security = HTTPBearer()
 SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'sua-chave-secreta-super-segura-mude-em-producao')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 dias
 
+# Cache de usuários autenticados (segundos / quantidade máxima)
+USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', '60'))
+USER_CACHE_MAX = int(os.environ.get('USER_CACHE_MAX', '10000'))
+# Quando ativo, plano/status vêm das claims do token e get_current_user não consulta o banco
+AUTH_CLAIMS_DO_TOKEN = os.environ.get('AUTH_CLAIMS_DO_TOKEN', 'false').lower() == 'true'
+
+# Cache das respostas de analytics (dashboard, resumos, projeções, recorrentes)
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '300'))
+RESPONSE_CACHE_MAX = int(os.environ.get('RESPONSE_CACHE_MAX', '5000'))
+REDIS_URL = os.environ.get('REDIS_URL')
+
+# bcrypt roda em um pool dedicado para não bloquear o event loop
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', '2'))
+BCRYPT_MAX_FILA = int(os.environ.get('BCRYPT_MAX_FILA', '64'))
+bcrypt_executor = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+bcrypt_metricas = {
+    "pendentes": 0,
+    "executadas": 0,
+    "rejeitadas": 0,
+    "espera_total_s": 0.0,
+    "espera_max_s": 0.0,
+}
+
+# /metrics: se definido, exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Leitura em lotes: cursores nunca carregam a coleção inteira de uma vez
+MONGO_BATCH_SIZE = int(os.environ.get('MONGO_BATCH_SIZE', '500'))
+
+# Listagens rápidas: documentos projetados vão direto para bytes, sem um modelo Pydantic por linha
+FAST_JSON = os.environ.get('FAST_JSON', 'false').lower() == 'true'
+
 
 # ========== MODELS ==========
 
@@ -53,6 +307,9 @@ class Usuario(BaseModel):
     status_assinatura: str = "active"  # active, canceled, expired
     data_expiracao: Optional[datetime] = None
     hotmart_subscriber_code: Optional[str] = None
+    assinatura_atual: Optional[dict] = None  # cópia da assinatura ativa, mantida pelo webhook
+    categorias_modelo: Optional[int] = None  # versão de MODELOS_CATEGORIAS; None = categorias todas em db.categorias
+    categorias_personalizadas: bool = False  # há documentos em db.categorias que alteram o modelo
 
 class Assinatura(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -127,6 +384,14 @@ class DespesaCreate(BaseModel):
     forma_pagamento: str
     valor: float
 
+class PaginaReceitas(BaseModel):
+    itens: List[Receita]
+    proximo: Optional[str] = None  # cursor opaco da próxima página
+
+class PaginaDespesas(BaseModel):
+    itens: List[Despesa]
+    proximo: Optional[str] = None
+
 class ResumoMensal(BaseModel):
     mes: int
     ano: int
@@ -139,13 +404,482 @@ class ResumoMensal(BaseModel):
 
 # ========== HELPER FUNCTIONS ==========
 
+class CacheTTL:
+    """Cache LRU em memória com expiração por item"""
+    
+    def __init__(self, max_itens: int, ttl: float):
+        self.max_itens = max_itens
+        self.ttl = ttl
+        self._itens = OrderedDict()
+    
+    def obter(self, chave):
+        item = self._itens.get(chave)
+        if item is None:
+            return None
+        expira_em, valor = item
+        if expira_em < time.monotonic():
+            del self._itens[chave]
+            return None
+        self._itens.move_to_end(chave)
+        return valor
+    
+    def definir(self, chave, valor):
+        if self.ttl <= 0:
+            return
+        self._itens[chave] = (time.monotonic() + self.ttl, valor)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.max_itens:
+            self._itens.popitem(last=False)
+    
+    def invalidar(self, chave):
+        self._itens.pop(chave, None)
+    
+    def limpar(self):
+        self._itens.clear()
+
+usuarios_cache = CacheTTL(USER_CACHE_MAX, USER_CACHE_TTL)
+
+# Datas inválidas caem em janeiro/2025, como sempre fez extrair_mes_ano
+DATA_PADRAO = datetime(2025, 1, 1)
+
+def converter_data(data_str: str) -> datetime:
+    """Converte uma string YYYY-MM-DD na data nativa gravada em data_lancamento"""
+    try:
+        return datetime.strptime(data_str, "%Y-%m-%d")
+    except:
+        return DATA_PADRAO
+
 def extrair_mes_ano(data_str: str):
     """Extrai mês e ano de uma string de data YYYY-MM-DD"""
+    data = converter_data(data_str)
+    return data.month, data.year
+
+def documento_lancamento(obj: BaseModel) -> dict:
+    """Documento de receita/despesa como gravado no banco, com a data nativa"""
+    doc = obj.dict()
+    doc["data_lancamento"] = converter_data(doc["data"])
+    return doc
+
+def ler_data_filtro(valor: str) -> datetime:
+    """Converte a data de um filtro da API, rejeitando formatos inválidos"""
     try:
-        data = datetime.strptime(data_str, "%Y-%m-%d")
-        return data.month, data.year
-    except:
-        return 1, 2025
+        return datetime.strptime(valor, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas devem estar no formato YYYY-MM-DD")
+
+
+# ========== AGGREGATION HELPERS ==========
+
+VALOR_OU_ZERO = {"$ifNull": ["$valor", 0]}
+
+# Soma de valores agrupada por (mes, ano)
+PIPELINE_POR_MES = [
+    {"$group": {"_id": {"mes": "$mes", "ano": "$ano"}, "valor": {"$sum": VALOR_OU_ZERO}}},
+]
+
+def montar_filtro_periodo(user_id: str, periodo: Optional[str], data_inicio: Optional[str] = None, data_fim: Optional[str] = None) -> dict:
+    """Traduz o período do dashboard em um filtro do MongoDB sobre data_lancamento"""
+    filtro = {"user_id": user_id}
+    
+    if periodo == "ultimo_mes":
+        hoje = datetime.now()
+        filtro["mes"] = hoje.month
+        filtro["ano"] = hoje.year
+    elif periodo == "ultimos_6_meses":
+        data_limite = datetime.now() - timedelta(days=180)
+        filtro["data_lancamento"] = {"$gte": data_limite}
+    elif periodo == "customizado" and data_inicio and data_fim:
+        filtro["data_lancamento"] = {"$gte": ler_data_filtro(data_inicio), "$lte": ler_data_filtro(data_fim)}
+    # Se periodo == "total" ou None, não filtra nada
+    
+    return filtro
+
+def montar_filtro_transacoes(
+    user_id: str,
+    mes: Optional[int] = None,
+    ano: Optional[int] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    categoria: Optional[str] = None
+) -> dict:
+    """Monta o filtro das listagens de receitas/despesas"""
+    filtro = {"user_id": user_id}
+    if mes:
+        filtro["mes"] = mes
+    if ano:
+        filtro["ano"] = ano
+    if data_inicio or data_fim:
+        filtro["data_lancamento"] = {}
+        if data_inicio:
+            filtro["data_lancamento"]["$gte"] = ler_data_filtro(data_inicio)
+        if data_fim:
+            filtro["data_lancamento"]["$lte"] = ler_data_filtro(data_fim)
+    if categoria:
+        filtro["categoria"] = categoria
+    return filtro
+
+def codificar_cursor(doc: dict) -> str:
+    """Gera o cursor opaco (data + id) a partir do último item da página"""
+    bruto = json.dumps([doc["data_lancamento"].isoformat(), doc["id"]]).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii')
+
+def decodificar_cursor(cursor: str):
+    """Recupera (data, id) de um cursor gerado por codificar_cursor"""
+    try:
+        data, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(data), str(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+# Ordenação das páginas; servida pelos índices declarados em INDICES
+ORDEM_PAGINACAO = [("data_lancamento", -1), ("id", -1)]
+
+async def listar_pagina(colecao, filtro: dict, limite: int, cursor: Optional[str] = None, projecao: Optional[dict] = None):
+    """Retorna uma página ordenada por data/id decrescentes e o cursor da próxima"""
+    if cursor:
+        data, item_id = decodificar_cursor(cursor)
+        filtro = {"$and": [filtro, {"$or": [
+            {"data_lancamento": {"$lt": data}},
+            {"data_lancamento": data, "id": {"$lt": item_id}},
+        ]}]}
+    projecao = {**projecao, "data_lancamento": 1} if projecao else {"_id": 0}
+    docs = await colecao.find(filtro, projecao).sort(ORDEM_PAGINACAO).limit(limite + 1).to_list(limite + 1)
+    proximo = None
+    if len(docs) > limite:
+        docs = docs[:limite]
+        proximo = codificar_cursor(docs[-1])
+    return docs, proximo
+
+def projecao_modelo(modelo) -> dict:
+    """Projeção do Mongo com exatamente os campos expostos pelo modelo"""
+    return {"_id": 0, **{campo: 1 for campo in modelo.model_fields}}
+
+PROJECAO_RECEITA = projecao_modelo(Receita)
+PROJECAO_DESPESA = projecao_modelo(Despesa)
+
+def serializar_padrao(obj):
+    """Converte os tipos que o encoder JSON não conhece"""
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Tipo não serializável: {type(obj).__name__}")
+
+def codificar_json(dados) -> bytes:
+    """Serializa para bytes com orjson quando instalado, senão com o json da stdlib"""
+    with medir_etapa("json"):
+        if orjson is not None:
+            return orjson.dumps(dados, default=serializar_padrao, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(dados, ensure_ascii=False, separators=(",", ":"), default=serializar_padrao).encode('utf-8')
+
+def resposta_json(dados) -> Response:
+    return Response(content=codificar_json(dados), media_type="application/json")
+
+async def listar_rapido(colecao, filtro: dict, projecao: dict) -> Response:
+    """Caminho FAST_JSON das listagens: dicts projetados serializados direto, sem response_model"""
+    docs = await colecao.find(filtro, projecao, batch_size=MONGO_BATCH_SIZE).to_list(None)
+    return resposta_json(docs)
+
+async def pagina_rapida(colecao, filtro: dict, limite: int, cursor: Optional[str], projecao: dict) -> Response:
+    """Caminho FAST_JSON das listagens paginadas"""
+    itens, proximo = await listar_pagina(colecao, filtro, limite, cursor, projecao)
+    for item in itens:
+        item.pop("data_lancamento", None)
+    return resposta_json({"itens": itens, "proximo": proximo})
+
+
+
+# ========== RESUMOS MENSAIS (ROLLUPS) ==========
+
+# Totais por (user_id, ano, mes, tipo, categoria), mantidos com $inc nas escritas
+COLECOES_POR_TIPO = {"receita": "receitas", "despesa": "despesas"}
+
+def chave_resumo(user_id: str, tipo: str, doc: dict) -> dict:
+    return {
+        "user_id": user_id,
+        "ano": doc.get("ano"),
+        "mes": doc.get("mes"),
+        "tipo": tipo,
+        "categoria": doc.get("categoria", "Outros"),
+    }
+
+async def atualizar_resumo(user_id: str, tipo: str, doc: dict, sinal: int = 1):
+    """Soma (sinal=1) ou subtrai (sinal=-1) um lançamento do resumo do mês"""
+    await db.resumos_mensais.update_one(
+        chave_resumo(user_id, tipo, doc),
+        {"$inc": {"valor": sinal * doc.get("valor", 0), "quantidade": sinal}},
+        upsert=True
+    )
+
+async def substituir_no_resumo(user_id: str, tipo: str, anterior: dict, novo: dict):
+    """Move um lançamento alterado entre resumos, se mês/categoria/valor mudaram"""
+    if chave_resumo(user_id, tipo, anterior) == chave_resumo(user_id, tipo, novo) \
+            and anterior.get("valor", 0) == novo.get("valor", 0):
+        return
+    await atualizar_resumo(user_id, tipo, anterior, -1)
+    await atualizar_resumo(user_id, tipo, novo, 1)
+
+def somar_incremento(incrementos: dict, chave: dict, valor: float, quantidade: int):
+    """Acumula um incremento de resumo para gravar depois com aplicar_incrementos"""
+    chave = tuple(sorted(chave.items()))
+    valor_atual, quantidade_atual = incrementos.get(chave, (0, 0))
+    incrementos[chave] = (valor_atual + valor, quantidade_atual + quantidade)
+
+async def aplicar_incrementos(incrementos: dict, sessao=None):
+    """Grava os incrementos acumulados em um único bulk_write"""
+    operacoes = [
+        UpdateOne(dict(chave), {"$inc": {"valor": valor, "quantidade": quantidade}}, upsert=True)
+        for chave, (valor, quantidade) in incrementos.items()
+        if valor or quantidade
+    ]
+    if operacoes:
+        await db.resumos_mensais.bulk_write(operacoes, ordered=False, session=sessao)
+
+def pipeline_resumos(filtro: dict) -> list:
+    """Recalcula os resumos a partir dos lançamentos brutos"""
+    return [
+        {"$match": filtro},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "ano": "$ano",
+                "mes": "$mes",
+                "categoria": {"$ifNull": ["$categoria", "Outros"]},
+            },
+            "valor": {"$sum": VALOR_OU_ZERO},
+            "quantidade": {"$sum": 1},
+        }},
+    ]
+
+async def reconstruir_resumos(user_id: Optional[str] = None) -> int:
+    """Recria resumos_mensais (de um usuário ou de todos) a partir dos lançamentos"""
+    filtro = {"user_id": user_id} if user_id else {}
+    await db.resumos_mensais.delete_many(filtro)
+    
+    gravados = 0
+    for tipo, nome_colecao in COLECOES_POR_TIPO.items():
+        lote = []
+        async for g in db[nome_colecao].aggregate(pipeline_resumos(filtro), allowDiskUse=True, batchSize=MONGO_BATCH_SIZE):
+            lote.append({**g["_id"], "tipo": tipo, "valor": g["valor"], "quantidade": g["quantidade"]})
+            if len(lote) >= MONGO_BATCH_SIZE:
+                await db.resumos_mensais.insert_many(lote, ordered=False)
+                gravados += len(lote)
+                lote = []
+        if lote:
+            await db.resumos_mensais.insert_many(lote, ordered=False)
+            gravados += len(lote)
+    return gravados
+
+async def verificar_resumos(user_id: Optional[str] = None, tolerancia: float = 0.01) -> List[dict]:
+    """Compara resumos_mensais com os lançamentos e retorna as divergências"""
+    filtro = {"user_id": user_id} if user_id else {}
+    
+    esperado = {}
+    for tipo, nome_colecao in COLECOES_POR_TIPO.items():
+        async for g in db[nome_colecao].aggregate(pipeline_resumos(filtro), allowDiskUse=True, batchSize=MONGO_BATCH_SIZE):
+            chave = (g["_id"]["user_id"], g["_id"]["ano"], g["_id"]["mes"], tipo, g["_id"]["categoria"])
+            esperado[chave] = (g["valor"], g["quantidade"])
+    
+    divergencias = []
+    async for r in db.resumos_mensais.find({**filtro, "quantidade": {"$gt": 0}}, batch_size=MONGO_BATCH_SIZE):
+        chave = (r["user_id"], r["ano"], r["mes"], r["tipo"], r["categoria"])
+        valor, quantidade = esperado.pop(chave, (0, 0))
+        if quantidade != r["quantidade"] or abs(valor - r["valor"]) > tolerancia:
+            divergencias.append({"chave": chave, "esperado": (valor, quantidade), "gravado": (r["valor"], r["quantidade"])})
+    for chave, (valor, quantidade) in esperado.items():
+        divergencias.append({"chave": chave, "esperado": (valor, quantidade), "gravado": (0, 0)})
+    return divergencias
+
+async def totais_por_mes(tipo: str, user_id: str) -> dict:
+    """Totais de receitas ou despesas por (mes, ano), lidos de resumos_mensais"""
+    totais = {}
+    pipeline = [
+        {"$match": {"user_id": user_id, "tipo": tipo, "quantidade": {"$gt": 0}}},
+        {"$group": {"_id": {"mes": "$mes", "ano": "$ano"}, "valor": {"$sum": "$valor"}}},
+    ]
+    async for g in leitura().resumos_mensais.aggregate(pipeline, batchSize=MONGO_BATCH_SIZE):
+        totais[(g["_id"]["mes"], g["_id"]["ano"])] = g["valor"]
+    return totais
+
+
+# ========== VERSÃO DOS DADOS ==========
+
+# Contador por usuário incrementado em toda escrita de receitas/despesas/categorias
+async def registrar_alteracao(user_id: str):
+    await db.versoes_dados.update_one(
+        {"user_id": user_id},
+        {"$inc": {"versao": 1}, "$set": {"alterado_em": datetime.utcnow()}},
+        upsert=True
+    )
+    await cache_respostas.invalidar_usuario(user_id)
+
+async def obter_versao_dados(user_id: str) -> int:
+    doc = await db.versoes_dados.find_one({"user_id": user_id}, {"_id": 0, "versao": 1})
+    return doc["versao"] if doc else 0
+
+
+# ========== LEITURAS DE ANÁLISE (RÉPLICAS) ==========
+
+# Dashboard, resumos, projeções, recorrentes, snapshots e exportação leem do banco
+# devolvido por leitura(); CRUD, auth e escritas continuam sempre no primário.
+# Para testar com um replica set local:
+#   mongod --replSet rs0 ... (3 membros) e rs.initiate() no mongosh
+#   MONGO_URL=mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0
+#   ANALYTICS_READ_PREFERENCE=secondaryPreferred
+# e acompanhar leituras_analise_total em /metrics.
+PREFERENCIAS_LEITURA = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+# "primary" (padrão) desliga o roteamento
+ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'primary')
+# Atraso máximo aceito de um secundário; o driver exige no mínimo 90s
+ANALYTICS_MAX_STALENESS_S = max(int(os.environ.get('ANALYTICS_MAX_STALENESS_S', '90')), 90)
+if ANALYTICS_READ_PREFERENCE != "primary" and ANALYTICS_READ_PREFERENCE not in PREFERENCIAS_LEITURA:
+    raise ValueError(f"ANALYTICS_READ_PREFERENCE inválido: {ANALYTICS_READ_PREFERENCE}")
+
+# Depois de uma escrita o usuário continua lendo do primário por esta janela, para que
+# caches e snapshots da nova versão não sejam montados com dados de um secundário atrasado.
+# O driver estima o atraso com erro de até um heartbeat (10s).
+JANELA_LEITURA_PRIMARIO = timedelta(seconds=ANALYTICS_MAX_STALENESS_S + 10)
+
+# Banco das leituras de análise da tarefa atual (definido por leituras_de_analise)
+banco_leitura = contextvars.ContextVar("banco_leitura", default=None)
+leituras_analise_metricas = {"replica": 0, "primario": 0}
+
+def banco_replica():
+    """db com a preferência de leitura das análises, ou None com o roteamento desligado"""
+    preferencia = PREFERENCIAS_LEITURA.get(ANALYTICS_READ_PREFERENCE)
+    if preferencia is None:
+        return None
+    return db.with_options(read_preference=preferencia(max_staleness=ANALYTICS_MAX_STALENESS_S))
+
+def leitura():
+    """Banco para leituras de análise: o escolhido em leituras_de_analise, ou o primário"""
+    return banco_leitura.get() or db
+
+async def banco_de_analise(user_id: str):
+    """Réplica, a menos que o usuário tenha alterado dados dentro de JANELA_LEITURA_PRIMARIO"""
+    replica = banco_replica()
+    if replica is None:
+        return db
+    doc = await db.versoes_dados.find_one({"user_id": user_id}, {"_id": 0, "alterado_em": 1})
+    alterado_em = doc.get("alterado_em") if doc else None
+    if alterado_em and datetime.utcnow() - alterado_em < JANELA_LEITURA_PRIMARIO:
+        leituras_analise_metricas["primario"] += 1
+        return db
+    leituras_analise_metricas["replica"] += 1
+    return replica
+
+@asynccontextmanager
+async def leituras_de_analise(user_id: str):
+    """Direciona as chamadas a leitura() dentro do bloco para o banco de análise do usuário"""
+    token = banco_leitura.set(await banco_de_analise(user_id))
+    try:
+        yield
+    finally:
+        banco_leitura.reset(token)
+
+
+# ========== CACHE DE RESPOSTAS ==========
+
+# As chaves incluem uma "geração" por usuário; invalidar = incrementar a geração,
+# e as entradas antigas simplesmente expiram.
+
+class CacheRespostasLocal:
+    """Cache em memória do processo; a geração é a versão dos dados no Mongo,
+    compartilhada entre os workers (uma leitura pontual por requisição)"""
+    
+    def __init__(self, max_itens: int, ttl: float):
+        self._itens = CacheTTL(max_itens, ttl)
+    
+    async def obter(self, chave: str):
+        return self._itens.obter(chave)
+    
+    async def definir(self, chave: str, etag: str, corpo: bytes):
+        self._itens.definir(chave, (etag, corpo))
+    
+    async def geracao(self, user_id: str) -> int:
+        return await obter_versao_dados(user_id)
+    
+    async def invalidar_usuario(self, user_id: str):
+        pass  # registrar_alteracao já incrementou versoes_dados
+
+class CacheRespostasRedis:
+    """Cache compartilhado entre workers em um Redis (ou compatível)"""
+    
+    def __init__(self, url: str, ttl: float):
+        self._redis = redis_asyncio.from_url(url)
+        self.ttl = int(ttl)
+    
+    async def obter(self, chave: str):
+        try:
+            bruto = await self._redis.get(f"resp:{chave}")
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível: {e}")
+            return None
+        if bruto is None:
+            return None
+        etag, _, corpo = bruto.partition(b"\n")
+        return etag.decode('ascii'), corpo
+    
+    async def definir(self, chave: str, etag: str, corpo: bytes):
+        try:
+            await self._redis.set(f"resp:{chave}", etag.encode('ascii') + b"\n" + corpo, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível: {e}")
+    
+    async def geracao(self, user_id: str) -> int:
+        try:
+            return int(await self._redis.get(f"resp:geracao:{user_id}") or 0)
+        except Exception as e:
+            logger.warning(f"Cache Redis indisponível: {e}")
+            return -1  # chave que nunca é gravada por outro worker
+    
+    async def invalidar_usuario(self, user_id: str):
+        try:
+            await self._redis.incr(f"resp:geracao:{user_id}")
+        except Exception as e:
+            logger.warning(f"Falha ao invalidar cache Redis do usuário {user_id}: {e}")
+
+def criar_cache_respostas():
+    if REDIS_URL and redis_asyncio is not None:
+        return CacheRespostasRedis(REDIS_URL, RESPONSE_CACHE_TTL)
+    if REDIS_URL:
+        logging.warning("REDIS_URL definido, mas o pacote redis não está instalado; usando cache em memória")
+    return CacheRespostasLocal(RESPONSE_CACHE_MAX, RESPONSE_CACHE_TTL)
+
+cache_respostas = criar_cache_respostas()
+
+def etag_corresponde(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidatos = {valor.strip().removeprefix("W/") for valor in if_none_match.split(",")}
+    return etag in candidatos or "*" in candidatos
+
+async def resposta_em_cache(request: Request, user_id: str, nome: str, parametros: dict, calcular) -> Response:
+    """Serve a resposta do cache (ou 304 via ETag) e só chama calcular() em caso de falta"""
+    geracao = await cache_respostas.geracao(user_id)
+    chave = f"{user_id}:{geracao}:{nome}:{json.dumps(parametros, sort_keys=True, default=str)}"
+    
+    item = await cache_respostas.obter(chave)
+    if item is None:
+        async with leituras_de_analise(user_id):
+            resultado = await calcular()
+        corpo = codificar_json(resultado)
+        etag = '"' + hashlib.sha256(corpo).hexdigest()[:32] + '"'
+        if geracao >= 0:
+            await cache_respostas.definir(chave, etag, corpo)
+        item = (etag, corpo)
+    
+    etag, corpo = item
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_corresponde(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=corpo, media_type="application/json", headers=headers)
 
 
 # ========== AUTH FUNCTIONS ==========
@@ -158,13 +892,49 @@ def verificar_senha(senha: str, senha_hash: str) -> bool:
     """Verifica se a senha corresponde ao hash"""
     return bcrypt.checkpw(senha.encode('utf-8'), senha_hash.encode('utf-8'))
 
-def criar_token(user_id: str, email: str) -> str:
+async def executar_bcrypt(func, *args):
+    """Executa hash/verificação de senha no pool do bcrypt, com fila limitada"""
+    if bcrypt_metricas["pendentes"] >= BCRYPT_MAX_FILA:
+        bcrypt_metricas["rejeitadas"] += 1
+        raise HTTPException(status_code=503, detail="Servidor ocupado, tente novamente em instantes")
+    
+    enfileirado_em = time.perf_counter()
+    
+    def tarefa():
+        espera = time.perf_counter() - enfileirado_em
+        return func(*args), espera
+    
+    bcrypt_metricas["pendentes"] += 1
+    try:
+        with medir_etapa("bcrypt"):
+            resultado, espera = await asyncio.get_running_loop().run_in_executor(bcrypt_executor, tarefa)
+    finally:
+        bcrypt_metricas["pendentes"] -= 1
+    
+    bcrypt_metricas["executadas"] += 1
+    bcrypt_metricas["espera_total_s"] += espera
+    bcrypt_metricas["espera_max_s"] = max(bcrypt_metricas["espera_max_s"], espera)
+    return resultado
+
+def claims_usuario(usuario: dict) -> dict:
+    """Dados do usuário embutidos no token (usados com AUTH_CLAIMS_DO_TOKEN)"""
+    data_expiracao = usuario.get("data_expiracao")
+    return {
+        "nome": usuario.get("nome"),
+        "plano": usuario.get("plano", "trial"),
+        "status_assinatura": usuario.get("status_assinatura", "active"),
+        "data_expiracao": data_expiracao.isoformat() if data_expiracao else None,
+    }
+
+def criar_token(user_id: str, email: str, claims: Optional[dict] = None) -> str:
     """Cria JWT token"""
     payload = {
         "user_id": user_id,
         "email": email,
         "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     }
+    if claims:
+        payload.update(claims)
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 def verificar_token(token: str) -> dict:
@@ -183,10 +953,25 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     payload = verificar_token(token)
     user_id = payload.get("user_id")
     
+    if AUTH_CLAIMS_DO_TOKEN and "plano" in payload:
+        return {
+            "id": user_id,
+            "email": payload.get("email"),
+            "nome": payload.get("nome"),
+            "plano": payload.get("plano"),
+            "status_assinatura": payload.get("status_assinatura"),
+            "data_expiracao": payload.get("data_expiracao"),
+        }
+    
+    usuario = usuarios_cache.obter(user_id)
+    if usuario is not None:
+        return usuario
+    
     usuario = await db.usuarios.find_one({"id": user_id})
     if not usuario:
         raise HTTPException(status_code=401, detail="Usuário não encontrado")
     
+    usuarios_cache.definir(user_id, usuario)
     return usuario
 
 
@@ -202,27 +987,19 @@ async def registrar_usuario(input: UsuarioCreate):
     
     # Criar usuário
     usuario_dict = input.dict()
-    usuario_dict["senha_hash"] = hash_senha(usuario_dict.pop("senha"))
+    usuario_dict["senha_hash"] = await executar_bcrypt(hash_senha, usuario_dict.pop("senha"))
+    # Categorias padrão vêm do modelo compartilhado; nada é gravado em db.categorias
+    usuario_dict["categorias_modelo"] = CATEGORIAS_MODELO_ATUAL
     usuario_obj = Usuario(**usuario_dict)
     
-    await db.usuarios.insert_one(usuario_obj.dict())
-    
-    # Criar categorias padrão para o novo usuário
-    categorias_padrao = [
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Salário", "tipo": "receita", "cor": "#10B981"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Freelance", "tipo": "receita", "cor": "#34D399"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Investimentos", "tipo": "receita", "cor": "#6EE7B7"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Alimentação", "tipo": "despesa", "cor": "#EF4444"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Transporte", "tipo": "despesa", "cor": "#F87171"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Moradia", "tipo": "despesa", "cor": "#FCA5A5"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Lazer", "tipo": "despesa", "cor": "#FCD34D"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Saúde", "tipo": "despesa", "cor": "#FB923C"},
-        {"id": str(uuid.uuid4()), "user_id": usuario_obj.id, "nome": "Educação", "tipo": "despesa", "cor": "#A78BFA"},
-    ]
-    await db.categorias.insert_many(categorias_padrao)
+    try:
+        await db.usuarios.insert_one(usuario_obj.dict())
+    except DuplicateKeyError:
+        # Cadastro concorrente com o mesmo email (índice único)
+        raise HTTPException(status_code=400, detail="Email já cadastrado")
     
     # Criar token
-    token = criar_token(usuario_obj.id, usuario_obj.email)
+    token = criar_token(usuario_obj.id, usuario_obj.email, claims_usuario(usuario_obj.dict()))
     
     return {
         "access_token": token,
@@ -243,11 +1020,11 @@ async def login_usuario(input: UsuarioLogin):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     # Verificar senha
-    if not verificar_senha(input.senha, usuario["senha_hash"]):
+    if not await executar_bcrypt(verificar_senha, input.senha, usuario["senha_hash"]):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     # Criar token
-    token = criar_token(usuario["id"], usuario["email"])
+    token = criar_token(usuario["id"], usuario["email"], claims_usuario(usuario))
     
     return {
         "access_token": token,
@@ -274,6 +1051,52 @@ async def obter_usuario_atual(usuario: dict = Depends(get_current_user)):
 
 # ========== ASSINATURAS & HOTMART ==========
 
+# Webhooks são gravados crus em eventos_hotmart e confirmados na hora; workers
+# locais aplicam os eventos em ordem por assinante. A chave de idempotência
+# (evento + transação) faz as repetições da Hotmart virarem no-op.
+HOTMART_WORKERS = int(os.environ.get('HOTMART_WORKERS', '2'))
+HOTMART_MAX_TENTATIVAS = int(os.environ.get('HOTMART_MAX_TENTATIVAS', '3'))
+HOTMART_REIVINDICAR_APOS = timedelta(minutes=5)  # evento "processando" de um processo que morreu
+
+# Identificar o plano baseado no product_id da Hotmart
+PLANOS_HOTMART = {
+    # Você vai preencher com os IDs reais dos seus produtos na Hotmart
+    "PRODUCT_ID_MENSAL": "mensal",
+    "PRODUCT_ID_SEMESTRAL": "semestral",
+    "PRODUCT_ID_ANUAL": "anual"
+}
+
+hotmart_filas = []
+hotmart_workers = []
+hotmart_metricas = {
+    "recebidos": 0,
+    "duplicados": 0,
+    "processados": 0,
+    "ignorados": 0,
+    "erros": 0,
+    "atraso_total_s": 0.0,
+    "atraso_max_s": 0.0,
+}
+
+def chave_evento_hotmart(payload: dict) -> str:
+    """Chave de idempotência: evento + transação; sem transação, o id do evento ou o hash do corpo"""
+    event = payload.get("event")
+    transaction_code = ((payload.get("data") or {}).get("purchase") or {}).get("transaction")
+    if transaction_code:
+        return f"{event}:{transaction_code}"
+    if payload.get("id"):
+        return f"{event}:{payload['id']}"
+    return f"{event}:{hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()}"
+
+def assinante_do_evento(payload: dict) -> str:
+    data = payload.get("data") or {}
+    return (data.get("buyer") or {}).get("email") or (data.get("subscription") or {}).get("subscriber_code") or ""
+
+def enfileirar_evento_hotmart(evento_id: str, assinante: str):
+    """Eventos do mesmo assinante caem sempre na mesma fila, preservando a ordem"""
+    if hotmart_filas:
+        hotmart_filas[hash(assinante) % len(hotmart_filas)].put_nowait(evento_id)
+
 @api_router.post("/webhook/hotmart")
 async def webhook_hotmart(request: dict):
     """
@@ -284,98 +1107,244 @@ async def webhook_hotmart(request: dict):
     - PURCHASE_CANCELED: Compra cancelada
     - PURCHASE_REFUNDED: Compra reembolsada
     - SUBSCRIPTION_CANCELLATION: Assinatura cancelada
+    
+    O evento é só registrado aqui; worker_hotmart aplica em segundo plano.
     """
+    evento_id = chave_evento_hotmart(request)
+    assinante = assinante_do_evento(request)
     try:
-        event = request.get("event")
-        data = request.get("data", {})
-        
-        buyer_email = data.get("buyer", {}).get("email")
-        transaction_code = data.get("purchase", {}).get("transaction")
-        subscriber_code = data.get("subscription", {}).get("subscriber_code")
-        product_id = data.get("product", {}).get("id")
+        await db.eventos_hotmart.insert_one({
+            "_id": evento_id,
+            "evento": request.get("event"),
+            "assinante": assinante,
+            "payload": request,
+            "status": "pendente",
+            "tentativas": 0,
+            "recebido_em": datetime.utcnow(),
+        })
+    except DuplicateKeyError:
+        hotmart_metricas["duplicados"] += 1
+        return {"status": "success", "message": "Webhook já recebido"}
+    except Exception as e:
+        # Sem registro não há como processar depois: a Hotmart deve reenviar
+        logging.error(f"Erro ao registrar webhook Hotmart: {e}")
+        raise HTTPException(status_code=503, detail="Não foi possível registrar o webhook")
+    
+    hotmart_metricas["recebidos"] += 1
+    enfileirar_evento_hotmart(evento_id, assinante)
+    return {"status": "success", "message": "Webhook recebido"}
+
+async def aplicar_evento_hotmart(payload: dict) -> bool:
+    """Aplica um evento da Hotmart; retorna False se não há usuário para ele"""
+    event = payload.get("event")
+    data = payload.get("data") or {}
+    
+    buyer_email = (data.get("buyer") or {}).get("email")
+    transaction_code = (data.get("purchase") or {}).get("transaction")
+    subscriber_code = (data.get("subscription") or {}).get("subscriber_code")
+    product_id = (data.get("product") or {}).get("id")
+    
+    plano = PLANOS_HOTMART.get(str(product_id), "mensal")
+    
+    # Buscar usuário pelo email
+    if not buyer_email:
+        return False
+    usuario = await db.usuarios.find_one({"email": buyer_email})
+    if not usuario:
+        return False
+    
+    if event == "PURCHASE_COMPLETE":
+        # Compra aprovada - ativar assinatura
+        if plano == "anual":
+            data_expiracao = datetime.utcnow() + timedelta(days=365)
+        else:
+            data_expiracao = datetime.utcnow() + timedelta(days=30)
         
-        # Identificar o plano baseado no product_id da Hotmart
-        plano_map = {
-            # Você vai preencher com os IDs reais dos seus produtos na Hotmart
-            "PRODUCT_ID_MENSAL": "mensal",
-            "PRODUCT_ID_SEMESTRAL": "semestral",
-            "PRODUCT_ID_ANUAL": "anual"
+        assinatura = {
+            "id": str(uuid.uuid4()),
+            "user_id": usuario["id"],
+            "plano": plano,
+            "status": "active",
+            "data_inicio": datetime.utcnow(),
+            "data_fim": data_expiracao,
+            "valor": ((data.get("purchase") or {}).get("price") or {}).get("value") or 0,
+            "hotmart_transaction": transaction_code,
+            "hotmart_subscriber_code": subscriber_code
         }
+        if transaction_code:
+            # Uma assinatura por transação, mesmo se o evento for reaplicado
+            assinatura = await db.assinaturas.find_one_and_update(
+                {"hotmart_transaction": transaction_code},
+                {"$setOnInsert": assinatura},
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        else:
+            await db.assinaturas.insert_one(assinatura)
+            assinatura.pop("_id", None)
         
-        plano = plano_map.get(str(product_id), "mensal")
-        
-        # Buscar usuário pelo email
-        usuario = await db.usuarios.find_one({"email": buyer_email})
-        
-        if event == "PURCHASE_COMPLETE":
-            # Compra aprovada - ativar assinatura
-            if usuario:
-                # Calcular data de expiração
-                if plano == "anual":
-                    data_expiracao = datetime.utcnow() + timedelta(days=365)
-                else:
-                    data_expiracao = datetime.utcnow() + timedelta(days=30)
-                
-                # Atualizar usuário
-                await db.usuarios.update_one(
-                    {"email": buyer_email},
-                    {"$set": {
-                        "plano": plano,
-                        "status_assinatura": "active",
-                        "data_expiracao": data_expiracao,
-                        "hotmart_subscriber_code": subscriber_code
-                    }}
-                )
-                
-                # Criar registro de assinatura
-                assinatura = {
-                    "id": str(uuid.uuid4()),
-                    "user_id": usuario["id"],
-                    "plano": plano,
-                    "status": "active",
-                    "data_inicio": datetime.utcnow(),
-                    "data_fim": data_expiracao,
-                    "valor": data.get("purchase", {}).get("price", {}).get("value", 0),
-                    "hotmart_transaction": transaction_code,
-                    "hotmart_subscriber_code": subscriber_code
-                }
-                await db.assinaturas.insert_one(assinatura)
-        
-        elif event in ["PURCHASE_CANCELED", "PURCHASE_REFUNDED", "SUBSCRIPTION_CANCELLATION"]:
-            # Cancelar assinatura
-            if usuario:
-                await db.usuarios.update_one(
-                    {"email": buyer_email},
-                    {"$set": {
-                        "status_assinatura": "canceled",
-                        "plano": "trial"
-                    }}
-                )
-                
-                await db.assinaturas.update_many(
-                    {"user_id": usuario["id"], "status": "active"},
-                    {"$set": {"status": "canceled"}}
-                )
+        await db.usuarios.update_one(
+            {"email": buyer_email},
+            {"$set": {
+                "plano": assinatura["plano"],
+                "status_assinatura": "active",
+                "data_expiracao": assinatura["data_fim"],
+                "hotmart_subscriber_code": subscriber_code,
+                "assinatura_atual": assinatura
+            }}
+        )
+        usuarios_cache.invalidar(usuario["id"])
+    
+    elif event in ["PURCHASE_CANCELED", "PURCHASE_REFUNDED", "SUBSCRIPTION_CANCELLATION"]:
+        # Cancelar assinatura
+        await db.usuarios.update_one(
+            {"email": buyer_email},
+            {"$set": {
+                "status_assinatura": "canceled",
+                "plano": "trial",
+                "assinatura_atual": None
+            }}
+        )
+        usuarios_cache.invalidar(usuario["id"])
         
-        return {"status": "success", "message": "Webhook processed"}
-    
+        await db.assinaturas.update_many(
+            {"user_id": usuario["id"], "status": "active"},
+            {"$set": {"status": "canceled"}}
+        )
+    return True
+
+async def processar_evento_hotmart(evento_id: str):
+    """Reivindica o evento (pendente ou abandonado) e aplica, com novas tentativas em caso de erro"""
+    agora = datetime.utcnow()
+    evento = await db.eventos_hotmart.find_one_and_update(
+        {"_id": evento_id, "$or": [
+            {"status": "pendente"},
+            {"status": "processando", "iniciado_em": {"$lt": agora - HOTMART_REIVINDICAR_APOS}},
+        ]},
+        {"$set": {"status": "processando", "iniciado_em": agora}, "$inc": {"tentativas": 1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not evento:
+        return  # já processado (ou em andamento em outro processo)
+    
+    while True:
+        try:
+            aplicado = await aplicar_evento_hotmart(evento["payload"])
+            situacao = "processado" if aplicado else "ignorado"
+            await db.eventos_hotmart.update_one(
+                {"_id": evento_id},
+                {"$set": {"status": situacao, "processado_em": datetime.utcnow()}, "$unset": {"erro": ""}}
+            )
+            atraso = (datetime.utcnow() - evento["recebido_em"]).total_seconds()
+            hotmart_metricas["processados" if aplicado else "ignorados"] += 1
+            hotmart_metricas["atraso_total_s"] += atraso
+            hotmart_metricas["atraso_max_s"] = max(hotmart_metricas["atraso_max_s"], atraso)
+            return
+        except Exception as e:
+            logger.error(f"Erro ao aplicar evento Hotmart {evento_id} (tentativa {evento['tentativas']}): {e}")
+            if evento["tentativas"] >= HOTMART_MAX_TENTATIVAS:
+                hotmart_metricas["erros"] += 1
+                await db.eventos_hotmart.update_one({"_id": evento_id}, {"$set": {"status": "erro", "erro": str(e)}})
+                return
+            # Espera na própria fila: os próximos eventos do assinante não passam na frente
+            await asyncio.sleep(2 ** evento["tentativas"])
+            evento = await db.eventos_hotmart.find_one_and_update(
+                {"_id": evento_id},
+                {"$set": {"erro": str(e), "iniciado_em": datetime.utcnow()}, "$inc": {"tentativas": 1}},
+                return_document=ReturnDocument.AFTER
+            )
+
+async def worker_hotmart(fila: asyncio.Queue):
+    while True:
+        evento_id = await fila.get()
+        try:
+            await processar_evento_hotmart(evento_id)
+        except Exception as e:
+            logger.error(f"Falha no worker Hotmart com o evento {evento_id}: {e}")
+        finally:
+            fila.task_done()
+
+@app.on_event("startup")
+async def iniciar_workers_hotmart():
+    for _ in range(HOTMART_WORKERS):
+        fila = asyncio.Queue()
+        hotmart_filas.append(fila)
+        hotmart_workers.append(asyncio.create_task(worker_hotmart(fila)))
+    
+    # Eventos recebidos antes de uma reinicialização, na ordem em que chegaram
+    limite = datetime.utcnow() - HOTMART_REIVINDICAR_APOS
+    try:
+        async for evento in db.eventos_hotmart.find(
+            {"$or": [{"status": "pendente"}, {"status": "processando", "iniciado_em": {"$lt": limite}}]},
+            {"_id": 1, "assinante": 1},
+            sort=[("recebido_em", 1)],
+            batch_size=MONGO_BATCH_SIZE
+        ):
+            enfileirar_evento_hotmart(evento["_id"], evento.get("assinante", ""))
     except Exception as e:
-        logging.error(f"Erro no webhook Hotmart: {e}")
-        return {"status": "error", "message": str(e)}
+        logger.error(f"Não foi possível retomar eventos Hotmart pendentes: {e}")
+
+@app.on_event("shutdown")
+async def parar_workers_hotmart():
+    for tarefa in hotmart_workers:
+        tarefa.cancel()
+
+# Assinaturas vencidas são expiradas em lote a cada EXPIRACAO_INTERVALO segundos (0 desliga)
+EXPIRACAO_INTERVALO = float(os.environ.get('EXPIRACAO_INTERVALO', '300'))
+expiracao_tarefa = None
+
+async def expirar_assinaturas(agora: Optional[datetime] = None) -> dict:
+    """Marca como expirados os usuários e assinaturas ativos com vencimento até `agora`"""
+    agora = agora or datetime.utcnow()
+    # Índices (status_assinatura, data_expiracao) e (status, data_fim) atendem os dois filtros
+    usuarios = await db.usuarios.update_many(
+        {"status_assinatura": "active", "data_expiracao": {"$lte": agora}},
+        {"$set": {"status_assinatura": "expired", "plano": "trial", "assinatura_atual": None}}
+    )
+    assinaturas = await db.assinaturas.update_many(
+        {"status": "active", "data_fim": {"$lte": agora}},
+        {"$set": {"status": "expired"}}
+    )
+    if usuarios.modified_count:
+        # Os caches de outros processos se ajustam em até USER_CACHE_TTL segundos
+        usuarios_cache.limpar()
+    return {"usuarios": usuarios.modified_count, "assinaturas": assinaturas.modified_count}
+
+async def varrer_expiracoes():
+    while True:
+        try:
+            expiradas = await expirar_assinaturas()
+            if expiradas["usuarios"] or expiradas["assinaturas"]:
+                logger.info(f"Assinaturas expiradas: {expiradas['usuarios']} usuários, {expiradas['assinaturas']} assinaturas")
+        except Exception as e:
+            logger.error(f"Falha ao expirar assinaturas: {e}")
+        await asyncio.sleep(EXPIRACAO_INTERVALO)
+
+@app.on_event("startup")
+async def iniciar_varredura_expiracoes():
+    global expiracao_tarefa
+    if EXPIRACAO_INTERVALO > 0:
+        expiracao_tarefa = asyncio.create_task(varrer_expiracoes())
+
+@app.on_event("shutdown")
+async def parar_varredura_expiracoes():
+    if expiracao_tarefa:
+        expiracao_tarefa.cancel()
 
 @api_router.get("/assinatura/status")
 async def obter_status_assinatura(usuario: dict = Depends(get_current_user)):
     """Retorna o status da assinatura do usuário"""
-    assinatura = await db.assinaturas.find_one(
-        {"user_id": usuario["id"], "status": "active"},
-        sort=[("data_inicio", -1)]
-    )
+    if "assinatura_atual" not in usuario:
+        # Usuário montado a partir das claims do token: lê só o campo denormalizado
+        doc = await db.usuarios.find_one({"id": usuario["id"]}, {"_id": 0, "assinatura_atual": 1})
+        usuario = {**usuario, "assinatura_atual": (doc or {}).get("assinatura_atual")}
     
     return {
         "plano": usuario.get("plano", "trial"),
         "status": usuario.get("status_assinatura", "active"),
         "data_expiracao": usuario.get("data_expiracao"),
-        "assinatura": assinatura if assinatura else None
+        "assinatura": usuario.get("assinatura_atual")
     }
 
 @api_router.post("/checkout/hotmart")
@@ -408,17 +1377,77 @@ async def criar_checkout_hotmart(plano: str, usuario: dict = Depends(get_current
 
 # ========== CATEGORIAS ENDPOINTS ==========
 
+# Modelos de categorias padrão, compartilhados por todos os usuários e servidos da
+# memória. Cada usuário guarda a versão com que foi criado (categorias_modelo); uma
+# versão nova vale só para novos cadastros, então as antigas não devem ser alteradas.
+# Em db.categorias ficam apenas as categorias criadas pelo usuário e as alterações
+# do modelo: o mesmo id com outros dados, ou {"removida": True} para uma exclusão.
+MODELOS_CATEGORIAS = {
+    1: [
+        {"id": "padrao-1-salario", "nome": "Salário", "tipo": "receita", "cor": "#10B981"},
+        {"id": "padrao-1-freelance", "nome": "Freelance", "tipo": "receita", "cor": "#34D399"},
+        {"id": "padrao-1-investimentos", "nome": "Investimentos", "tipo": "receita", "cor": "#6EE7B7"},
+        {"id": "padrao-1-alimentacao", "nome": "Alimentação", "tipo": "despesa", "cor": "#EF4444"},
+        {"id": "padrao-1-transporte", "nome": "Transporte", "tipo": "despesa", "cor": "#F87171"},
+        {"id": "padrao-1-moradia", "nome": "Moradia", "tipo": "despesa", "cor": "#FCA5A5"},
+        {"id": "padrao-1-lazer", "nome": "Lazer", "tipo": "despesa", "cor": "#FCD34D"},
+        {"id": "padrao-1-saude", "nome": "Saúde", "tipo": "despesa", "cor": "#FB923C"},
+        {"id": "padrao-1-educacao", "nome": "Educação", "tipo": "despesa", "cor": "#A78BFA"},
+    ],
+}
+CATEGORIAS_MODELO_ATUAL = 1
+
+CAMPOS_CATEGORIAS_USUARIO = {"_id": 0, "id": 1, "categorias_modelo": 1, "categorias_personalizadas": 1}
+
+async def usuario_com_categorias(usuario: dict) -> dict:
+    """Campos de categorias lidos do banco por leitura pontual
+    
+    Não vêm do usuário autenticado: o cache de usuários é por processo e as claims
+    do token não os trazem, então outro worker poderia não ver uma alteração recente.
+    Com o cache desligado (USER_CACHE_TTL=0), o documento completo (com _id, que as
+    claims não têm) acabou de ser lido do primário por get_current_user e é reaproveitado.
+    """
+    if usuarios_cache.ttl <= 0 and "_id" in usuario:
+        return usuario
+    doc = await db.usuarios.find_one({"id": usuario["id"]}, CAMPOS_CATEGORIAS_USUARIO)
+    return {**usuario, **(doc or {})}
+
+def ids_do_modelo(usuario: dict) -> set:
+    return {c["id"] for c in MODELOS_CATEGORIAS.get(usuario.get("categorias_modelo"), [])}
+
+async def categorias_do_usuario(usuario: dict) -> List[dict]:
+    """Categorias do usuário: modelo compartilhado mesclado com as alterações gravadas"""
+    versao = usuario.get("categorias_modelo")
+    modelo = [{**c, "user_id": usuario["id"]} for c in MODELOS_CATEGORIAS.get(versao, [])]
+    if versao is not None and usuario.get("categorias_personalizadas") is False:
+        return modelo  # nunca alterou nada: nenhuma consulta
+    
+    gravadas = await db.categorias.find({"user_id": usuario["id"]}, {"_id": 0}, batch_size=MONGO_BATCH_SIZE).to_list(None)
+    alteradas = {c["id"]: c for c in gravadas}
+    mescladas = [alteradas.get(c["id"], c) for c in modelo]
+    ids_modelo = {c["id"] for c in modelo}
+    mescladas += [c for c in gravadas if c["id"] not in ids_modelo]
+    return [c for c in mescladas if not c.get("removida")]
+
+async def marcar_categorias_personalizadas(usuario: dict):
+    """A partir daqui as listagens do usuário passam a consultar db.categorias"""
+    if usuario.get("categorias_personalizadas") is True:
+        return
+    await db.usuarios.update_one({"id": usuario["id"]}, {"$set": {"categorias_personalizadas": True}})
+
 @api_router.get("/categorias", response_model=List[Categoria])
 async def listar_categorias(usuario: dict = Depends(get_current_user)):
-    categorias = await db.categorias.find({"user_id": usuario["id"]}).to_list(1000)
-    return [Categoria(**cat) for cat in categorias]
+    usuario = await usuario_com_categorias(usuario)
+    return [Categoria(**cat) for cat in await categorias_do_usuario(usuario)]
 
 @api_router.post("/categorias", response_model=Categoria)
 async def criar_categoria(input: CategoriaCreate, usuario: dict = Depends(get_current_user)):
     cat_dict = input.dict()
     cat_dict["user_id"] = usuario["id"]
     cat_obj = Categoria(**cat_dict)
+    await marcar_categorias_personalizadas(await usuario_com_categorias(usuario))
     await db.categorias.insert_one(cat_obj.dict())
+    await registrar_alteracao(usuario["id"])
     return cat_obj
 
 @api_router.put("/categorias/{cat_id}", response_model=Categoria)
@@ -427,33 +1456,74 @@ async def atualizar_categoria(cat_id: str, input: CategoriaCreate, usuario: dict
     cat_dict["id"] = cat_id
     cat_dict["user_id"] = usuario["id"]
     cat_obj = Categoria(**cat_dict)
-    result = await db.categorias.update_one(
-        {"id": cat_id, "user_id": usuario["id"]}, 
-        {"$set": cat_obj.dict()}
-    )
-    if result.modified_count == 0:
+    usuario = await usuario_com_categorias(usuario)
+    gravada = await db.categorias.find_one({"id": cat_id, "user_id": usuario["id"]}, {"_id": 0, "removida": 1})
+    if (gravada is None and cat_id not in ids_do_modelo(usuario)) or (gravada and gravada.get("removida")):
         raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    await marcar_categorias_personalizadas(usuario)
+    # Categoria do modelo ainda não alterada: o upsert grava a versão do usuário
+    await db.categorias.update_one(
+        {"id": cat_id, "user_id": usuario["id"]},
+        {"$set": cat_obj.dict()},
+        upsert=True
+    )
+    await registrar_alteracao(usuario["id"])
     return cat_obj
 
 @api_router.delete("/categorias/{cat_id}")
 async def deletar_categoria(cat_id: str, usuario: dict = Depends(get_current_user)):
-    result = await db.categorias.delete_one({"id": cat_id, "user_id": usuario["id"]})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    usuario = await usuario_com_categorias(usuario)
+    if cat_id in ids_do_modelo(usuario):
+        # Do modelo: fica uma marca de exclusão para a categoria não reaparecer
+        gravada = await db.categorias.find_one({"id": cat_id, "user_id": usuario["id"]}, {"_id": 0, "removida": 1})
+        if gravada and gravada.get("removida"):
+            raise HTTPException(status_code=404, detail="Categoria não encontrada")
+        await marcar_categorias_personalizadas(usuario)
+        await db.categorias.replace_one(
+            {"id": cat_id, "user_id": usuario["id"]},
+            {"id": cat_id, "user_id": usuario["id"], "removida": True},
+            upsert=True
+        )
+    else:
+        result = await db.categorias.delete_one({"id": cat_id, "user_id": usuario["id"]})
+        if result.deleted_count == 0:
+            raise HTTPException(status_code=404, detail="Categoria não encontrada")
+    await registrar_alteracao(usuario["id"])
     return {"message": "Categoria deletada com sucesso"}
 
 
 # ========== RECEITAS ENDPOINTS ==========
 
 @api_router.get("/receitas", response_model=List[Receita])
-async def listar_receitas(mes: Optional[int] = None, ano: Optional[int] = None, usuario: dict = Depends(get_current_user)):
-    filtro = {"user_id": usuario["id"]}
-    if mes:
-        filtro["mes"] = mes
-    if ano:
-        filtro["ano"] = ano
-    receitas = await db.receitas.find(filtro).to_list(1000)
-    return [Receita(**rec) for rec in receitas]
+async def listar_receitas(
+    mes: Optional[int] = None,
+    ano: Optional[int] = None,
+    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None,  # formato: YYYY-MM-DD
+    categoria: Optional[str] = None,
+    usuario: dict = Depends(get_current_user)
+):
+    filtro = montar_filtro_transacoes(usuario["id"], mes, ano, data_inicio, data_fim, categoria)
+    if FAST_JSON:
+        return await listar_rapido(db.receitas, filtro, PROJECAO_RECEITA)
+    cursor = db.receitas.find(filtro, batch_size=MONGO_BATCH_SIZE)
+    return [Receita(**rec) async for rec in cursor]
+
+@api_router.get("/receitas/pagina", response_model=PaginaReceitas)
+async def listar_receitas_paginado(
+    limite: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None,  # formato: YYYY-MM-DD
+    categoria: Optional[str] = None,
+    usuario: dict = Depends(get_current_user)
+):
+    """Lista receitas por páginas (mais recentes primeiro) usando cursor por data + id"""
+    filtro = montar_filtro_transacoes(usuario["id"], data_inicio=data_inicio, data_fim=data_fim, categoria=categoria)
+    if FAST_JSON:
+        return await pagina_rapida(db.receitas, filtro, limite, cursor, PROJECAO_RECEITA)
+    itens, proximo = await listar_pagina(db.receitas, filtro, limite, cursor)
+    return {"itens": itens, "proximo": proximo}
 
 @api_router.post("/receitas", response_model=Receita)
 async def criar_receita(input: ReceitaCreate, usuario: dict = Depends(get_current_user)):
@@ -463,7 +1533,9 @@ async def criar_receita(input: ReceitaCreate, usuario: dict = Depends(get_curren
     rec_dict["ano"] = ano
     rec_dict["user_id"] = usuario["id"]
     rec_obj = Receita(**rec_dict)
-    await db.receitas.insert_one(rec_obj.dict())
+    await db.receitas.insert_one(documento_lancamento(rec_obj))
+    await atualizar_resumo(usuario["id"], "receita", rec_dict)
+    await registrar_alteracao(usuario["id"])
     return rec_obj
 
 @api_router.put("/receitas/{rec_id}", response_model=Receita)
@@ -475,30 +1547,55 @@ async def atualizar_receita(rec_id: str, input: ReceitaCreate, usuario: dict = D
     rec_dict["id"] = rec_id
     rec_dict["user_id"] = usuario["id"]
     rec_obj = Receita(**rec_dict)
-    result = await db.receitas.update_one({"id": rec_id, "user_id": usuario["id"]}, {"$set": rec_obj.dict()})
-    if result.modified_count == 0:
+    anterior = await db.receitas.find_one_and_update({"id": rec_id, "user_id": usuario["id"]}, {"$set": documento_lancamento(rec_obj)})
+    if not anterior:
         raise HTTPException(status_code=404, detail="Receita não encontrada")
+    await substituir_no_resumo(usuario["id"], "receita", anterior, rec_dict)
+    await registrar_alteracao(usuario["id"])
     return rec_obj
 
 @api_router.delete("/receitas/{rec_id}")
 async def deletar_receita(rec_id: str, usuario: dict = Depends(get_current_user)):
-    result = await db.receitas.delete_one({"id": rec_id, "user_id": usuario["id"]})
-    if result.deleted_count == 0:
+    anterior = await db.receitas.find_one_and_delete({"id": rec_id, "user_id": usuario["id"]})
+    if not anterior:
         raise HTTPException(status_code=404, detail="Receita não encontrada")
+    await atualizar_resumo(usuario["id"], "receita", anterior, -1)
+    await registrar_alteracao(usuario["id"])
     return {"message": "Receita deletada com sucesso"}
 
 
 # ========== DESPESAS ENDPOINTS ==========
 
 @api_router.get("/despesas", response_model=List[Despesa])
-async def listar_despesas(mes: Optional[int] = None, ano: Optional[int] = None, usuario: dict = Depends(get_current_user)):
-    filtro = {"user_id": usuario["id"]}
-    if mes:
-        filtro["mes"] = mes
-    if ano:
-        filtro["ano"] = ano
-    despesas = await db.despesas.find(filtro).to_list(1000)
-    return [Despesa(**desp) for desp in despesas]
+async def listar_despesas(
+    mes: Optional[int] = None,
+    ano: Optional[int] = None,
+    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None,  # formato: YYYY-MM-DD
+    categoria: Optional[str] = None,
+    usuario: dict = Depends(get_current_user)
+):
+    filtro = montar_filtro_transacoes(usuario["id"], mes, ano, data_inicio, data_fim, categoria)
+    if FAST_JSON:
+        return await listar_rapido(db.despesas, filtro, PROJECAO_DESPESA)
+    cursor = db.despesas.find(filtro, batch_size=MONGO_BATCH_SIZE)
+    return [Despesa(**desp) async for desp in cursor]
+
+@api_router.get("/despesas/pagina", response_model=PaginaDespesas)
+async def listar_despesas_paginado(
+    limite: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None,  # formato: YYYY-MM-DD
+    categoria: Optional[str] = None,
+    usuario: dict = Depends(get_current_user)
+):
+    """Lista despesas por páginas (mais recentes primeiro) usando cursor por data + id"""
+    filtro = montar_filtro_transacoes(usuario["id"], data_inicio=data_inicio, data_fim=data_fim, categoria=categoria)
+    if FAST_JSON:
+        return await pagina_rapida(db.despesas, filtro, limite, cursor, PROJECAO_DESPESA)
+    itens, proximo = await listar_pagina(db.despesas, filtro, limite, cursor)
+    return {"itens": itens, "proximo": proximo}
 
 @api_router.post("/despesas", response_model=Despesa)
 async def criar_despesa(input: DespesaCreate, usuario: dict = Depends(get_current_user)):
@@ -508,7 +1605,9 @@ async def criar_despesa(input: DespesaCreate, usuario: dict = Depends(get_curren
     desp_dict["ano"] = ano
     desp_dict["user_id"] = usuario["id"]
     desp_obj = Despesa(**desp_dict)
-    await db.despesas.insert_one(desp_obj.dict())
+    await db.despesas.insert_one(documento_lancamento(desp_obj))
+    await atualizar_resumo(usuario["id"], "despesa", desp_dict)
+    await registrar_alteracao(usuario["id"])
     return desp_obj
 
 @api_router.put("/despesas/{desp_id}", response_model=Despesa)
@@ -520,88 +1619,588 @@ async def atualizar_despesa(desp_id: str, input: DespesaCreate, usuario: dict =
     desp_dict["id"] = desp_id
     desp_dict["user_id"] = usuario["id"]
     desp_obj = Despesa(**desp_dict)
-    result = await db.despesas.update_one({"id": desp_id, "user_id": usuario["id"]}, {"$set": desp_obj.dict()})
-    if result.modified_count == 0:
+    anterior = await db.despesas.find_one_and_update({"id": desp_id, "user_id": usuario["id"]}, {"$set": documento_lancamento(desp_obj)})
+    if not anterior:
         raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    await substituir_no_resumo(usuario["id"], "despesa", anterior, desp_dict)
+    await registrar_alteracao(usuario["id"])
     return desp_obj
 
 @api_router.delete("/despesas/{desp_id}")
 async def deletar_despesa(desp_id: str, usuario: dict = Depends(get_current_user)):
-    result = await db.despesas.delete_one({"id": desp_id, "user_id": usuario["id"]})
-    if result.deleted_count == 0:
+    anterior = await db.despesas.find_one_and_delete({"id": desp_id, "user_id": usuario["id"]})
+    if not anterior:
         raise HTTPException(status_code=404, detail="Despesa não encontrada")
+    await atualizar_resumo(usuario["id"], "despesa", anterior, -1)
+    await registrar_alteracao(usuario["id"])
     return {"message": "Despesa deletada com sucesso"}
 
 
-# ========== DASHBOARD & RESUMOS ==========
+# ========== IMPORTAÇÃO EM LOTE ==========
 
-@api_router.get("/dashboard")
-async def obter_dashboard(
-    usuario: dict = Depends(get_current_user),
-    periodo: Optional[str] = None,  # "total", "ultimo_mes", "ultimos_6_meses", "customizado"
-    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
-    data_fim: Optional[str] = None  # formato: YYYY-MM-DD
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '1000'))
+IMPORT_MAX_ERROS = 1000  # erros detalhados na resposta; o total é sempre informado
+
+CAMPOS_FORMA = {"receita": "forma_recebimento", "despesa": "forma_pagamento"}
+MODELOS_LANCAMENTO = {"receita": Receita, "despesa": Despesa}
+FORMATOS_DATA_IMPORTACAO = ["%d/%m/%Y"]
+
+def ler_valor(bruto) -> float:
+    """Converte valores como 1234.56, "1.234,56", "1,234.56" ou "R$ 10,00" em float
+    
+    Com os dois separadores, o último é o decimal. Com um só, ele é decimal, a
+    menos que se repita ("1.234.567", "1,234,567").
+    """
+    if isinstance(bruto, (int, float)):
+        return float(bruto)
+    texto = str(bruto or "").replace("R$", "").replace(" ", "")
+    virgula, ponto = texto.rfind(","), texto.rfind(".")
+    if virgula != -1 and ponto != -1:
+        milhar, decimal = (".", ",") if virgula > ponto else (",", ".")
+    elif texto.count(",") > 1 or texto.count(".") > 1:
+        milhar, decimal = ("," if virgula != -1 else "."), None
+    else:
+        milhar, decimal = None, ","
+    if milhar:
+        texto = texto.replace(milhar, "")
+    if decimal:
+        texto = texto.replace(decimal, ".")
+    return float(texto)
+
+def ler_data_importacao(bruto) -> datetime:
+    texto = str(bruto).strip()
+    if len(texto) == 10 and texto[4] == "-":
+        try:
+            return datetime.fromisoformat(texto)  # bem mais rápido que strptime
+        except ValueError:
+            pass
+    for formato in FORMATOS_DATA_IMPORTACAO:
+        try:
+            return datetime.strptime(texto, formato)
+        except ValueError:
+            continue
+    raise ValueError(f"data inválida: {bruto!r}")
+
+def linhas_csv(arquivo):
+    """Lê o CSV linha a linha; aceita ',' ou ';' como separador"""
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig", newline="")
+    amostra = texto.readline()
+    separador = ";" if amostra.count(";") > amostra.count(",") else ","
+    cabecalho = [coluna.strip().lower() for coluna in next(csv.reader([amostra], delimiter=separador))]
+    for valores in csv.reader(texto, delimiter=separador):
+        if any(v.strip() for v in valores):
+            yield dict(zip(cabecalho, valores))
+
+IMPORT_BLOCO = 64 * 1024  # caracteres lidos por vez em arrays JSON e arquivos OFX
+
+def itens_array_json(texto):
+    """Itens de um array JSON (o "[" já foi lido), decodificados um a um sem carregar o arquivo"""
+    decoder = json.JSONDecoder()
+    buffer, fim_arquivo, espera_virgula = "", False, False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith("]"):
+            return
+        if espera_virgula and buffer:
+            if not buffer.startswith(","):
+                raise ValueError("Array JSON inválido: esperado ',' entre os itens")
+            buffer = buffer[1:].lstrip()
+            espera_virgula = False
+        try:
+            item, fim = decoder.raw_decode(buffer)
+            # Um número no fim do buffer pode continuar no próximo bloco
+            if fim < len(buffer) or fim_arquivo:
+                buffer = buffer[fim:]
+                espera_virgula = True
+                yield item
+                continue
+        except json.JSONDecodeError:
+            if fim_arquivo:
+                raise
+        bloco = texto.read(IMPORT_BLOCO)
+        fim_arquivo = not bloco
+        buffer += bloco
+
+def linhas_json(arquivo):
+    """Aceita um array JSON ou JSON Lines (um objeto por linha), lidos sem carregar o arquivo inteiro"""
+    texto = io.TextIOWrapper(arquivo, encoding="utf-8-sig")
+    primeiro = texto.read(1)
+    while primeiro.isspace():
+        primeiro = texto.read(1)
+    if primeiro == "[":
+        yield from itens_array_json(texto)
+        return
+    yield json.loads(primeiro + texto.readline())
+    for linha in texto:
+        if linha.strip():
+            yield json.loads(linha)
+
+# Tags do OFX: <TAG>valor (SGML) ou <TAG>valor</TAG> (XML), com ou sem quebras de linha
+TAG_OFX = re.compile(r"<(/?)([A-Za-z0-9._]+)>([^<]*)")
+
+def tags_ofx(texto):
+    """(fechamento, TAG, valor) de cada tag do arquivo, lido em blocos"""
+    resto = ""
+    for bloco in iter(lambda: texto.read(IMPORT_BLOCO), ""):
+        resto += bloco
+        corte = resto.rfind("<")
+        if corte == -1:
+            resto = ""  # cabeçalho SGML ou texto fora de tags
+            continue
+        # O valor da última tag pode continuar no próximo bloco
+        for m in TAG_OFX.finditer(resto, 0, corte):
+            yield m.group(1) == "/", m.group(2).upper(), html.unescape(m.group(3).strip())
+        resto = resto[corte:]
+    for m in TAG_OFX.finditer(resto):
+        yield m.group(1) == "/", m.group(2).upper(), html.unescape(m.group(3).strip())
+
+def transacao_ofx(campos: dict) -> dict:
+    bruto = campos.get("TRNAMT", "")
+    try:
+        valor = ler_valor(bruto)
+    except ValueError:
+        valor = None  # segue bruto para a validação registrar o erro na linha
+    return {
+        "tipo": "receita" if valor is not None and valor >= 0 else "despesa",
+        "data": campos.get("DTPOSTED", "")[:8],
+        "descricao": campos.get("MEMO") or campos.get("NAME") or "",
+        "valor": bruto if valor is None else abs(valor),
+    }
+
+def encoding_ofx(arquivo) -> str:
+    """UTF-8 se o cabeçalho declarar (ou for XML sem declaração, o padrão do OFX 2.x); senão latin-1"""
+    cabecalho = arquivo.read(1024).decode("latin-1").upper()
+    arquivo.seek(0)
+    if re.search(r'ENCODING\s*[:=]\s*"?UTF-?8', cabecalho):
+        return "utf-8"
+    if cabecalho.lstrip().startswith("<?XML") and "ENCODING=" not in cabecalho.split("?>")[0]:
+        return "utf-8"
+    return "latin-1"
+
+def linhas_ofx(arquivo):
+    """Extrai as transações (<STMTTRN>) de um extrato OFX; o sinal do valor define o tipo"""
+    texto = io.TextIOWrapper(arquivo, encoding=encoding_ofx(arquivo), errors="replace")
+    campos = None
+    for fechamento, tag, valor in tags_ofx(texto):
+        if tag == "STMTTRN":
+            if campos is not None:  # fechamento, ou nova transação sem fechar a anterior
+                yield transacao_ofx(campos)
+            campos = None if fechamento else {}
+        elif campos is not None and not fechamento:
+            campos[tag] = valor
+    if campos is not None:
+        yield transacao_ofx(campos)
+
+LEITORES_IMPORTACAO = {"csv": linhas_csv, "json": linhas_json, "jsonl": linhas_json, "ofx": linhas_ofx}
+
+def validar_linha_importacao(linha: dict, tipo_padrao: Optional[str], user_id: str):
+    """Converte uma linha importada no documento de receita/despesa"""
+    tipo = str(linha.get("tipo") or tipo_padrao or "").strip().lower()
+    tipo = tipo[:-1] if tipo.endswith("s") else tipo  # aceita "receitas"/"despesas"
+    if tipo not in CAMPOS_FORMA:
+        raise ValueError("tipo deve ser 'receita' ou 'despesa'")
+    
+    data = linha.get("data", "")
+    if len(str(data)) == 8 and str(data).isdigit():  # OFX: YYYYMMDD
+        data = f"{data[:4]}-{data[4:6]}-{data[6:]}"
+    data = ler_data_importacao(data)
+    
+    campo_forma = CAMPOS_FORMA[tipo]
+    obj = MODELOS_LANCAMENTO[tipo](
+        user_id=user_id,
+        data=data.strftime("%Y-%m-%d"),
+        descricao=str(linha.get("descricao") or "").strip(),
+        categoria=str(linha.get("categoria") or "Outros").strip(),
+        valor=ler_valor(linha.get("valor")),
+        mes=data.month,
+        ano=data.year,
+        **{campo_forma: str(linha.get(campo_forma) or linha.get("forma") or "Importado").strip()}
+    )
+    # Data já validada: evita o segundo parse de documento_lancamento
+    doc = obj.dict()
+    doc["data_lancamento"] = data
+    return tipo, doc
+
+async def gravar_lote_importacao(user_id: str, tipo: str, lote: list, relatorio: dict):
+    """Grava um lote com insert_many não ordenado e atualiza os resumos mensais"""
+    if not lote:
+        return
+    falhas = {}
+    try:
+        await db[COLECOES_POR_TIPO[tipo]].insert_many([doc for _, doc in lote], ordered=False)
+    except BulkWriteError as e:
+        falhas = {erro["index"]: erro.get("errmsg", "erro de gravação") for erro in e.details.get("writeErrors", [])}
+    
+    incrementos = {}
+    for indice, (numero, doc) in enumerate(lote):
+        if indice in falhas:
+            registrar_erro_importacao(relatorio, numero, falhas[indice])
+            continue
+        somar_incremento(incrementos, chave_resumo(user_id, tipo, doc), doc["valor"], 1)
+    relatorio["importados"] += len(lote) - len(falhas)
+    await aplicar_incrementos(incrementos)
+
+def registrar_erro_importacao(relatorio: dict, numero: int, mensagem: str):
+    relatorio["total_erros"] += 1
+    if len(relatorio["erros"]) < IMPORT_MAX_ERROS:
+        relatorio["erros"].append({"linha": numero, "erro": mensagem})
+
+@api_router.post("/importacao")
+async def importar_lancamentos(
+    arquivo: UploadFile = File(...),
+    formato: Optional[str] = None,  # csv, ofx, json ou jsonl; padrão: extensão do arquivo
+    tipo: Optional[str] = None,  # receita/despesa, para arquivos sem coluna "tipo"
+    usuario: dict = Depends(get_current_user)
 ):
-    """Retorna dados agregados para o dashboard com filtros de data"""
-    from datetime import datetime, timedelta
+    """Importa receitas e despesas em lote a partir de CSV, OFX ou JSON
     
-    # Determinar o filtro baseado no período
-    filtro = {}
+    Colunas: data (YYYY-MM-DD ou DD/MM/AAAA), descricao, categoria, valor,
+    forma_recebimento/forma_pagamento e, opcionalmente, tipo.
+    """
+    formato = (formato or Path(arquivo.filename or "").suffix.lstrip(".")).lower()
+    leitor = LEITORES_IMPORTACAO.get(formato)
+    if not leitor:
+        raise HTTPException(status_code=400, detail="Formato inválido (use csv, ofx ou json)")
+    
+    relatorio = {"importados": 0, "total_erros": 0, "erros": []}
+    lotes = {"receita": [], "despesa": []}
+    
+    linhas = leitor(arquivo.file)
+    numero = 0
+    while True:
+        numero += 1
+        try:
+            linha = next(linhas)
+        except StopIteration:
+            break
+        except (ValueError, UnicodeDecodeError) as e:
+            # Arquivo malformado: não há como continuar a leitura
+            registrar_erro_importacao(relatorio, numero, f"arquivo inválido: {e}")
+            break
+        
+        try:
+            tipo_linha, doc = validar_linha_importacao(linha, tipo, usuario["id"])
+        except (ValueError, TypeError, AttributeError, ValidationError) as e:
+            registrar_erro_importacao(relatorio, numero, str(e))
+            continue
+        
+        lotes[tipo_linha].append((numero, doc))
+        if len(lotes[tipo_linha]) >= IMPORT_BATCH_SIZE:
+            await gravar_lote_importacao(usuario["id"], tipo_linha, lotes[tipo_linha], relatorio)
+            lotes[tipo_linha] = []
     
-    if periodo == "ultimo_mes":
-        # Último mês
-        hoje = datetime.now()
-        filtro["mes"] = hoje.month
-        filtro["ano"] = hoje.year
-    elif periodo == "ultimos_6_meses":
-        # Últimos 6 meses - vamos filtrar depois
-        pass
-    elif periodo == "customizado" and data_inicio and data_fim:
-        # Range customizado - vamos filtrar depois
-        pass
-    # Se periodo == "total" ou None, não filtra nada
+    for tipo_linha, lote in lotes.items():
+        await gravar_lote_importacao(usuario["id"], tipo_linha, lote, relatorio)
     
-    # Buscar todos os dados (vamos filtrar por data depois se necessário)
-    todas_receitas = await db.receitas.find({"user_id": usuario["id"]}).to_list(1000)
-    todas_despesas = await db.despesas.find({"user_id": usuario["id"]}).to_list(1000)
+    if relatorio["importados"]:
+        await registrar_alteracao(usuario["id"])
+    return relatorio
+
+
+# ========== OPERAÇÕES EM LOTE ==========
+
+class FiltroLote(BaseModel):
+    ids: Optional[List[str]] = None
+    categoria: Optional[str] = None
+    data_inicio: Optional[str] = None  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None  # formato: YYYY-MM-DD
+
+class AlteracoesLote(BaseModel):
+    data: Optional[str] = None
+    descricao: Optional[str] = None
+    categoria: Optional[str] = None
+    forma_recebimento: Optional[str] = None  # apenas receitas
+    forma_pagamento: Optional[str] = None  # apenas despesas
+    valor: Optional[float] = None
+
+class AtualizacaoLote(BaseModel):
+    filtro: FiltroLote
+    alteracoes: AlteracoesLote
+
+def montar_filtro_lote(user_id: str, filtro: FiltroLote) -> dict:
+    """Filtro do MongoDB para uma operação em lote; exige ids ou algum critério"""
+    if filtro.ids is None and not (filtro.categoria or filtro.data_inicio or filtro.data_fim):
+        raise HTTPException(status_code=400, detail="Informe ids ou um filtro (categoria, data_inicio, data_fim)")
+    consulta = montar_filtro_transacoes(
+        user_id,
+        data_inicio=filtro.data_inicio,
+        data_fim=filtro.data_fim,
+        categoria=filtro.categoria
+    )
+    if filtro.ids is not None:
+        consulta["id"] = {"$in": filtro.ids}
+    return consulta
+
+# ids por UpdateMany/DeleteMany: mantém o filtro $in bem abaixo do limite de 16 MB
+LOTE_IDS = 10000
+CAMPOS_CAPTURA_LOTE = {"_id": 0, "id": 1, "mes": 1, "ano": 1, "categoria": 1, "valor": 1}
+
+_suporta_transacoes = None
+
+async def suporta_transacoes() -> bool:
+    """Transações exigem replica set ou cluster shardado (o Atlas sempre é um deles)"""
+    global _suporta_transacoes
+    if _suporta_transacoes is None:
+        try:
+            hello = await client.admin.command("hello")
+        except Exception:
+            return False  # tenta de novo na próxima operação
+        _suporta_transacoes = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+    return _suporta_transacoes
+
+async def executar_atomico(operacao):
+    """Executa operacao(sessao) em uma transação quando o deploy suporta; senão com sessao=None"""
+    if not await suporta_transacoes():
+        return await operacao(None)
+    async with await client.start_session() as sessao:
+        return await sessao.with_transaction(operacao)
+
+async def capturar_lote(colecao, consulta: dict, sessao) -> List[dict]:
+    """id e campos dos resumos de cada lançamento afetado, lidos uma única vez"""
+    return await colecao.find(consulta, CAMPOS_CAPTURA_LOTE, session=sessao, batch_size=MONGO_BATCH_SIZE).to_list(None)
+
+def filtros_por_ids(user_id: str, capturados: List[dict]) -> List[dict]:
+    ids = [doc["id"] for doc in capturados]
+    return [{"user_id": user_id, "id": {"$in": ids[i:i + LOTE_IDS]}} for i in range(0, len(ids), LOTE_IDS)]
+
+async def atualizar_lote(tipo: str, entrada: AtualizacaoLote, user_id: str) -> dict:
+    """Aplica as mesmas alterações a vários lançamentos com um único bulk_write
+    
+    Escrita e incrementos dos resumos partem do mesmo conjunto capturado de
+    lançamentos, então um lançamento criado no meio da operação não é movido nos
+    resumos sem ter sido alterado (nem o contrário). Com transações disponíveis,
+    captura, escrita e resumos são atômicas.
+    """
+    colecao = db[COLECOES_POR_TIPO[tipo]]
+    consulta = montar_filtro_lote(user_id, entrada.filtro)
     
-    # Aplicar filtros de data customizada
-    if periodo == "ultimos_6_meses":
-        hoje = datetime.now()
-        data_limite = hoje - timedelta(days=180)
-        todas_receitas = [r for r in todas_receitas if datetime.strptime(r.get("data"), "%Y-%m-%d") >= data_limite]
-        todas_despesas = [d for d in todas_despesas if datetime.strptime(d.get("data"), "%Y-%m-%d") >= data_limite]
-    elif periodo == "customizado" and data_inicio and data_fim:
-        dt_inicio = datetime.strptime(data_inicio, "%Y-%m-%d")
-        dt_fim = datetime.strptime(data_fim, "%Y-%m-%d")
-        todas_receitas = [r for r in todas_receitas if dt_inicio <= datetime.strptime(r.get("data"), "%Y-%m-%d") <= dt_fim]
-        todas_despesas = [d for d in todas_despesas if dt_inicio <= datetime.strptime(d.get("data"), "%Y-%m-%d") <= dt_fim]
-    elif periodo == "ultimo_mes":
-        todas_receitas = [r for r in todas_receitas if r.get("mes") == filtro.get("mes") and r.get("ano") == filtro.get("ano")]
-        todas_despesas = [d for d in todas_despesas if d.get("mes") == filtro.get("mes") and d.get("ano") == filtro.get("ano")]
-    
-    total_receitas = sum(r.get("valor", 0) for r in todas_receitas)
-    total_despesas = sum(d.get("valor", 0) for d in todas_despesas)
+    campos_outro_tipo = {campo for t, campo in CAMPOS_FORMA.items() if t != tipo}
+    alteracoes = {
+        campo: valor for campo, valor in entrada.alteracoes.dict().items()
+        if valor is not None and campo not in campos_outro_tipo
+    }
+    if not alteracoes:
+        raise HTTPException(status_code=400, detail="Nenhuma alteração informada")
+    if "data" in alteracoes:
+        data = ler_data_filtro(alteracoes["data"])
+        # Mesmo formato das escritas individuais e da importação (ex.: "2024-3-9" -> "2024-03-09")
+        alteracoes.update(data=data.strftime("%Y-%m-%d"), mes=data.month, ano=data.year, data_lancamento=data)
+    
+    async def operacao(sessao):
+        if not {"categoria", "valor", "mes"} & set(alteracoes):
+            # Os resumos não mudam: não há o que capturar
+            result = await colecao.bulk_write([UpdateMany(consulta, {"$set": alteracoes})], session=sessao)
+            return result.matched_count, result.modified_count
+        
+        capturados = await capturar_lote(colecao, consulta, sessao)
+        if not capturados:
+            return 0, 0
+        result = await colecao.bulk_write(
+            [UpdateMany(filtro, {"$set": alteracoes}) for filtro in filtros_por_ids(user_id, capturados)],
+            session=sessao
+        )
+        incrementos = {}
+        for doc in capturados:
+            valor = doc.get("valor", 0)
+            somar_incremento(incrementos, chave_resumo(user_id, tipo, doc), -valor, -1)
+            somar_incremento(incrementos, chave_resumo(user_id, tipo, {**doc, **alteracoes}), alteracoes.get("valor", valor), 1)
+        await aplicar_incrementos(incrementos, sessao)
+        return result.matched_count, result.modified_count
+    
+    encontrados, modificados = await executar_atomico(operacao)
+    if modificados:
+        await registrar_alteracao(user_id)
+    return {"encontrados": encontrados, "modificados": modificados}
+
+async def excluir_lote(tipo: str, filtro: FiltroLote, user_id: str) -> dict:
+    """Exclui vários lançamentos com um único bulk_write (ver atualizar_lote)"""
+    colecao = db[COLECOES_POR_TIPO[tipo]]
+    consulta = montar_filtro_lote(user_id, filtro)
+    
+    async def operacao(sessao):
+        capturados = await capturar_lote(colecao, consulta, sessao)
+        if not capturados:
+            return 0
+        result = await colecao.bulk_write(
+            [DeleteMany(filtro) for filtro in filtros_por_ids(user_id, capturados)],
+            session=sessao
+        )
+        incrementos = {}
+        for doc in capturados:
+            somar_incremento(incrementos, chave_resumo(user_id, tipo, doc), -doc.get("valor", 0), -1)
+        await aplicar_incrementos(incrementos, sessao)
+        return result.deleted_count
+    
+    excluidos = await executar_atomico(operacao)
+    if excluidos:
+        await registrar_alteracao(user_id)
+    return {"excluidos": excluidos}
+
+@api_router.patch("/receitas/lote")
+async def atualizar_receitas_lote(entrada: AtualizacaoLote, usuario: dict = Depends(get_current_user)):
+    """Atualiza várias receitas (por ids ou filtro) de uma vez"""
+    return await atualizar_lote("receita", entrada, usuario["id"])
+
+@api_router.post("/receitas/lote/excluir")
+async def excluir_receitas_lote(filtro: FiltroLote, usuario: dict = Depends(get_current_user)):
+    """Exclui várias receitas (por ids ou filtro) de uma vez"""
+    return await excluir_lote("receita", filtro, usuario["id"])
+
+@api_router.patch("/despesas/lote")
+async def atualizar_despesas_lote(entrada: AtualizacaoLote, usuario: dict = Depends(get_current_user)):
+    """Atualiza várias despesas (por ids ou filtro) de uma vez"""
+    return await atualizar_lote("despesa", entrada, usuario["id"])
+
+@api_router.post("/despesas/lote/excluir")
+async def excluir_despesas_lote(filtro: FiltroLote, usuario: dict = Depends(get_current_user)):
+    """Exclui várias despesas (por ids ou filtro) de uma vez"""
+    return await excluir_lote("despesa", filtro, usuario["id"])
+
+
+# ========== PROJEÇÕES ==========
+
+# Abaixo disso a tendência fica plana (média) e não há fatores sazonais
+PROJECAO_MIN_MESES_TENDENCIA = 3
+PROJECAO_MIN_MESES_SAZONAL = 24  # dois ciclos completos de 12 meses
+PROJECAO_Z = 1.96  # faixa de ~95%
+
+def indice_mes(mes: int, ano: int) -> int:
+    return ano * 12 + mes - 1
+
+def mes_do_indice(indice: int):
+    """(mes, ano) de um índice criado por indice_mes"""
+    return indice % 12 + 1, indice // 12
+
+async def carregar_series_mensais(user_id: str) -> List[dict]:
+    """Totais mensais por tipo/categoria, lidos de resumos_mensais"""
+    return await leitura().resumos_mensais.find(
+        {"user_id": user_id, "quantidade": {"$gt": 0}, "mes": {"$ne": None}, "ano": {"$ne": None}},
+        {"_id": 0, "tipo": 1, "categoria": 1, "mes": 1, "ano": 1, "valor": 1},
+        batch_size=MONGO_BATCH_SIZE
+    ).to_list(None)
+
+def montar_matriz_mensal(series: List[dict]):
+    """Matriz (tipo/categoria × mês) contínua do primeiro ao último mês com dados
+    
+    Meses sem lançamento na categoria ficam com zero.
+    """
+    indices = np.array([indice_mes(s["mes"], s["ano"]) for s in series])
+    inicio = int(indices.min())
+    categorias = sorted({(s["tipo"], s.get("categoria") or "Outros") for s in series})
+    linha_de = {chave: i for i, chave in enumerate(categorias)}
+    linhas = np.array([linha_de[(s["tipo"], s.get("categoria") or "Outros")] for s in series])
+    valores = np.zeros((len(categorias), int(indices.max()) - inicio + 1))
+    np.add.at(valores, (linhas, indices - inicio), np.array([s.get("valor", 0) for s in series], dtype=float))
+    return inicio, categorias, valores
+
+def projetar_series(valores: np.ndarray, inicio: int, horizonte: int) -> dict:
+    """Projeta `horizonte` meses para cada linha de `valores` (séries × meses)
+    
+    Modelo aditivo ajustado em todas as séries de uma vez: tendência linear por
+    mínimos quadrados + fator sazonal por mês do ano (com >= 24 meses). A faixa é
+    o intervalo de predição da regressão com o desvio dos resíduos.
+    """
+    series, n = valores.shape
+    t = np.arange(n, dtype=float)
+    futuro = np.arange(n, n + horizonte, dtype=float)
+    media = valores.mean(axis=1, keepdims=True)
+    
+    if n >= PROJECAO_MIN_MESES_TENDENCIA:
+        t_medio = t.mean()
+        sxx = ((t - t_medio) ** 2).sum()
+        inclinacao = ((valores - media) * (t - t_medio)).sum(axis=1, keepdims=True) / sxx
+        intercepto = media - inclinacao * t_medio
+        parametros = 2
+    else:
+        t_medio, sxx = 0.0, np.inf
+        inclinacao = np.zeros((series, 1))
+        intercepto = media
+        parametros = 1
+    ajuste = intercepto + inclinacao * t
+    residuos = valores - ajuste
+    
+    # Fatores sazonais: média dos resíduos por mês do ano, centrada em zero
+    mes_do_ano = (inicio + np.arange(n + horizonte)) % 12
+    sazonal = n >= PROJECAO_MIN_MESES_SAZONAL
+    fatores = np.zeros((series, 12))
+    if sazonal:
+        uma_quente = np.eye(12)[mes_do_ano[:n]]  # (meses × 12)
+        fatores = (residuos @ uma_quente) / uma_quente.sum(axis=0)
+        fatores -= fatores.mean(axis=1, keepdims=True)
+        residuos = residuos - fatores[:, mes_do_ano[:n]]
+        parametros += 11
+    
+    graus_liberdade = max(n - parametros, 1)
+    desvio = np.sqrt((residuos ** 2).sum(axis=1, keepdims=True) / graus_liberdade)
+    alavanca = 1 + 1 / n + ((futuro - t_medio) ** 2 / sxx if np.isfinite(sxx) else np.zeros(horizonte))
+    margem = PROJECAO_Z * desvio * np.sqrt(alavanca)
+    
+    previsao = intercepto + inclinacao * futuro + fatores[:, mes_do_ano[n:]]
+    previsao = np.maximum(previsao, 0)
+    
+    return {
+        "valor": previsao,
+        "margem": margem,
+        "minimo": np.maximum(previsao - margem, 0),
+        "maximo": previsao + margem,
+        "inclinacao": inclinacao[:, 0],
+        "media_movel_3": valores[:, -3:].mean(axis=1),
+        "media_movel_6": valores[:, -6:].mean(axis=1),
+        "sazonal": sazonal,
+    }
+
+
+# ========== DASHBOARD & RESUMOS ==========
+
+async def calcular_dashboard(
+    user_id: str,
+    periodo: Optional[str] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None
+) -> dict:
+    """Dados agregados do dashboard com filtros de data"""
+    filtro = montar_filtro_periodo(user_id, periodo, data_inicio, data_fim)
+    
+    # Totais, categorias e série mensal calculados no MongoDB
+    agg_receitas = await leitura().receitas.aggregate([
+        {"$match": filtro},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, "valor": {"$sum": VALOR_OU_ZERO}}}],
+            "por_mes": PIPELINE_POR_MES,
+        }},
+    ]).to_list(1)
+    agg_despesas = await leitura().despesas.aggregate([
+        {"$match": filtro},
+        {"$facet": {
+            "total": [{"$group": {"_id": None, "valor": {"$sum": VALOR_OU_ZERO}}}],
+            "por_categoria": [
+                {"$group": {"_id": {"$ifNull": ["$categoria", "Outros"]}, "valor": {"$sum": VALOR_OU_ZERO}}},
+                {"$sort": {"valor": -1}},
+            ],
+            "por_mes": PIPELINE_POR_MES,
+        }},
+    ]).to_list(1)
+    rec = agg_receitas[0] if agg_receitas else {}
+    desp = agg_despesas[0] if agg_despesas else {}
+    
+    return montar_dashboard(
+        rec["total"][0]["valor"] if rec.get("total") else 0,
+        desp["total"][0]["valor"] if desp.get("total") else 0,
+        [(g["_id"], g["valor"]) for g in desp.get("por_categoria", [])],
+        {(g["_id"]["mes"], g["_id"]["ano"]): g["valor"] for g in rec.get("por_mes", [])},
+        {(g["_id"]["mes"], g["_id"]["ano"]): g["valor"] for g in desp.get("por_mes", [])},
+    )
+
+def montar_dashboard(total_receitas, total_despesas, por_categoria: list, recs_mes: dict, desps_mes: dict) -> dict:
+    """Resposta do dashboard a partir dos totais, das despesas por categoria e dos totais por (mes, ano)"""
     saldo = total_receitas - total_despesas
     percentual_economia = (saldo / total_receitas * 100) if total_receitas > 0 else 0
     
-    # Distribuição por categorias (despesas)
-    categorias_dist = {}
-    for d in todas_despesas:
-        cat = d.get("categoria", "Outros")
-        categorias_dist[cat] = categorias_dist.get(cat, 0) + d.get("valor", 0)
-    
     # Evolução mensal
-    meses_anos = set()
-    for r in todas_receitas:
-        meses_anos.add((r.get("mes"), r.get("ano")))
-    for d in todas_despesas:
-        meses_anos.add((d.get("mes"), d.get("ano")))
-    
     evolucao = []
-    for m, a in sorted(meses_anos):
-        recs = sum(r.get("valor", 0) for r in todas_receitas if r.get("mes") == m and r.get("ano") == a)
-        desps = sum(d.get("valor", 0) for d in todas_despesas if d.get("mes") == m and d.get("ano") == a)
+    for m, a in sorted(set(recs_mes) | set(desps_mes)):
+        recs = recs_mes.get((m, a), 0)
+        desps = desps_mes.get((m, a), 0)
         evolucao.append({
             "mes": m,
             "ano": a,
@@ -616,96 +2215,99 @@ async def obter_dashboard(
         "saldo": saldo,
         "percentual_economia": round(percentual_economia, 2),
         "lucro_prejuizo": "lucro" if saldo >= 0 else "prejuizo",
-        "categorias_distribuicao": [{"categoria": k, "valor": v} for k, v in categorias_dist.items()],
+        "categorias_distribuicao": [{"categoria": categoria, "valor": valor} for categoria, valor in por_categoria],
         "evolucao_mensal": evolucao
     }
 
-@api_router.get("/gastos-recorrentes")
-async def obter_gastos_recorrentes(usuario: dict = Depends(get_current_user)):
-    """Retorna análise de gastos recorrentes e frequentes"""
-    from collections import Counter
-    
-    despesas = await db.despesas.find({"user_id": usuario["id"]}).to_list(1000)
-    
-    if not despesas:
+async def calcular_gastos_recorrentes(user_id: str, top_n: int = 10, min_ocorrencias: int = 2) -> dict:
+    """Análise de gastos recorrentes e frequentes"""
+    # Por categoria o resultado é pequeno; por descrição pode ter uma linha por
+    # despesa (memos de banco quase sempre únicos), então vem por cursor em vez de
+    # um $facet, cujo resultado é um único documento limitado a 16 MB
+    despesas = leitura().despesas
+    por_categoria = await despesas.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": {"$ifNull": ["$categoria", "Outros"]},
+            "ocorrencias": {"$sum": 1},
+            "valor_total": {"$sum": VALOR_OU_ZERO},
+        }},
+    ]).to_list(None)
+    
+    if not por_categoria:
         return {
             "categorias_mais_frequentes": [],
             "descricoes_recorrentes": [],
             "media_por_categoria": []
         }
     
-    # Contar frequência por categoria
-    categorias_count = Counter(d.get("categoria") for d in despesas)
-    categorias_valores = {}
-    categorias_ocorrencias = {}
-    
-    for d in despesas:
-        cat = d.get("categoria", "Outros")
-        if cat not in categorias_valores:
-            categorias_valores[cat] = 0
-            categorias_ocorrencias[cat] = 0
-        categorias_valores[cat] += d.get("valor", 0)
-        categorias_ocorrencias[cat] += 1
-    
     # Categorias mais frequentes com valores
-    categorias_freq = []
-    for cat, count in categorias_count.most_common():
-        categorias_freq.append({
-            "categoria": cat,
-            "ocorrencias": count,
-            "valor_total": categorias_valores[cat],
-            "valor_medio": categorias_valores[cat] / count if count > 0 else 0
-        })
+    por_categoria.sort(key=lambda g: (-g["ocorrencias"], g["_id"]))
+    categorias_freq = [
+        {
+            "categoria": g["_id"],
+            "ocorrencias": g["ocorrencias"],
+            "valor_total": g["valor_total"],
+            "valor_medio": g["valor_total"] / g["ocorrencias"]
+        }
+        for g in por_categoria[:top_n]
+    ]
     
-    # Descrições que se repetem (gastos recorrentes)
-    descricoes_count = Counter(d.get("descricao").lower() for d in despesas)
-    descricoes_recorrentes = []
-    
-    for desc, count in descricoes_count.most_common(10):
-        if count > 1:  # Apenas descrições que aparecem mais de uma vez
-            valor_total = sum(d.get("valor", 0) for d in despesas if d.get("descricao").lower() == desc)
-            descricoes_recorrentes.append({
-                "descricao": desc.title(),
-                "ocorrencias": count,
-                "valor_total": valor_total,
-                "valor_medio": valor_total / count
-            })
-    
-    # Média de gasto por categoria
-    media_por_cat = []
-    for cat, total in categorias_valores.items():
-        count = categorias_ocorrencias[cat]
-        media_por_cat.append({
-            "categoria": cat,
-            "media_gasto": total / count if count > 0 else 0,
-            "total_gasto": total
-        })
+    # Descrições que se repetem (gastos recorrentes). O $toLower do MongoDB
+    # só trata ASCII, então a normalização de acentos é feita aqui, já sobre
+    # as descrições distintas e não sobre cada despesa.
+    descricoes = {}
+    async for g in despesas.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {
+            "_id": {"$ifNull": ["$descricao", ""]},
+            "ocorrencias": {"$sum": 1},
+            "valor_total": {"$sum": VALOR_OU_ZERO},
+        }},
+    ], allowDiskUse=True, batchSize=MONGO_BATCH_SIZE):
+        desc = g["_id"].lower()
+        ocorrencias, valor_total = descricoes.get(desc, (0, 0))
+        descricoes[desc] = (ocorrencias + g["ocorrencias"], valor_total + g["valor_total"])
+    
+    recorrentes = sorted(
+        ((desc, ocorrencias, total) for desc, (ocorrencias, total) in descricoes.items() if ocorrencias >= min_ocorrencias),
+        key=lambda item: (-item[1], item[0])
+    )
+    descricoes_recorrentes = [
+        {
+            "descricao": desc.title(),
+            "ocorrencias": ocorrencias,
+            "valor_total": valor_total,
+            "valor_medio": valor_total / ocorrencias
+        }
+        for desc, ocorrencias, valor_total in recorrentes[:top_n]
+    ]
     
-    # Ordenar por total gasto
-    media_por_cat.sort(key=lambda x: x["total_gasto"], reverse=True)
+    # Média de gasto por categoria, ordenada por total gasto
+    media_por_cat = [
+        {
+            "categoria": g["_id"],
+            "media_gasto": g["valor_total"] / g["ocorrencias"],
+            "total_gasto": g["valor_total"]
+        }
+        for g in sorted(por_categoria, key=lambda g: g["valor_total"], reverse=True)
+    ]
     
     return {
-        "categorias_mais_frequentes": categorias_freq[:10],
+        "categorias_mais_frequentes": categorias_freq,
         "descricoes_recorrentes": descricoes_recorrentes,
         "media_por_categoria": media_por_cat
     }
 
-@api_router.get("/resumo-mensal", response_model=List[ResumoMensal])
-async def obter_resumo_mensal(usuario: dict = Depends(get_current_user)):
-    """Retorna resumo de todos os meses"""
-    receitas = await db.receitas.find({"user_id": usuario["id"]}).to_list(1000)
-    despesas = await db.despesas.find({"user_id": usuario["id"]}).to_list(1000)
-    
-    meses_anos = set()
-    for r in receitas:
-        meses_anos.add((r.get("mes"), r.get("ano")))
-    for d in despesas:
-        meses_anos.add((d.get("mes"), d.get("ano")))
+async def calcular_resumo_mensal(user_id: str) -> List[ResumoMensal]:
+    """Resumo de todos os meses"""
+    recs_mes = await totais_por_mes("receita", user_id)
+    desps_mes = await totais_por_mes("despesa", user_id)
     
     resumos = []
-    for m, a in sorted(meses_anos):
-        total_rec = sum(r.get("valor", 0) for r in receitas if r.get("mes") == m and r.get("ano") == a)
-        total_desp = sum(d.get("valor", 0) for d in despesas if d.get("mes") == m and d.get("ano") == a)
+    for m, a in sorted(set(recs_mes) | set(desps_mes)):
+        total_rec = recs_mes.get((m, a), 0)
+        total_desp = desps_mes.get((m, a), 0)
         saldo = total_rec - total_desp
         perc = (saldo / total_rec * 100) if total_rec > 0 else 0
         
@@ -721,13 +2323,11 @@ async def obter_resumo_mensal(usuario: dict = Depends(get_current_user)):
     
     return resumos
 
-@api_router.get("/projecoes")
-async def obter_projecoes(usuario: dict = Depends(get_current_user)):
-    """Calcula projeções financeiras baseadas nas médias"""
-    receitas = await db.receitas.find({"user_id": usuario["id"]}).to_list(1000)
-    despesas = await db.despesas.find({"user_id": usuario["id"]}).to_list(1000)
+async def calcular_projecoes(user_id: str, horizonte: int = 6) -> dict:
+    """Projeções por categoria (tendência + sazonalidade) e totais do período"""
+    series = await carregar_series_mensais(user_id)
     
-    if not receitas and not despesas:
+    if not series:
         return {
             "media_receitas": 0,
             "media_despesas": 0,
@@ -741,366 +2341,694 @@ async def obter_projecoes(usuario: dict = Depends(get_current_user)):
                     "saldo_estimado": 0
                 }
                 for i in range(6)
-            ]
+            ],
+            "projecao": [],
+            "por_categoria": {"receita": [], "despesa": []},
         }
     
-    # Calcular médias dos últimos 3 meses
-    meses_anos = set()
-    for r in receitas:
-        meses_anos.add((r.get("mes"), r.get("ano")))
-    for d in despesas:
-        meses_anos.add((d.get("mes"), d.get("ano")))
-    
-    ultimos_meses = sorted(meses_anos)[-3:]
-    
-    total_rec = 0
-    total_desp = 0
-    for m, a in ultimos_meses:
-        total_rec += sum(r.get("valor", 0) for r in receitas if r.get("mes") == m and r.get("ano") == a)
-        total_desp += sum(d.get("valor", 0) for d in despesas if d.get("mes") == m and d.get("ano") == a)
+    inicio, categorias, valores = montar_matriz_mensal(series)
+    meses_futuros = [mes_do_indice(inicio + valores.shape[1] + h) for h in range(horizonte)]
+    
+    totais = {}
+    por_categoria = {}
+    for tipo in ("receita", "despesa"):
+        linhas = [i for i, (t, _) in enumerate(categorias) if t == tipo]
+        matriz = valores[linhas]
+        previsao = projetar_series(matriz, inicio, horizonte)
+        totais[tipo] = {
+            # Média dos últimos 3 meses do período (como sempre foi exibido)
+            "media": float(matriz.sum(axis=0)[-3:].mean()),
+            "valor": previsao["valor"].sum(axis=0),
+            # Bandas das categorias combinadas supondo erros independentes
+            "margem": np.sqrt((previsao["margem"] ** 2).sum(axis=0)),
+        }
+        por_categoria[tipo] = [
+            {
+                "categoria": categorias[linha][1],
+                "media_movel_3": round(float(previsao["media_movel_3"][k]), 2),
+                "media_movel_6": round(float(previsao["media_movel_6"][k]), 2),
+                "tendencia_mensal": round(float(previsao["inclinacao"][k]), 2),
+                "sazonal": bool(previsao["sazonal"]),
+                "previsao": [
+                    {
+                        "mes": mes,
+                        "ano": ano,
+                        "valor": round(float(previsao["valor"][k, h]), 2),
+                        "minimo": round(float(previsao["minimo"][k, h]), 2),
+                        "maximo": round(float(previsao["maximo"][k, h]), 2),
+                    }
+                    for h, (mes, ano) in enumerate(meses_futuros)
+                ],
+            }
+            for k, linha in enumerate(linhas)
+        ]
     
-    media_rec = total_rec / len(ultimos_meses) if ultimos_meses else 0
-    media_desp = total_desp / len(ultimos_meses) if ultimos_meses else 0
+    media_rec = totais["receita"]["media"]
+    media_desp = totais["despesa"]["media"]
     saldo_proj = media_rec - media_desp
-    
     tendencia = "crescimento" if saldo_proj > 0 else "declinio" if saldo_proj < 0 else "neutro"
     
+    projecao = []
+    for h, (mes, ano) in enumerate(meses_futuros):
+        rec = float(totais["receita"]["valor"][h])
+        desp = float(totais["despesa"]["valor"][h])
+        margem_rec = float(totais["receita"]["margem"][h])
+        margem_desp = float(totais["despesa"]["margem"][h])
+        projecao.append({
+            "mes": mes,
+            "ano": ano,
+            "receita_estimada": round(rec, 2),
+            "despesa_estimada": round(desp, 2),
+            "saldo_estimado": round(rec - desp, 2),
+            "receita_minima": round(max(rec - margem_rec, 0.0), 2),
+            "receita_maxima": round(rec + margem_rec, 2),
+            "despesa_minima": round(max(desp - margem_desp, 0.0), 2),
+            "despesa_maxima": round(desp + margem_desp, 2),
+        })
+    
     return {
         "media_receitas": round(media_rec, 2),
         "media_despesas": round(media_desp, 2),
         "saldo_projetado": round(saldo_proj, 2),
         "tendencia": tendencia,
+        # Mantido para o gráfico atual: "mes" é a posição (1..6) na projeção
         "projecao_6_meses": [
             {
                 "mes": i + 1,
-                "receita_estimada": round(media_rec, 2),
-                "despesa_estimada": round(media_desp, 2),
-                "saldo_estimado": round(saldo_proj, 2)
+                "receita_estimada": p["receita_estimada"],
+                "despesa_estimada": p["despesa_estimada"],
+                "saldo_estimado": p["saldo_estimado"]
             }
-            for i in range(6)
-        ]
+            for i, p in enumerate(projecao[:6])
+        ],
+        "projecao": projecao,
+        "por_categoria": por_categoria,
     }
 
 
-# ========== EXPORTAÇÃO EXCEL ==========
+@api_router.get("/dashboard")
+async def obter_dashboard(
+    request: Request,
+    usuario: dict = Depends(get_current_user),
+    periodo: Optional[str] = None,  # "total", "ultimo_mes", "ultimos_6_meses", "customizado"
+    data_inicio: Optional[str] = None,  # formato: YYYY-MM-DD
+    data_fim: Optional[str] = None  # formato: YYYY-MM-DD
+):
+    """Retorna dados agregados para o dashboard com filtros de data"""
+    # Períodos relativos mudam com o dia, então a data de hoje entra na chave
+    parametros = {"periodo": periodo, "data_inicio": data_inicio, "data_fim": data_fim, "hoje": datetime.now().date()}
+    if montar_filtro_periodo(usuario["id"], periodo, data_inicio, data_fim) == {"user_id": usuario["id"]}:
+        # Período total: snapshot noturno ou, se houve alterações depois dele, os resumos mensais
+        calcular = lambda: snapshot_ou_calcular(usuario["id"], "dashboard", {}, lambda: dashboard_dos_resumos(usuario["id"]))
+    else:
+        calcular = lambda: calcular_dashboard(usuario["id"], periodo, data_inicio, data_fim)
+    return await resposta_em_cache(request, usuario["id"], "dashboard", parametros, calcular)
 
-@api_router.get("/export-excel")
-async def exportar_excel(usuario: dict = Depends(get_current_user)):
-    """Gera arquivo Excel com todas as abas e fórmulas"""
-    
-    # Buscar dados
-    receitas = await db.receitas.find({"user_id": usuario["id"]}).to_list(1000)
-    despesas = await db.despesas.find({"user_id": usuario["id"]}).to_list(1000)
-    categorias = await db.categorias.find({"user_id": usuario["id"]}).to_list(1000)
-    
-    # Criar workbook
-    wb = Workbook()
+@api_router.get("/gastos-recorrentes")
+async def obter_gastos_recorrentes(
+    request: Request,
+    usuario: dict = Depends(get_current_user),
+    top_n: int = Query(10, ge=1, le=100),
+    min_ocorrencias: int = Query(2, ge=1)  # mínimo para uma descrição contar como recorrente
+):
+    """Retorna análise de gastos recorrentes e frequentes
     
-    # Estilos
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    header_font = Font(bold=True, color="FFFFFF", size=12)
-    titulo_font = Font(bold=True, size=14, color="2F5496")
-    border = Border(
+    O snapshot noturno só vale enquanto os dados não mudam. Diferente das outras
+    análises, esta não tem rollup que incorpore as alterações do dia (descrições
+    importadas são quase todas únicas), então a primeira consulta depois de uma
+    escrita percorre as despesas do usuário; o resultado fica no cache de
+    respostas até a próxima escrita.
+    """
+    parametros = {"top_n": top_n, "min_ocorrencias": min_ocorrencias}
+    return await resposta_em_cache(
+        request, usuario["id"], "gastos-recorrentes", parametros,
+        lambda: snapshot_ou_calcular(
+            usuario["id"], "gastos-recorrentes", parametros,
+            lambda: calcular_gastos_recorrentes(usuario["id"], top_n, min_ocorrencias)
+        )
+    )
+
+@api_router.get("/resumo-mensal", response_model=List[ResumoMensal])
+async def obter_resumo_mensal(request: Request, usuario: dict = Depends(get_current_user)):
+    """Retorna resumo de todos os meses"""
+    return await resposta_em_cache(
+        request, usuario["id"], "resumo-mensal", {},
+        lambda: snapshot_ou_calcular(usuario["id"], "resumo-mensal", {}, lambda: calcular_resumo_mensal(usuario["id"]))
+    )
+
+@api_router.get("/projecoes")
+async def obter_projecoes(
+    request: Request,
+    usuario: dict = Depends(get_current_user),
+    meses: int = Query(6, ge=6, le=12)  # horizonte da projeção
+):
+    """Projeções por categoria com tendência, sazonalidade e faixa de confiança"""
+    return await resposta_em_cache(
+        request, usuario["id"], "projecoes", {"meses": meses},
+        lambda: snapshot_ou_calcular(usuario["id"], "projecoes", {"meses": meses}, lambda: calcular_projecoes(usuario["id"], meses))
+    )
+
+
+# ========== PRÉ-CÁLCULO (SNAPSHOTS) ==========
+
+# O batch noturno (python manage.py precalcular) grava em snapshots_analytics o
+# resultado de cada análise junto com a versão dos dados do usuário. O snapshot só
+# é servido enquanto a versão não mudar; depois de uma alteração, dashboard,
+# resumo-mensal e projeções saem de resumos_mensais, que já incorporam as
+# alterações do dia, e gastos-recorrentes volta a ser calculado na hora (não há
+# delta por descrição; a latência da primeira consulta depois de uma escrita
+# cresce com o histórico de despesas do usuário).
+PRECALCULO_CONCORRENCIA = int(os.environ.get('PRECALCULO_CONCORRENCIA', '8'))
+
+# (nome, parâmetros, função) de cada análise pré-calculada
+ANALISES_PRECALCULADAS = [
+    ("dashboard", {}, lambda user_id: calcular_dashboard(user_id)),
+    ("resumo-mensal", {}, lambda user_id: calcular_resumo_mensal(user_id)),
+    ("gastos-recorrentes", {"top_n": 10, "min_ocorrencias": 2}, lambda user_id: calcular_gastos_recorrentes(user_id, 10, 2)),
+    ("projecoes", {"meses": 6}, lambda user_id: calcular_projecoes(user_id, 6)),
+]
+
+snapshot_metricas = {"servidos": 0, "desatualizados": 0}
+
+def chave_parametros(parametros: dict) -> str:
+    return json.dumps(parametros, sort_keys=True, default=str)
+
+async def snapshot_ou_calcular(user_id: str, nome: str, parametros: dict, calcular):
+    """Serve o snapshot pré-calculado se os dados não mudaram desde ele; senão chama calcular()"""
+    snapshot, versao = await asyncio.gather(
+        leitura().snapshots_analytics.find_one(
+            {"user_id": user_id, "nome": nome, "parametros": chave_parametros(parametros)},
+            {"_id": 0, "versao": 1, "resultado": 1}
+        ),
+        obter_versao_dados(user_id),
+    )
+    if snapshot and snapshot["versao"] == versao:
+        snapshot_metricas["servidos"] += 1
+        return snapshot["resultado"]
+    if snapshot:
+        snapshot_metricas["desatualizados"] += 1
+    return await calcular()
+
+async def dashboard_dos_resumos(user_id: str) -> dict:
+    """Dashboard do período total montado a partir de resumos_mensais"""
+    recs_mes, desps_mes, por_categoria = {}, {}, {}
+    async for r in leitura().resumos_mensais.find(
+        {"user_id": user_id, "quantidade": {"$gt": 0}},
+        {"_id": 0, "tipo": 1, "categoria": 1, "mes": 1, "ano": 1, "valor": 1},
+        batch_size=MONGO_BATCH_SIZE
+    ):
+        chave = (r["mes"], r["ano"])
+        if r["tipo"] == "receita":
+            recs_mes[chave] = recs_mes.get(chave, 0) + r["valor"]
+        else:
+            desps_mes[chave] = desps_mes.get(chave, 0) + r["valor"]
+            por_categoria[r["categoria"]] = por_categoria.get(r["categoria"], 0) + r["valor"]
+    
+    return montar_dashboard(
+        sum(recs_mes.values()),
+        sum(desps_mes.values()),
+        sorted(por_categoria.items(), key=lambda item: item[1], reverse=True),
+        recs_mes,
+        desps_mes,
+    )
+
+async def precalcular_usuario(user_id: str) -> int:
+    """Grava os snapshots de todas as análises de um usuário"""
+    # A versão é lida antes de calcular: uma escrita concorrente deixa o snapshot desatualizado
+    versao = await obter_versao_dados(user_id)
+    operacoes = []
+    async with leituras_de_analise(user_id):
+        for nome, parametros, calcular in ANALISES_PRECALCULADAS:
+            resultado = json.loads(codificar_json(await calcular(user_id)))
+            chave = {"user_id": user_id, "nome": nome, "parametros": chave_parametros(parametros)}
+            operacoes.append(UpdateOne(
+                chave,
+                {"$set": {"versao": versao, "resultado": resultado, "gerado_em": datetime.utcnow()}},
+                upsert=True
+            ))
+    await db.snapshots_analytics.bulk_write(operacoes, ordered=False)
+    return len(operacoes)
+
+async def precalcular_analytics(user_id: Optional[str] = None, concorrencia: int = PRECALCULO_CONCORRENCIA) -> dict:
+    """Pré-calcula os snapshots de todos os usuários (ou de um) com `concorrencia` workers"""
+    fila = asyncio.Queue(maxsize=concorrencia * 2)
+    contagem = {"usuarios": 0, "snapshots": 0, "erros": 0}
+    
+    async def worker():
+        while True:
+            uid = await fila.get()
+            if uid is None:
+                return
+            try:
+                contagem["snapshots"] += await precalcular_usuario(uid)
+                contagem["usuarios"] += 1
+            except Exception:
+                contagem["erros"] += 1
+                logger.exception(f"Falha ao pré-calcular análises do usuário {uid}")
+    
+    workers = [asyncio.create_task(worker()) for _ in range(concorrencia)]
+    try:
+        filtro = {"id": user_id} if user_id else {}
+        async for u in db.usuarios.find(filtro, {"_id": 0, "id": 1}, batch_size=MONGO_BATCH_SIZE):
+            await fila.put(u["id"])
+        for _ in workers:
+            await fila.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for tarefa in workers:
+            tarefa.cancel()
+    return contagem
+
+
+# ========== EXPORTAÇÃO EXCEL ==========
+
+EXCEL_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# Exportações geradas ficam em disco, uma por versão dos dados do usuário
+EXPORT_DIR = Path(os.environ.get('EXPORT_DIR', ROOT_DIR / 'exports'))
+EXPORT_FORMATO = "1"  # incrementar quando o layout da planilha mudar
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', '2'))
+EXPORT_MAX_FILA = int(os.environ.get('EXPORT_MAX_FILA', '100'))
+EXPORT_MAX_JOBS = 10000
+EXPORT_JOB_TTL = 60 * 60  # status dos jobs fica disponível por 1 hora
+# A planilha é montada nestas threads para não ocupar o event loop da API
+excel_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="excel")
+
+INSTRUCOES_TUTORIAL = [
+    "",
+    "🎯 COMO USAR ESTA PLANILHA:",
+    "",
+    "1️⃣ ABA 'RECEITAS': Preencha suas receitas mensais",
+    "   - Células em BRANCO são editáveis",
+    "   - Células em CINZA são calculadas automaticamente (NÃO EDITE)",
+    "",
+    "2️⃣ ABA 'DESPESAS': Preencha suas despesas mensais",
+    "   - Use o menu suspenso para selecionar categorias",
+    "   - Os totais são calculados automaticamente",
+    "",
+    "3️⃣ ABA 'CATEGORIAS': Personalize suas categorias",
+    "   - Adicione ou remova categorias conforme sua necessidade",
+    "",
+    "4️⃣ ABA 'RESUMO MENSAL': Veja o histórico completo",
+    "   - Totais por mês calculados automaticamente",
+    "   - Meses com prejuízo destacados em vermelho",
+    "",
+    "5️⃣ ABA 'PROJEÇÕES': Veja tendências futuras",
+    "   - Baseado na média dos últimos meses",
+    "",
+    "6️⃣ ABA 'PAINEL': Dashboard visual",
+    "   - Indicadores principais e resumo geral",
+    "",
+    "⚠️ IMPORTANTE:",
+    "• Não delete linhas de cabeçalho",
+    "• Não modifique células com fórmulas (cinza)",
+    "• Sempre use datas no formato DD/MM/AAAA",
+    "• Valores devem ser apenas números (sem R$)",
+    "",
+    "💡 DICA: Comece preenchendo a aba CATEGORIAS, depois RECEITAS e DESPESAS!",
+    "",
+    "✅ Pronto! Sua planilha está configurada e pronta para uso!",
+]
+
+# Cards do painel: (nome do estilo, cor do texto, cor de fundo)
+CARDS_PAINEL = [
+    ("receita", "10B981", "D1FAE5"),
+    ("despesa", "EF4444", "FEE2E2"),
+    ("saldo", "3B82F6", "DBEAFE"),
+    ("economia", "8B5CF6", "EDE9FE"),
+]
+
+def registrar_estilos_excel(wb: Workbook):
+    """Registra os estilos nomeados usados na exportação"""
+    borda = Border(
         left=Side(style='thin'),
         right=Side(style='thin'),
         top=Side(style='thin'),
         bottom=Side(style='thin')
     )
-    
-    # ========== ABA 1: TUTORIAL ==========
-    ws_tutorial = wb.active
-    ws_tutorial.title = "Tutorial"
-    
-    ws_tutorial['A1'] = "📚 BEM-VINDO À PLANILHA DE CONTROLE FINANCEIRO"
-    ws_tutorial['A1'].font = Font(bold=True, size=16, color="2F5496")
-    
-    instrucoes = [
-        "",
-        "🎯 COMO USAR ESTA PLANILHA:",
-        "",
-        "1️⃣ ABA 'RECEITAS': Preencha suas receitas mensais",
-        "   - Células em BRANCO são editáveis",
-        "   - Células em CINZA são calculadas automaticamente (NÃO EDITE)",
-        "",
-        "2️⃣ ABA 'DESPESAS': Preencha suas despesas mensais",
-        "   - Use o menu suspenso para selecionar categorias",
-        "   - Os totais são calculados automaticamente",
-        "",
-        "3️⃣ ABA 'CATEGORIAS': Personalize suas categorias",
-        "   - Adicione ou remova categorias conforme sua necessidade",
-        "",
-        "4️⃣ ABA 'RESUMO MENSAL': Veja o histórico completo",
-        "   - Totais por mês calculados automaticamente",
-        "   - Meses com prejuízo destacados em vermelho",
-        "",
-        "5️⃣ ABA 'PROJEÇÕES': Veja tendências futuras",
-        "   - Baseado na média dos últimos meses",
-        "",
-        "6️⃣ ABA 'PAINEL': Dashboard visual",
-        "   - Indicadores principais e resumo geral",
-        "",
-        "⚠️ IMPORTANTE:",
-        "• Não delete linhas de cabeçalho",
-        "• Não modifique células com fórmulas (cinza)",
-        "• Sempre use datas no formato DD/MM/AAAA",
-        "• Valores devem ser apenas números (sem R$)",
-        "",
-        "💡 DICA: Comece preenchendo a aba CATEGORIAS, depois RECEITAS e DESPESAS!",
-        "",
-        "✅ Pronto! Sua planilha está configurada e pronta para uso!",
+    estilos = [
+        NamedStyle(name="titulo_tutorial", font=Font(bold=True, size=16, color="2F5496")),
+        NamedStyle(name="titulo", font=Font(bold=True, size=14, color="2F5496")),
+        NamedStyle(name="titulo_painel", font=Font(bold=True, size=18, color="2F5496")),
+        NamedStyle(name="topico", font=Font(bold=True, size=11)),
+        NamedStyle(name="negrito", font=Font(bold=True)),
+        NamedStyle(name="italico", font=Font(italic=True)),
+        NamedStyle(
+            name="cabecalho",
+            font=Font(bold=True, color="FFFFFF", size=12),
+            fill=PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid"),
+            border=borda,
+            alignment=Alignment(horizontal='center')
+        ),
+        NamedStyle(name="celula", font=Font(size=11), border=borda),
+        NamedStyle(
+            name="celula_prejuizo",
+            font=Font(size=11),
+            border=borda,
+            fill=PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
+        ),
+        NamedStyle(
+            name="total",
+            font=Font(bold=True),
+            fill=PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
+        ),
     ]
+    for nome, cor_texto, cor_fundo in CARDS_PAINEL:
+        fundo = PatternFill(start_color=cor_fundo, end_color=cor_fundo, fill_type="solid")
+        estilos.append(NamedStyle(name=f"card_{nome}_rotulo", font=Font(bold=True, size=12), fill=fundo))
+        estilos.append(NamedStyle(name=f"card_{nome}_valor", font=Font(bold=True, size=14, color=cor_texto), fill=fundo))
+    for estilo in estilos:
+        wb.add_named_style(estilo)
+
+def celulas(ws, valores, estilo: Optional[str] = None) -> list:
+    """Monta uma linha de células write-only; None deixa a célula vazia"""
+    linha = []
+    for valor in valores:
+        if valor is None:
+            linha.append(None)
+            continue
+        cell = WriteOnlyCell(ws, value=valor)
+        if estilo:
+            cell.style = estilo
+        linha.append(cell)
+    return linha
+
+def celula(ws, valor, estilo: str) -> WriteOnlyCell:
+    cell = WriteOnlyCell(ws, value=valor)
+    cell.style = estilo
+    return cell
+
+def definir_larguras(ws, larguras: dict):
+    """Larguras das colunas; em write-only precisa vir antes da primeira linha"""
+    for coluna, largura in larguras.items():
+        ws.column_dimensions[coluna].width = largura
+
+def documentos_do_cursor(cursor, loop):
+    """Itera, a partir de uma thread, um cursor do Motor que continua sendo lido no event loop"""
+    while True:
+        lote = asyncio.run_coroutine_threadsafe(cursor.to_list(MONGO_BATCH_SIZE), loop).result()
+        if not lote:
+            return
+        yield from lote
+
+def escrever_aba_lancamentos(ws, titulo: str, documentos, coluna_forma: str, headers: list, totais_mes: dict):
+    """Escreve receitas ou despesas linha a linha e acumula os totais por mês"""
+    definir_larguras(ws, {'A': 15, 'B': 30, 'C': 20, 'D': 20, 'E': 15})
+    ws.append([celula(ws, titulo, "titulo")])
+    ws.merged_cells.add('A1:E1')
+    ws.append([])
+    ws.append(celulas(ws, headers, "cabecalho"))
+    
+    linha = 4
+    for doc in documentos:
+        ws.append(celulas(ws, [
+            doc.get('data', ''),
+            doc.get('descricao', ''),
+            doc.get('categoria', ''),
+            doc.get(coluna_forma, ''),
+            doc.get('valor', 0),
+        ], "celula"))
+        chave = (doc.get('mes'), doc.get('ano'))
+        totais_mes[chave] = totais_mes.get(chave, 0) + doc.get('valor', 0)
+        linha += 1
     
-    for i, texto in enumerate(instrucoes, start=2):
-        ws_tutorial[f'A{i}'] = texto
-        if "️⃣" in texto or "⚠️" in texto:
-            ws_tutorial[f'A{i}'].font = Font(bold=True, size=11)
+    # Total
+    ws.append([None, None, None, celula(ws, "TOTAL:", "negrito"), celula(ws, f"=SUM(E4:E{linha-1})", "total")])
+
+async def escrever_excel(user_id: str, destino):
+    """Gera a planilha completa em modo write-only, lendo os dados por cursores
     
-    ws_tutorial.column_dimensions['A'].width = 80
+    A montagem (células e wb.save) roda em excel_executor; os cursores continuam
+    no event loop e entregam os documentos à thread lote a lote. As linhas vão
+    para arquivos temporários do openpyxl à medida que são escritas, então a
+    memória não cresce com o histórico do usuário.
+    """
+    usuario = await db.usuarios.find_one({"id": user_id}, CAMPOS_CATEGORIAS_USUARIO) or {"id": user_id}
+    categorias = await categorias_do_usuario(usuario)
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        excel_executor,
+        montar_excel,
+        categorias,
+        documentos_do_cursor(leitura().receitas.find({"user_id": user_id}, batch_size=MONGO_BATCH_SIZE), loop),
+        documentos_do_cursor(leitura().despesas.find({"user_id": user_id}, batch_size=MONGO_BATCH_SIZE), loop),
+        destino,
+    )
+
+def montar_excel(categorias: List[dict], receitas, despesas, destino):
+    """Monta e grava a planilha (roda fora do event loop)"""
+    wb = Workbook(write_only=True)
+    registrar_estilos_excel(wb)
+    
+    # Totais por (mes, ano) acumulados enquanto as linhas são escritas
+    recs_mes = {}
+    desps_mes = {}
+    
+    # ========== ABA 1: TUTORIAL ==========
+    ws_tutorial = wb.create_sheet("Tutorial")
+    definir_larguras(ws_tutorial, {'A': 80})
+    ws_tutorial.append([celula(ws_tutorial, "📚 BEM-VINDO À PLANILHA DE CONTROLE FINANCEIRO", "titulo_tutorial")])
+    for texto in INSTRUCOES_TUTORIAL:
+        if "️⃣" in texto or "⚠️" in texto:
+            ws_tutorial.append([celula(ws_tutorial, texto, "topico")])
+        else:
+            ws_tutorial.append([texto])
     
     # ========== ABA 2: CATEGORIAS ==========
     ws_cat = wb.create_sheet("Categorias")
+    definir_larguras(ws_cat, {'A': 25, 'B': 15, 'C': 15})
+    ws_cat.append([celula(ws_cat, "📁 CATEGORIAS", "titulo")])
+    ws_cat.merged_cells.add('A1:C1')
+    ws_cat.append([])
+    ws_cat.append(celulas(ws_cat, ['Nome', 'Tipo', 'Cor'], "cabecalho"))
     
-    ws_cat['A1'] = "📁 CATEGORIAS"
-    ws_cat['A1'].font = titulo_font
-    ws_cat.merge_cells('A1:C1')
-    
-    headers_cat = ['Nome', 'Tipo', 'Cor']
-    for col, header in enumerate(headers_cat, start=1):
-        cell = ws_cat.cell(row=3, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
-    
-    for i, cat in enumerate(categorias, start=4):
-        ws_cat[f'A{i}'] = cat.get('nome', '')
-        ws_cat[f'B{i}'] = cat.get('tipo', '')
-        ws_cat[f'C{i}'] = cat.get('cor', '')
-        
-        for col in range(1, 4):
-            ws_cat.cell(row=i, column=col).border = border
-    
-    ws_cat.column_dimensions['A'].width = 25
-    ws_cat.column_dimensions['B'].width = 15
-    ws_cat.column_dimensions['C'].width = 15
+    for cat in categorias:
+        ws_cat.append(celulas(ws_cat, [cat.get('nome', ''), cat.get('tipo', ''), cat.get('cor', '')], "celula"))
     
     # ========== ABA 3: RECEITAS ==========
-    ws_rec = wb.create_sheet("Receitas")
-    
-    ws_rec['A1'] = "💰 RECEITAS"
-    ws_rec['A1'].font = titulo_font
-    ws_rec.merge_cells('A1:E1')
-    
-    headers_rec = ['Data', 'Descrição', 'Categoria', 'Forma Recebimento', 'Valor']
-    for col, header in enumerate(headers_rec, start=1):
-        cell = ws_rec.cell(row=3, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
-    
-    for i, rec in enumerate(receitas, start=4):
-        ws_rec[f'A{i}'] = rec.get('data', '')
-        ws_rec[f'B{i}'] = rec.get('descricao', '')
-        ws_rec[f'C{i}'] = rec.get('categoria', '')
-        ws_rec[f'D{i}'] = rec.get('forma_recebimento', '')
-        ws_rec[f'E{i}'] = rec.get('valor', 0)
-        
-        for col in range(1, 6):
-            ws_rec.cell(row=i, column=col).border = border
-    
-    # Total
-    ultima_linha = len(receitas) + 4
-    ws_rec[f'D{ultima_linha}'] = "TOTAL:"
-    ws_rec[f'D{ultima_linha}'].font = Font(bold=True)
-    ws_rec[f'E{ultima_linha}'] = f"=SUM(E4:E{ultima_linha-1})"
-    ws_rec[f'E{ultima_linha}'].font = Font(bold=True)
-    ws_rec[f'E{ultima_linha}'].fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    
-    ws_rec.column_dimensions['A'].width = 15
-    ws_rec.column_dimensions['B'].width = 30
-    ws_rec.column_dimensions['C'].width = 20
-    ws_rec.column_dimensions['D'].width = 20
-    ws_rec.column_dimensions['E'].width = 15
+    escrever_aba_lancamentos(
+        wb.create_sheet("Receitas"),
+        "💰 RECEITAS",
+        receitas,
+        'forma_recebimento',
+        ['Data', 'Descrição', 'Categoria', 'Forma Recebimento', 'Valor'],
+        recs_mes
+    )
     
     # ========== ABA 4: DESPESAS ==========
-    ws_desp = wb.create_sheet("Despesas")
-    
-    ws_desp['A1'] = "💸 DESPESAS"
-    ws_desp['A1'].font = titulo_font
-    ws_desp.merge_cells('A1:E1')
-    
-    headers_desp = ['Data', 'Descrição', 'Categoria', 'Forma Pagamento', 'Valor']
-    for col, header in enumerate(headers_desp, start=1):
-        cell = ws_desp.cell(row=3, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
-    
-    for i, desp in enumerate(despesas, start=4):
-        ws_desp[f'A{i}'] = desp.get('data', '')
-        ws_desp[f'B{i}'] = desp.get('descricao', '')
-        ws_desp[f'C{i}'] = desp.get('categoria', '')
-        ws_desp[f'D{i}'] = desp.get('forma_pagamento', '')
-        ws_desp[f'E{i}'] = desp.get('valor', 0)
-        
-        for col in range(1, 6):
-            ws_desp.cell(row=i, column=col).border = border
-    
-    # Total
-    ultima_linha_desp = len(despesas) + 4
-    ws_desp[f'D{ultima_linha_desp}'] = "TOTAL:"
-    ws_desp[f'D{ultima_linha_desp}'].font = Font(bold=True)
-    ws_desp[f'E{ultima_linha_desp}'] = f"=SUM(E4:E{ultima_linha_desp-1})"
-    ws_desp[f'E{ultima_linha_desp}'].font = Font(bold=True)
-    ws_desp[f'E{ultima_linha_desp}'].fill = PatternFill(start_color="D9E1F2", end_color="D9E1F2", fill_type="solid")
-    
-    ws_desp.column_dimensions['A'].width = 15
-    ws_desp.column_dimensions['B'].width = 30
-    ws_desp.column_dimensions['C'].width = 20
-    ws_desp.column_dimensions['D'].width = 20
-    ws_desp.column_dimensions['E'].width = 15
+    escrever_aba_lancamentos(
+        wb.create_sheet("Despesas"),
+        "💸 DESPESAS",
+        despesas,
+        'forma_pagamento',
+        ['Data', 'Descrição', 'Categoria', 'Forma Pagamento', 'Valor'],
+        desps_mes
+    )
     
     # ========== ABA 5: RESUMO MENSAL ==========
     ws_resumo = wb.create_sheet("Resumo Mensal")
-    
-    ws_resumo['A1'] = "📊 RESUMO MENSAL"
-    ws_resumo['A1'].font = titulo_font
-    ws_resumo.merge_cells('A1:F1')
-    
-    headers_resumo = ['Mês/Ano', 'Receitas', 'Despesas', 'Saldo', '% Economia', 'Status']
-    for col, header in enumerate(headers_resumo, start=1):
-        cell = ws_resumo.cell(row=3, column=col)
-        cell.value = header
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.border = border
-        cell.alignment = Alignment(horizontal='center')
+    definir_larguras(ws_resumo, {coluna: 15 for coluna in 'ABCDEF'})
+    ws_resumo.append([celula(ws_resumo, "📊 RESUMO MENSAL", "titulo")])
+    ws_resumo.merged_cells.add('A1:F1')
+    ws_resumo.append([])
+    ws_resumo.append(celulas(ws_resumo, ['Mês/Ano', 'Receitas', 'Despesas', 'Saldo', '% Economia', 'Status'], "cabecalho"))
     
     # Agrupar por mês/ano
-    meses_anos = set()
-    for r in receitas:
-        meses_anos.add((r.get('mes'), r.get('ano')))
-    for d in despesas:
-        meses_anos.add((d.get('mes'), d.get('ano')))
+    meses_anos = set(recs_mes) | set(desps_mes)
     
-    row = 4
     for mes, ano in sorted(meses_anos):
-        total_rec = sum(r.get('valor', 0) for r in receitas if r.get('mes') == mes and r.get('ano') == ano)
-        total_desp = sum(d.get('valor', 0) for d in despesas if d.get('mes') == mes and d.get('ano') == ano)
+        total_rec = recs_mes.get((mes, ano), 0)
+        total_desp = desps_mes.get((mes, ano), 0)
         saldo = total_rec - total_desp
         perc = (saldo / total_rec * 100) if total_rec > 0 else 0
         status = "Lucro" if saldo >= 0 else "Prejuízo"
         
-        ws_resumo[f'A{row}'] = f"{mes:02d}/{ano}"
-        ws_resumo[f'B{row}'] = total_rec
-        ws_resumo[f'C{row}'] = total_desp
-        ws_resumo[f'D{row}'] = saldo
-        ws_resumo[f'E{row}'] = f"{perc:.2f}%"
-        ws_resumo[f'F{row}'] = status
-        
         # Destaque vermelho para prejuízo
-        if saldo < 0:
-            for col in range(1, 7):
-                ws_resumo.cell(row=row, column=col).fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-        
-        for col in range(1, 7):
-            ws_resumo.cell(row=row, column=col).border = border
-        
-        row += 1
-    
-    ws_resumo.column_dimensions['A'].width = 15
-    ws_resumo.column_dimensions['B'].width = 15
-    ws_resumo.column_dimensions['C'].width = 15
-    ws_resumo.column_dimensions['D'].width = 15
-    ws_resumo.column_dimensions['E'].width = 15
-    ws_resumo.column_dimensions['F'].width = 15
+        estilo = "celula_prejuizo" if saldo < 0 else "celula"
+        ws_resumo.append(celulas(ws_resumo, [f"{mes:02d}/{ano}", total_rec, total_desp, saldo, f"{perc:.2f}%", status], estilo))
     
     # ========== ABA 6: PROJEÇÕES ==========
     ws_proj = wb.create_sheet("Projeções")
-    
-    ws_proj['A1'] = "🔮 PROJEÇÕES FINANCEIRAS"
-    ws_proj['A1'].font = titulo_font
-    ws_proj.merge_cells('A1:D1')
-    
-    ws_proj['A3'] = "Baseado na média dos últimos 3 meses"
-    ws_proj['A3'].font = Font(italic=True)
-    
-    ws_proj['A5'] = "Média de Receitas:"
-    ws_proj['A6'] = "Média de Despesas:"
-    ws_proj['A7'] = "Saldo Projetado:"
+    definir_larguras(ws_proj, {'A': 25, 'B': 20})
+    ws_proj.append([celula(ws_proj, "🔮 PROJEÇÕES FINANCEIRAS", "titulo")])
+    ws_proj.merged_cells.add('A1:D1')
+    ws_proj.append([])
+    ws_proj.append([celula(ws_proj, "Baseado na média dos últimos 3 meses", "italico")])
+    ws_proj.append([])
     
     # Calcular médias (simplificado para o Excel)
-    total_rec_all = sum(r.get('valor', 0) for r in receitas)
-    total_desp_all = sum(d.get('valor', 0) for d in despesas)
+    total_rec_all = sum(recs_mes.values())
+    total_desp_all = sum(desps_mes.values())
     num_meses = len(meses_anos) if meses_anos else 1
     
-    ws_proj['B5'] = total_rec_all / num_meses
-    ws_proj['B6'] = total_desp_all / num_meses
-    ws_proj['B7'] = f"=B5-B6"
-    
-    for i in [5, 6, 7]:
-        ws_proj[f'A{i}'].font = Font(bold=True)
-        ws_proj[f'B{i}'].font = Font(bold=True)
-    
-    ws_proj.column_dimensions['A'].width = 25
-    ws_proj.column_dimensions['B'].width = 20
+    ws_proj.append(celulas(ws_proj, ["Média de Receitas:", total_rec_all / num_meses], "negrito"))
+    ws_proj.append(celulas(ws_proj, ["Média de Despesas:", total_desp_all / num_meses], "negrito"))
+    ws_proj.append(celulas(ws_proj, ["Saldo Projetado:", "=B5-B6"], "negrito"))
     
     # ========== ABA 7: PAINEL ==========
     ws_painel = wb.create_sheet("Painel")
     ws_painel.sheet_view.showGridLines = False
+    definir_larguras(ws_painel, {'B': 20, 'D': 20})
+    ws_painel.append([])
+    ws_painel.append([None, celula(ws_painel, "📈 PAINEL DE CONTROLE FINANCEIRO", "titulo_painel")])
+    ws_painel.merged_cells.add('B2:E2')
+    ws_painel.append([])
     
-    ws_painel['B2'] = "📈 PAINEL DE CONTROLE FINANCEIRO"
-    ws_painel['B2'].font = Font(bold=True, size=18, color="2F5496")
-    ws_painel.merge_cells('B2:E2')
+    perc_economia = ((total_rec_all - total_desp_all) / total_rec_all * 100) if total_rec_all > 0 else 0
     
     # Cards de indicadores
-    ws_painel['B4'] = "💰 RECEITA TOTAL"
-    ws_painel['B5'] = total_rec_all
-    ws_painel['B4'].font = Font(bold=True, size=12)
-    ws_painel['B5'].font = Font(bold=True, size=14, color="10B981")
-    ws_painel['B4'].fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
-    ws_painel['B5'].fill = PatternFill(start_color="D1FAE5", end_color="D1FAE5", fill_type="solid")
-    
-    ws_painel['D4'] = "💸 DESPESA TOTAL"
-    ws_painel['D5'] = total_desp_all
-    ws_painel['D4'].font = Font(bold=True, size=12)
-    ws_painel['D5'].font = Font(bold=True, size=14, color="EF4444")
-    ws_painel['D4'].fill = PatternFill(start_color="FEE2E2", end_color="FEE2E2", fill_type="solid")
-    ws_painel['D5'].fill = PatternFill(start_color="FEE2E2", end_color="FEE2E2", fill_type="solid")
-    
-    ws_painel['B7'] = "📊 SALDO"
-    ws_painel['B8'] = total_rec_all - total_desp_all
-    ws_painel['B7'].font = Font(bold=True, size=12)
-    ws_painel['B8'].font = Font(bold=True, size=14, color="3B82F6")
-    ws_painel['B7'].fill = PatternFill(start_color="DBEAFE", end_color="DBEAFE", fill_type="solid")
-    ws_painel['B8'].fill = PatternFill(start_color="DBEAFE", end_color="DBEAFE", fill_type="solid")
+    ws_painel.append([None, celula(ws_painel, "💰 RECEITA TOTAL", "card_receita_rotulo"), None, celula(ws_painel, "💸 DESPESA TOTAL", "card_despesa_rotulo")])
+    ws_painel.append([None, celula(ws_painel, total_rec_all, "card_receita_valor"), None, celula(ws_painel, total_desp_all, "card_despesa_valor")])
+    ws_painel.append([])
+    ws_painel.append([None, celula(ws_painel, "📊 SALDO", "card_saldo_rotulo"), None, celula(ws_painel, "💎 % ECONOMIA", "card_economia_rotulo")])
+    ws_painel.append([None, celula(ws_painel, total_rec_all - total_desp_all, "card_saldo_valor"), None, celula(ws_painel, f"{perc_economia:.2f}%", "card_economia_valor")])
+    
+    wb.save(destino)
+
+def caminho_exportacao(user_id: str, versao: int) -> Path:
+    """Arquivo "<versão>-<hash>.xlsx", com o hash de (usuário, versão dos dados, formato da planilha)"""
+    chave = hashlib.sha256(f"{user_id}:{versao}:{EXPORT_FORMATO}".encode('utf-8')).hexdigest()
+    return EXPORT_DIR / user_id / f"{versao}-{chave}.xlsx"
+
+def versao_do_arquivo(caminho: Path) -> int:
+    """Versão dos dados no nome do arquivo; -1 para nomes sem versão (formato antigo)"""
+    prefixo, _, _ = caminho.stem.partition("-")
+    return int(prefixo) if prefixo.isdigit() else -1
+
+async def gerar_exportacao(user_id: str) -> Path:
+    """Gera a planilha da versão atual dos dados, reaproveitando o arquivo se já existir"""
+    versao = await obter_versao_dados(user_id)
+    caminho = caminho_exportacao(user_id, versao)
+    if caminho.exists():
+        return caminho
+    
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    temporario = caminho.with_name(f"{caminho.stem}.{uuid.uuid4().hex}.tmp")
+    try:
+        async with leituras_de_analise(user_id):
+            with open(temporario, "wb") as arquivo, medir_etapa("excel"):
+                await escrever_excel(user_id, arquivo)
+        os.replace(temporario, caminho)
+    finally:
+        temporario.unlink(missing_ok=True)
+    
+    # Só versões anteriores: um job lento não pode apagar o arquivo de uma versão mais nova
+    for antigo in caminho.parent.glob("*.xlsx"):
+        if versao_do_arquivo(antigo) < versao:
+            antigo.unlink(missing_ok=True)
+    return caminho
+
+def resposta_excel(caminho: Path) -> FileResponse:
+    # FileResponse envia o arquivo do disco em blocos
+    return FileResponse(caminho, media_type=EXCEL_MEDIA_TYPE, filename="controle_financeiro.xlsx")
+
+@api_router.get("/export-excel")
+async def exportar_excel(usuario: dict = Depends(get_current_user)):
+    """Gera arquivo Excel com todas as abas e fórmulas"""
+    caminho = await gerar_exportacao(usuario["id"])
+    return resposta_excel(caminho)
+
+
+# ========== EXPORTAÇÃO EM SEGUNDO PLANO ==========
+
+class ExportacaoJob(BaseModel):
+    id: str
+    status: str  # pendente, processando, concluido, erro
+    criado_em: datetime
+    concluido_em: Optional[datetime] = None
+    erro: Optional[str] = None
+
+exportacao_jobs = CacheTTL(EXPORT_MAX_JOBS, EXPORT_JOB_TTL)
+exportacao_em_andamento = {}  # user_id -> job_id pendente
+exportacao_fila: Optional[asyncio.Queue] = None
+exportacao_workers: List[asyncio.Task] = []
+
+async def worker_exportacao():
+    """Consome a fila de exportações gerando os arquivos"""
+    while True:
+        job_id = await exportacao_fila.get()
+        job = exportacao_jobs.obter(job_id)
+        try:
+            if job is None:
+                continue
+            job["status"] = "processando"
+            job["caminho"] = await gerar_exportacao(job["user_id"])
+            job["status"] = "concluido"
+        except Exception as e:
+            logger.error(f"Erro na exportação {job_id}: {e}")
+            job["status"] = "erro"
+            job["erro"] = str(e)
+        finally:
+            if job is not None:
+                job["concluido_em"] = datetime.utcnow()
+                exportacao_em_andamento.pop(job["user_id"], None)
+            exportacao_fila.task_done()
+
+def obter_job_usuario(job_id: str, usuario: dict) -> dict:
+    job = exportacao_jobs.obter(job_id)
+    if job is None or job["user_id"] != usuario["id"]:
+        raise HTTPException(status_code=404, detail="Exportação não encontrada")
+    return job
+
+@api_router.post("/export-excel/jobs", response_model=ExportacaoJob, status_code=status.HTTP_202_ACCEPTED)
+async def criar_exportacao(usuario: dict = Depends(get_current_user)):
+    """Agenda a geração da planilha; se os dados não mudaram, reaproveita o último arquivo"""
+    # Já existe uma exportação em andamento para o usuário
+    job_id = exportacao_em_andamento.get(usuario["id"])
+    if job_id and exportacao_jobs.obter(job_id):
+        return exportacao_jobs.obter(job_id)
+    
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": usuario["id"],
+        "status": "pendente",
+        "criado_em": datetime.utcnow(),
+        "concluido_em": None,
+        "erro": None,
+        "caminho": None,
+    }
     
-    perc_economia = ((total_rec_all - total_desp_all) / total_rec_all * 100) if total_rec_all > 0 else 0
-    ws_painel['D7'] = "💎 % ECONOMIA"
-    ws_painel['D8'] = f"{perc_economia:.2f}%"
-    ws_painel['D7'].font = Font(bold=True, size=12)
-    ws_painel['D8'].font = Font(bold=True, size=14, color="8B5CF6")
-    ws_painel['D7'].fill = PatternFill(start_color="EDE9FE", end_color="EDE9FE", fill_type="solid")
-    ws_painel['D8'].fill = PatternFill(start_color="EDE9FE", end_color="EDE9FE", fill_type="solid")
-    
-    ws_painel.column_dimensions['B'].width = 20
-    ws_painel.column_dimensions['D'].width = 20
-    
-    # Salvar em memória
-    excel_file = io.BytesIO()
-    wb.save(excel_file)
-    excel_file.seek(0)
-    
-    return StreamingResponse(
-        excel_file,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": "attachment; filename=controle_financeiro.xlsx"}
-    )
+    caminho = caminho_exportacao(usuario["id"], await obter_versao_dados(usuario["id"]))
+    if caminho.exists():
+        job.update(status="concluido", caminho=caminho, concluido_em=job["criado_em"])
+    else:
+        try:
+            exportacao_fila.put_nowait(job["id"])
+        except asyncio.QueueFull:
+            raise HTTPException(status_code=503, detail="Muitas exportações na fila, tente novamente em instantes")
+        exportacao_em_andamento[usuario["id"]] = job["id"]
+    
+    exportacao_jobs.definir(job["id"], job)
+    return job
+
+@api_router.get("/export-excel/jobs/{job_id}", response_model=ExportacaoJob)
+async def obter_exportacao(job_id: str, usuario: dict = Depends(get_current_user)):
+    """Retorna o status de uma exportação"""
+    return obter_job_usuario(job_id, usuario)
+
+@api_router.get("/export-excel/jobs/{job_id}/download")
+async def baixar_exportacao(job_id: str, usuario: dict = Depends(get_current_user)):
+    """Baixa o arquivo de uma exportação concluída"""
+    job = obter_job_usuario(job_id, usuario)
+    if job["status"] != "concluido":
+        raise HTTPException(status_code=409, detail="Exportação ainda não concluída")
+    if not job["caminho"].exists():
+        # Substituído por uma versão mais nova dos dados
+        raise HTTPException(status_code=410, detail="Arquivo expirado, gere uma nova exportação")
+    return resposta_excel(job["caminho"])
+
+@app.on_event("startup")
+async def iniciar_workers_exportacao():
+    global exportacao_fila
+    exportacao_fila = asyncio.Queue(maxsize=EXPORT_MAX_FILA)
+    for _ in range(EXPORT_WORKERS):
+        exportacao_workers.append(asyncio.create_task(worker_exportacao()))
+
+@app.on_event("shutdown")
+async def parar_workers_exportacao():
+    for tarefa in exportacao_workers:
+        tarefa.cancel()
+    excel_executor.shutdown(wait=False)
 
 
 # ========== ROOT ENDPOINT ==========
@@ -1110,6 +3038,339 @@ async def root():
     return {"message": "API de Controle Financeiro - Sistema completo de gestão financeira"}
 
 
+# ========== MÉTRICAS ==========
+
+# Limites (segundos) do histograma de latência por rota
+LATENCIA_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class MetricasRota:
+    """Acumulados de uma rota (método + caminho declarado) desde o início do processo"""
+    
+    def __init__(self):
+        self.por_status = {}
+        self.buckets = [0] * len(LATENCIA_BUCKETS)
+        self.contagem = 0
+        self.duracao_s = 0.0
+        self.db_s = 0.0
+        self.consultas = 0
+        self.documentos = 0
+    
+    def registrar(self, status_code: int, duracao: float, medicao: MedicaoRequisicao):
+        self.por_status[status_code] = self.por_status.get(status_code, 0) + 1
+        for i, limite in enumerate(LATENCIA_BUCKETS):
+            if duracao <= limite:
+                self.buckets[i] += 1
+        self.contagem += 1
+        self.duracao_s += duracao
+        self.db_s += medicao.db_s
+        self.consultas += medicao.consultas
+        self.documentos += medicao.documentos
+
+metricas_rotas = {}  # (método, rota) -> MetricasRota
+_rotas_por_endpoint = {}
+
+def rota_da_requisicao(request: Request) -> str:
+    """Caminho declarado da rota (/api/receitas/{rec_id}), para não criar uma série por id"""
+    endpoint = request.scope.get("endpoint")
+    if endpoint is None:
+        return "desconhecida"
+    if not _rotas_por_endpoint:
+        _rotas_por_endpoint.update({r.endpoint: r.path for r in app.routes if hasattr(r, "endpoint")})
+    return _rotas_por_endpoint.get(endpoint, "desconhecida")
+
+def cabecalho_server_timing(duracao: float, medicao: MedicaoRequisicao) -> str:
+    partes = [
+        f"total;dur={duracao * 1000:.1f}",
+        f'db;dur={medicao.db_s * 1000:.1f};desc="{medicao.consultas} consultas, {medicao.documentos} docs"',
+    ]
+    partes += [f"{nome};dur={segundos * 1000:.1f}" for nome, segundos in medicao.etapas.items()]
+    return ", ".join(partes)
+
+@app.middleware("http")
+async def instrumentar_requisicao(request: Request, call_next):
+    """Mede cada requisição: tempo total, tempo no Mongo, consultas e documentos"""
+    medicao = MedicaoRequisicao()
+    token = medicao_atual.set(medicao)
+    perfil = profiler_lento.iniciar(request, medicao) if profiler_lento else None
+    inicio = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["Server-Timing"] = cabecalho_server_timing(time.perf_counter() - inicio, medicao)
+        return response
+    finally:
+        chave = (request.method, rota_da_requisicao(request))
+        if chave not in metricas_rotas:
+            metricas_rotas[chave] = MetricasRota()
+        duracao = time.perf_counter() - inicio
+        metricas_rotas[chave].registrar(status_code, duracao, medicao)
+        if perfil is not None:
+            profiler_lento.finalizar(perfil, chave, status_code, duracao)
+        medicao_atual.reset(token)
+
+def rotulos(**valores) -> str:
+    return "{" + ",".join(f'{k}="{v}"' for k, v in valores.items()) + "}" if valores else ""
+
+def formatar_metricas() -> str:
+    """Métricas no formato texto do Prometheus"""
+    linhas = []
+    
+    def cabecalho(nome: str, tipo: str, ajuda: str):
+        linhas.append(f"# HELP {nome} {ajuda}")
+        linhas.append(f"# TYPE {nome} {tipo}")
+    
+    rotas = sorted(metricas_rotas.items())
+    
+    cabecalho("http_requisicoes_total", "counter", "Requisições atendidas por rota e status")
+    for (metodo, rota), met in rotas:
+        for status_code, n in sorted(met.por_status.items()):
+            linhas.append(f"http_requisicoes_total{rotulos(metodo=metodo, rota=rota, status=status_code)} {n}")
+    
+    cabecalho("http_duracao_segundos", "histogram", "Tempo total da requisição")
+    for (metodo, rota), met in rotas:
+        for limite, n in zip(LATENCIA_BUCKETS, met.buckets):
+            linhas.append(f"http_duracao_segundos_bucket{rotulos(metodo=metodo, rota=rota, le=limite)} {n}")
+        linhas.append(f"http_duracao_segundos_bucket{rotulos(metodo=metodo, rota=rota, le='+Inf')} {met.contagem}")
+        linhas.append(f"http_duracao_segundos_sum{rotulos(metodo=metodo, rota=rota)} {met.duracao_s}")
+        linhas.append(f"http_duracao_segundos_count{rotulos(metodo=metodo, rota=rota)} {met.contagem}")
+    
+    for nome, campo, ajuda in (
+        ("http_db_segundos_total", "db_s", "Tempo gasto em comandos do Mongo"),
+        ("http_db_consultas_total", "consultas", "Comandos enviados ao Mongo"),
+        ("http_db_documentos_total", "documentos", "Documentos retornados pelo Mongo"),
+    ):
+        cabecalho(nome, "counter", ajuda)
+        for (metodo, rota), met in rotas:
+            linhas.append(f"{nome}{rotulos(metodo=metodo, rota=rota)} {getattr(met, campo)}")
+    
+    for nome, tipo, chave, ajuda in (
+        ("bcrypt_pendentes", "gauge", "pendentes", "Hashes de senha na fila ou em execução"),
+        ("bcrypt_executadas_total", "counter", "executadas", "Hashes de senha executados"),
+        ("bcrypt_rejeitadas_total", "counter", "rejeitadas", "Hashes rejeitados com a fila cheia"),
+        ("bcrypt_espera_segundos_total", "counter", "espera_total_s", "Tempo de espera na fila do bcrypt"),
+    ):
+        cabecalho(nome, tipo, ajuda)
+        linhas.append(f"{nome} {bcrypt_metricas[chave]}")
+    
+    for nome, tipo, chave, ajuda in (
+        ("hotmart_eventos_recebidos_total", "counter", "recebidos", "Webhooks Hotmart registrados"),
+        ("hotmart_eventos_duplicados_total", "counter", "duplicados", "Webhooks repetidos descartados"),
+        ("hotmart_eventos_processados_total", "counter", "processados", "Eventos aplicados"),
+        ("hotmart_eventos_ignorados_total", "counter", "ignorados", "Eventos sem usuário correspondente"),
+        ("hotmart_eventos_erros_total", "counter", "erros", "Eventos que esgotaram as tentativas"),
+        ("hotmart_atraso_segundos_total", "counter", "atraso_total_s", "Soma do tempo entre recebimento e aplicação"),
+        ("hotmart_atraso_max_segundos", "gauge", "atraso_max_s", "Maior tempo entre recebimento e aplicação"),
+    ):
+        cabecalho(nome, tipo, ajuda)
+        linhas.append(f"{nome} {hotmart_metricas[chave]}")
+    cabecalho("hotmart_fila", "gauge", "Eventos aguardando os workers deste processo")
+    linhas.append(f"hotmart_fila {sum(fila.qsize() for fila in hotmart_filas)}")
+    
+    pool = estatisticas_pool()
+    for nome, tipo, chave, ajuda in (
+        ("mongo_pool_conexoes", "gauge", "conexoes", "Conexões abertas com o Mongo"),
+        ("mongo_pool_em_uso", "gauge", "em_uso", "Conexões emprestadas a operações em andamento"),
+        ("mongo_pool_checkouts_total", "counter", "checkouts", "Conexões obtidas do pool"),
+        ("mongo_pool_falhas_checkout_total", "counter", "falhas_checkout", "Falhas ao obter conexão do pool"),
+        ("mongo_pool_timeouts_checkout_total", "counter", "timeouts_checkout", "Esperas que estouraram MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+        ("mongo_pool_espera_segundos_total", "counter", "espera_total_s", "Tempo esperando uma conexão livre"),
+        ("mongo_pool_espera_max_segundos", "gauge", "espera_max_s", "Maior espera por uma conexão livre"),
+    ):
+        cabecalho(nome, tipo, ajuda)
+        linhas.append(f"{nome} {pool[chave]}")
+    
+    cabecalho("leituras_analise_total", "counter", "Análises lidas de réplicas ou do primário (escrita recente)")
+    for destino, n in leituras_analise_metricas.items():
+        linhas.append(f"leituras_analise_total{rotulos(destino=destino)} {n}")
+    
+    cabecalho("snapshots_total", "counter", "Análises servidas do pré-cálculo ou recalculadas por estarem desatualizadas")
+    for situacao, n in snapshot_metricas.items():
+        linhas.append(f"snapshots_total{rotulos(situacao=situacao)} {n}")
+    return "\n".join(linhas) + "\n"
+
+@app.get("/metrics", include_in_schema=False)
+async def metricas(request: Request):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    return Response(content=formatar_metricas(), media_type="text/plain; version=0.0.4")
+
+
+# ========== SAÚDE ==========
+
+def estatisticas_pool() -> dict:
+    """Retrato do pool de conexões: ocupação e espera por conexão livre"""
+    with monitor_pool._lock:
+        pool = dict(monitor_pool.metricas)
+    capacidade = MONGO_MAX_POOL_SIZE * max(pool["pools"], 1)
+    tentativas = pool["checkouts"] + pool["falhas_checkout"]
+    return {
+        **pool,
+        "max_por_servidor": MONGO_MAX_POOL_SIZE,
+        "min_por_servidor": MONGO_MIN_POOL_SIZE,
+        "utilizacao": round(pool["em_uso"] / capacidade, 4) if capacidade else None,
+        "espera_media_ms": round(pool["espera_total_s"] / tentativas * 1000, 3) if tentativas else 0.0,
+        "espera_max_ms": round(pool["espera_max_s"] * 1000, 3),
+    }
+
+@app.get("/health", include_in_schema=False)
+async def health():
+    """Liveness: o processo responde; não consulta o banco"""
+    return {"status": "ok", "pool": estatisticas_pool()}
+
+@app.get("/ready", include_in_schema=False)
+async def ready():
+    """Readiness: o banco responde a um ping dentro de MONGO_READY_TIMEOUT"""
+    inicio = time.perf_counter()
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=MONGO_READY_TIMEOUT)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={
+            "status": "indisponivel",
+            "erro": repr(e),
+            "pool": estatisticas_pool(),
+        })
+    return {
+        "status": "pronto",
+        "ping_ms": round((time.perf_counter() - inicio) * 1000, 3),
+        "pool": estatisticas_pool(),
+    }
+
+
+# ========== PROFILER DE REQUISIÇÕES LENTAS ==========
+
+# PROFILER_LIMITE_MS=0 desliga; acima do limite a pilha do event loop passa a ser amostrada
+PROFILER_LIMITE_MS = float(os.environ.get('PROFILER_LIMITE_MS', '0'))
+PROFILER_ROTAS = {r.strip() for r in os.environ.get('PROFILER_ROTAS', '/api/dashboard,/api/export-excel').split(',') if r.strip()}
+PROFILER_AMOSTRAGEM = float(os.environ.get('PROFILER_AMOSTRAGEM', '1'))  # fração das requisições acompanhadas
+PROFILER_INTERVALO_MS = float(os.environ.get('PROFILER_INTERVALO_MS', '5'))
+PROFILER_DIR = Path(os.environ.get('PROFILER_DIR', ROOT_DIR / 'profiles'))
+
+# Chaves de sessão/roteamento que o driver acrescenta e que não fazem parte da consulta
+CAMPOS_INTERNOS_COMANDO = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction"}
+
+class PerfilRequisicao:
+    def __init__(self, thread_id: int, medicao: MedicaoRequisicao):
+        self.thread_id = thread_id
+        self.medicao = medicao
+        self.inicio = time.perf_counter()
+        self.amostras = {}  # pilha "arquivo:função:linha;..." -> quantidade
+
+class ProfilerLento:
+    """Amostra a pilha do event loop enquanto uma requisição acompanhada passa do limite
+    
+    Uma thread dorme até existir requisição acompanhada em andamento; abaixo do limite
+    ela só confere o relógio. Ao final, requisições lentas geram um diretório em
+    PROFILER_DIR com as pilhas (formato "collapsed" de flamegraph) e os planos
+    (explain) das consultas emitidas.
+    """
+    
+    def __init__(self, limite_s: float, intervalo_s: float):
+        self.limite_s = limite_s
+        self.intervalo_s = intervalo_s
+        self._ativos = set()
+        self._lock = threading.Lock()
+        self._acordar = threading.Event()
+        self._thread = None
+        self._tarefas = set()
+    
+    def iniciar(self, request: Request, medicao: MedicaoRequisicao) -> Optional[PerfilRequisicao]:
+        if request.url.path not in PROFILER_ROTAS or random.random() >= PROFILER_AMOSTRAGEM:
+            return None
+        perfil = PerfilRequisicao(threading.get_ident(), medicao)
+        medicao.comandos = []
+        with self._lock:
+            self._ativos.add(perfil)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._amostrar, name="profiler-lento", daemon=True)
+                self._thread.start()
+        self._acordar.set()
+        return perfil
+    
+    def finalizar(self, perfil: PerfilRequisicao, chave: tuple, status_code: int, duracao: float):
+        with self._lock:
+            self._ativos.discard(perfil)
+        if duracao < self.limite_s:
+            return
+        tarefa = asyncio.create_task(self._gravar(perfil, chave, status_code, duracao))
+        self._tarefas.add(tarefa)
+        tarefa.add_done_callback(self._tarefas.discard)
+    
+    def _amostrar(self):
+        while True:
+            self._acordar.wait()
+            if self._amostrar_ativos():
+                time.sleep(self.intervalo_s)
+    
+    def _amostrar_ativos(self) -> bool:
+        """Uma rodada de amostragem; sob o lock, para que um perfil já finalizado
+        (e talvez sendo gravado) não receba mais amostras"""
+        with self._lock:
+            if not self._ativos:
+                self._acordar.clear()
+                return False
+            agora = time.perf_counter()
+            frames = None
+            for perfil in self._ativos:
+                if agora - perfil.inicio < self.limite_s:
+                    continue
+                if frames is None:
+                    frames = sys._current_frames()
+                pilha = formatar_pilha(frames.get(perfil.thread_id))
+                if pilha:
+                    perfil.amostras[pilha] = perfil.amostras.get(pilha, 0) + 1
+            return True
+    
+    async def _gravar(self, perfil: PerfilRequisicao, chave: tuple, status_code: int, duracao: float):
+        metodo, rota = chave
+        medicao = perfil.medicao
+        planos = []
+        for banco, comando in medicao.comandos or []:
+            comando = {k: v for k, v in comando.items() if k not in CAMPOS_INTERNOS_COMANDO}
+            try:
+                plano = await client[banco].command({"explain": comando, "verbosity": "queryPlanner"})
+                planos.append({"comando": comando, "plano": plano})
+            except Exception as e:
+                planos.append({"comando": comando, "erro": str(e)})
+        
+        resumo = {
+            "metodo": metodo,
+            "rota": rota,
+            "status": status_code,
+            "duracao_ms": round(duracao * 1000, 1),
+            "db_ms": round(medicao.db_s * 1000, 1),
+            "consultas": medicao.consultas,
+            "documentos": medicao.documentos,
+            "etapas_ms": {nome: round(s * 1000, 1) for nome, s in medicao.etapas.items()},
+            "amostras": sum(perfil.amostras.values()),
+            "intervalo_ms": self.intervalo_s * 1000,
+        }
+        pilhas = "".join(f"{pilha} {n}\n" for pilha, n in sorted(perfil.amostras.items(), key=lambda item: -item[1]))
+        nome = f"{datetime.utcnow():%Y%m%dT%H%M%S}_{metodo}_{rota.strip('/').replace('/', '_')}_{uuid.uuid4().hex[:8]}"
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, gravar_arquivos_perfil, PROFILER_DIR / nome, resumo, pilhas, planos)
+            logger.warning(f"Requisição lenta {metodo} {rota} ({resumo['duracao_ms']} ms) perfilada em {PROFILER_DIR / nome}")
+        except OSError as e:
+            logger.error(f"Falha ao gravar perfil de {metodo} {rota}: {e}")
+
+def formatar_pilha(frame) -> str:
+    """Pilha no formato collapsed (raiz primeiro, separada por ;)"""
+    quadros = []
+    while frame is not None:
+        codigo = frame.f_code
+        quadros.append(f"{os.path.basename(codigo.co_filename)}:{codigo.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(quadros))
+
+def gravar_arquivos_perfil(destino: Path, resumo: dict, pilhas: str, planos: list):
+    destino.mkdir(parents=True, exist_ok=True)
+    (destino / "resumo.json").write_text(json.dumps(resumo, ensure_ascii=False, indent=2), encoding="utf-8")
+    (destino / "pilhas.txt").write_text(pilhas, encoding="utf-8")
+    (destino / "explain.json").write_text(json.dumps(planos, ensure_ascii=False, indent=2, default=str), encoding="utf-8")
+
+profiler_lento = ProfilerLento(PROFILER_LIMITE_MS / 1000, PROFILER_INTERVALO_MS / 1000) if PROFILER_LIMITE_MS > 0 else None
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1128,6 +3389,147 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# ========== ÍNDICES ==========
+
+# (coleção, chaves, opções, consultas atendidas)
+INDICES = [
+    ("usuarios", [("email", 1)], {"unique": True}, "registro, login e webhook Hotmart por email"),
+    ("usuarios", [("id", 1)], {"unique": True}, "get_current_user por id"),
+    ("usuarios", [("status_assinatura", 1), ("data_expiracao", 1)], {}, "expiração de assinaturas em lote"),
+    ("categorias", [("user_id", 1)], {}, "listar_categorias e exportar_excel"),
+    ("categorias", [("id", 1), ("user_id", 1)], {}, "atualizar/deletar categoria"),
+    ("assinaturas", [("user_id", 1), ("status", 1), ("data_inicio", -1)], {}, "cancelamento no webhook e migração de assinatura_atual"),
+    ("assinaturas", [("status", 1), ("data_fim", 1)], {}, "expiração de assinaturas em lote"),
+    ("assinaturas", [("hotmart_transaction", 1)], {"unique": True, "partialFilterExpression": {"hotmart_transaction": {"$type": "string"}}}, "uma assinatura por transação Hotmart"),
+    ("eventos_hotmart", [("status", 1), ("recebido_em", 1)], {}, "retomada dos webhooks pendentes na inicialização"),
+    ("versoes_dados", [("user_id", 1)], {"unique": True}, "versão dos dados (cache de exportações)"),
+    ("resumos_mensais", [("user_id", 1), ("tipo", 1), ("ano", 1), ("mes", 1), ("categoria", 1)], {"unique": True}, "rollups mensais ($inc nas escritas, resumo-mensal, projecoes)"),
+    ("snapshots_analytics", [("user_id", 1), ("nome", 1), ("parametros", 1)], {"unique": True}, "snapshots do pré-cálculo noturno"),
+]
+for _colecao in ("receitas", "despesas"):
+    INDICES += [
+        (_colecao, [("user_id", 1), ("ano", 1), ("mes", 1)], {}, "listagem por mes/ano, dashboard ultimo_mes"),
+        (_colecao, [("id", 1), ("user_id", 1)], {}, "atualizar/deletar por id"),
+        (_colecao, [("user_id", 1), ("data_lancamento", -1), ("id", -1)], {}, "listagem paginada, intervalos de datas (listas e dashboard)"),
+        (_colecao, [("user_id", 1), ("categoria", 1), ("data_lancamento", -1), ("id", -1)], {}, "listagem paginada filtrada por categoria"),
+    ]
+
+async def relatorio_indices() -> List[dict]:
+    """Descreve cada índice declarado, as consultas que ele atende e se já existe no banco"""
+    existentes = {}
+    for colecao in {colecao for colecao, _, _, _ in INDICES}:
+        info = await db[colecao].index_information()
+        existentes[colecao] = [list(indice["key"]) for indice in info.values()]
+    return [
+        {
+            "colecao": colecao,
+            "chaves": ", ".join(f"{campo}:{ordem}" for campo, ordem in chaves),
+            "unico": opcoes.get("unique", False),
+            "consultas": consultas,
+            "criado": list(chaves) in existentes[colecao],
+        }
+        for colecao, chaves, opcoes, consultas in INDICES
+    ]
+
+# ========== MIGRAÇÕES ==========
+
+async def migrar_datas_nativas() -> int:
+    """Preenche data_lancamento (data BSON) nos lançamentos gravados antes do campo existir"""
+    atualizados = 0
+    for colecao in (db.receitas, db.despesas):
+        result = await colecao.update_many(
+            {"data_lancamento": {"$exists": False}},
+            [{"$set": {"data_lancamento": {"$dateFromString": {
+                "dateString": "$data",
+                "format": "%Y-%m-%d",
+                "onError": DATA_PADRAO,
+                "onNull": DATA_PADRAO,
+            }}}}]
+        )
+        atualizados += result.modified_count
+    return atualizados
+
+async def migrar_resumos_mensais() -> int:
+    """Gera os rollups mensais dos lançamentos anteriores a resumos_mensais"""
+    return await reconstruir_resumos()
+
+async def migrar_assinatura_atual() -> int:
+    """Copia para usuarios.assinatura_atual a assinatura ativa mais recente de cada usuário"""
+    pipeline = [
+        {"$match": {"status": "active"}},
+        {"$sort": {"user_id": 1, "data_inicio": -1}},
+        {"$group": {"_id": "$user_id", "assinatura": {"$first": "$$ROOT"}}},
+    ]
+    operacoes = []
+    async for g in db.assinaturas.aggregate(pipeline, allowDiskUse=True, batchSize=MONGO_BATCH_SIZE):
+        assinatura = {k: v for k, v in g["assinatura"].items() if k != "_id"}
+        operacoes.append(UpdateOne({"id": g["_id"]}, {"$set": {"assinatura_atual": assinatura}}))
+    atualizados = 0
+    for i in range(0, len(operacoes), MONGO_BATCH_SIZE):
+        result = await db.usuarios.bulk_write(operacoes[i:i + MONGO_BATCH_SIZE], ordered=False)
+        atualizados += result.modified_count
+    return atualizados
+
+# (nome, função); cada migração roda uma única vez e fica registrada em db.migracoes.
+# resumos_mensais precisa terminar antes de a API aceitar escritas: um $inc gravado
+# durante a reconstrução se perderia ou seria contado duas vezes.
+MIGRACOES = [
+    ("data_lancamento", migrar_datas_nativas),
+    ("resumos_mensais", migrar_resumos_mensais),
+    ("assinatura_atual", migrar_assinatura_atual),
+]
+
+# Segundos que um worker espera a migração iniciada por outro processo terminar
+MIGRACAO_ESPERA = float(os.environ.get('MIGRACAO_ESPERA', '900'))
+
+async def aguardar_migracao(nome: str):
+    """Espera a migração reservada por outro processo; registros antigos não têm status"""
+    limite = time.monotonic() + MIGRACAO_ESPERA
+    while True:
+        doc = await db.migracoes.find_one({"_id": nome})
+        if doc is None or doc.get("status", "aplicada") == "aplicada":
+            return
+        if time.monotonic() >= limite:
+            raise RuntimeError(
+                f"Migração {nome} em andamento desde {doc.get('iniciada_em')}; se o processo que a "
+                f"iniciou caiu, remova o registro em db.migracoes e rode python manage.py migrar"
+            )
+        await asyncio.sleep(1)
+
+async def aplicar_migracoes() -> List[str]:
+    """Aplica as migrações pendentes; com vários workers, só um executa cada migração
+    e os demais esperam por ela antes de começar a atender requisições"""
+    aplicadas = []
+    for nome, migracao in MIGRACOES:
+        try:
+            await db.migracoes.insert_one({"_id": nome, "status": "em_andamento", "iniciada_em": datetime.utcnow()})
+        except DuplicateKeyError:
+            await aguardar_migracao(nome)
+            continue
+        try:
+            afetados = await migracao()
+        except BaseException:
+            await db.migracoes.delete_one({"_id": nome})  # libera para a próxima tentativa
+            raise
+        await db.migracoes.update_one(
+            {"_id": nome},
+            {"$set": {"status": "aplicada", "aplicada_em": datetime.utcnow(), "documentos": afetados}}
+        )
+        logger.info(f"Migração {nome} aplicada ({afetados} documentos)")
+        aplicadas.append(nome)
+    return aplicadas
+
+async def criar_indices():
+    """Cria os índices declarados em INDICES (operação idempotente)"""
+    for colecao, chaves, opcoes, consultas in INDICES:
+        try:
+            nome = await db[colecao].create_index(chaves, **opcoes)
+            logger.info(f"Índice {colecao}.{nome} pronto ({consultas})")
+        except OperationFailure as e:
+            # Ex.: emails duplicados impedem o índice único; a API continua no ar
+            logger.error(f"Falha ao criar índice em {colecao} {chaves}: {e}")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
+    bcrypt_executor.shutdown(wait=False)
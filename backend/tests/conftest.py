@@ -0,0 +1,40 @@
+"""Fixtures dos testes do backend: o banco é um mongomock em memória (pacote mongomock-motor)"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "controle_financeiro_testes")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Banco vazio por teste, no lugar de server.db"""
+    client = mongomock_motor.AsyncMongoMockClient()
+    banco = client[os.environ["DB_NAME"]]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", banco)
+    server.usuarios_cache.limpar()
+    return banco
+
+
+@pytest.fixture
+def executar():
+    """Roda uma corrotina até o fim (os testes não dependem de plugin de asyncio)"""
+    return asyncio.run
+
+
+@pytest.fixture
+def usuario(db, executar):
+    doc = {"id": "usuario-teste", "nome": "Teste", "email": "teste@exemplo.com", "plano": "mensal",
+           "status_assinatura": "active", "categorias_modelo": server.CATEGORIAS_MODELO_ATUAL}
+    executar(db.usuarios.insert_one(dict(doc)))
+    return doc
@@ -0,0 +1,25 @@
+"""Análises calculadas a partir das despesas"""
+import server
+
+
+def test_gastos_recorrentes_agrupa_descricoes_sem_diferenciar_maiusculas(usuario, executar, monkeypatch):
+    monkeypatch.setattr(server, "MONGO_BATCH_SIZE", 2)  # descrições chegam em vários lotes
+    for descricao, categoria, valor in [
+        ("Mercado", "Alimentação", 100.0), ("mercado", "Alimentação", 50.0), ("MERCADO", "Alimentação", 30.0),
+        ("Padaria", "Alimentação", 10.0), ("Uber", "Transporte", 20.0), ("uber", "Transporte", 25.0),
+        ("Cinema", "Lazer", 40.0),
+    ]:
+        executar(server.criar_despesa(server.DespesaCreate(
+            data="2024-03-10", descricao=descricao, categoria=categoria, forma_pagamento="pix", valor=valor), usuario))
+    
+    resultado = executar(server.calcular_gastos_recorrentes(usuario["id"], top_n=10, min_ocorrencias=2))
+    assert [(d["descricao"], d["ocorrencias"], d["valor_total"]) for d in resultado["descricoes_recorrentes"]] == [
+        ("Mercado", 3, 180.0), ("Uber", 2, 45.0),
+    ]
+    assert [c["categoria"] for c in resultado["categorias_mais_frequentes"]] == ["Alimentação", "Transporte", "Lazer"]
+    assert [c["total_gasto"] for c in resultado["media_por_categoria"]] == [190.0, 45.0, 40.0]
+
+
+def test_gastos_recorrentes_sem_despesas(usuario, executar):
+    resultado = executar(server.calcular_gastos_recorrentes(usuario["id"]))
+    assert resultado == {"categorias_mais_frequentes": [], "descricoes_recorrentes": [], "media_por_categoria": []}
@@ -0,0 +1,36 @@
+"""Cache de respostas em memória com mais de um worker"""
+import json
+
+from starlette.requests import Request
+
+import server
+
+
+def requisicao():
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": []})
+
+
+def test_escrita_em_um_worker_invalida_o_cache_do_outro(usuario, executar, monkeypatch):
+    worker_a = server.CacheRespostasLocal(100, 60)
+    worker_b = server.CacheRespostasLocal(100, 60)
+    calculos = []
+
+    async def calcular():
+        calculos.append(1)
+        return {"calculos": len(calculos)}
+
+    def dashboard(worker):
+        monkeypatch.setattr(server, "cache_respostas", worker)
+        resposta = executar(server.resposta_em_cache(requisicao(), usuario["id"], "dashboard", {}, calcular))
+        return json.loads(resposta.body)
+
+    assert dashboard(worker_a) == {"calculos": 1}
+    assert dashboard(worker_a) == {"calculos": 1}
+
+    # A escrita chega pelo worker B; o worker A não pode servir a resposta antiga
+    monkeypatch.setattr(server, "cache_respostas", worker_b)
+    executar(server.registrar_alteracao(usuario["id"]))
+
+    assert dashboard(worker_a) == {"calculos": 2}
+    assert dashboard(worker_b) == {"calculos": 3}
+    assert dashboard(worker_a) == {"calculos": 2}
@@ -0,0 +1,48 @@
+"""Categorias: modelo compartilhado mesclado com as alterações do usuário"""
+import server
+
+
+def nomes(executar, usuario):
+    return [c.nome for c in executar(server.listar_categorias(usuario))]
+
+
+def test_usuario_novo_recebe_o_modelo(usuario, executar):
+    modelo = server.MODELOS_CATEGORIAS[server.CATEGORIAS_MODELO_ATUAL]
+    assert nomes(executar, usuario) == [c["nome"] for c in modelo]
+
+
+def test_alteracao_feita_em_outro_worker_aparece(usuario, executar):
+    # Cópia em cache de outro processo, de antes de qualquer personalização
+    em_cache = {**usuario, "categorias_personalizadas": False}
+    
+    criada = executar(server.criar_categoria(server.CategoriaCreate(nome="Pets", tipo="despesa", cor="#123456"), usuario))
+    modelo = server.MODELOS_CATEGORIAS[server.CATEGORIAS_MODELO_ATUAL]
+    executar(server.deletar_categoria(modelo[0]["id"], usuario))
+    
+    lista = nomes(executar, em_cache)
+    assert "Pets" in lista
+    assert modelo[0]["nome"] not in lista
+    executar(server.deletar_categoria(criada.id, em_cache))
+    assert "Pets" not in nomes(executar, em_cache)
+
+
+def usuario_autenticado(executar, usuario):
+    token = server.criar_token(usuario["id"], usuario["email"])
+    credenciais = server.HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return executar(server.get_current_user(credenciais))
+
+
+def test_documento_do_banco_reaproveitado_sem_cache_de_usuarios(usuario, executar, db, monkeypatch):
+    monkeypatch.setattr(server.usuarios_cache, "ttl", 0)
+    autenticado = usuario_autenticado(executar, usuario)
+    # Sem releitura: a alteração gravada depois da autenticação não aparece
+    executar(db.usuarios.update_one({"id": usuario["id"]}, {"$set": {"categorias_personalizadas": True}}))
+    assert executar(server.usuario_com_categorias(autenticado)) is autenticado
+
+
+def test_usuario_em_cache_relido_so_com_campos_de_categorias(usuario, executar, db):
+    autenticado = usuario_autenticado(executar, usuario)
+    executar(db.usuarios.update_one({"id": usuario["id"]}, {"$set": {"categorias_personalizadas": True, "nome": "Outro"}}))
+    atualizado = executar(server.usuario_com_categorias(autenticado))
+    assert atualizado["categorias_personalizadas"] is True
+    assert atualizado["nome"] == "Teste"
@@ -0,0 +1,55 @@
+"""Exportação Excel: conteúdo da planilha e limpeza das versões anteriores"""
+from openpyxl import load_workbook
+
+import server
+
+
+def lancar(executar, usuario, n):
+    for i in range(n):
+        executar(server.criar_despesa(server.DespesaCreate(
+            data=f"2024-0{i % 9 + 1}-10", descricao=f"Compra {i}", categoria="Alimentação",
+            forma_pagamento="pix", valor=10.0), usuario))
+
+
+def test_planilha_tem_todas_as_linhas(usuario, executar, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "EXPORT_DIR", tmp_path)
+    monkeypatch.setattr(server, "MONGO_BATCH_SIZE", 3)  # vários lotes entregues à thread
+    lancar(executar, usuario, 10)
+    caminho = executar(server.gerar_exportacao(usuario["id"]))
+    wb = load_workbook(caminho, read_only=True)
+    linhas = list(wb["Despesas"].iter_rows(values_only=True))
+    assert len(linhas) == 3 + 10 + 1  # título, vazio, cabeçalho, lançamentos, total
+    categorias = list(wb["Categorias"].iter_rows(min_row=4, values_only=True))
+    assert len(categorias) == len(server.MODELOS_CATEGORIAS[server.CATEGORIAS_MODELO_ATUAL])
+
+
+def test_exportacao_antiga_nao_apaga_versao_mais_nova(usuario, executar, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "EXPORT_DIR", tmp_path)
+    lancar(executar, usuario, 1)
+    nova = executar(server.gerar_exportacao(usuario["id"]))
+    versao = server.versao_do_arquivo(nova)
+    
+    # Um job lento da versão anterior termina depois
+    monkeypatch.setattr(server, "obter_versao_dados", lambda user_id: _versao(versao - 1))
+    antiga = executar(server.gerar_exportacao(usuario["id"]))
+    assert nova.exists() and antiga.exists()
+    
+    # A versão seguinte remove as anteriores
+    monkeypatch.setattr(server, "obter_versao_dados", lambda user_id: _versao(versao + 1))
+    seguinte = executar(server.gerar_exportacao(usuario["id"]))
+    assert seguinte.exists() and not nova.exists() and not antiga.exists()
+
+
+async def _versao(valor):
+    return valor
+
+
+def test_celulas_de_dados_com_fonte_explicita(usuario, executar, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "EXPORT_DIR", tmp_path)
+    lancar(executar, usuario, 1)
+    wb = load_workbook(executar(server.gerar_exportacao(usuario["id"])))
+    estilos = {estilo.name: estilo for estilo in wb._named_styles}
+    for nome in ("celula", "celula_prejuizo"):
+        assert estilos[nome].font.size == 11
+    celula = wb["Despesas"].cell(row=4, column=1)
+    assert celula.style == "celula" and celula.font.size == 11
@@ -0,0 +1,43 @@
+"""Webhook da Hotmart: registro do evento e aplicação pelo worker"""
+import server
+
+
+def compra(**data):
+    base = {
+        "buyer": {"email": "teste@exemplo.com"},
+        "purchase": {"transaction": "HP123", "price": {"value": 29.9}},
+        "subscription": {"subscriber_code": "SUB1"},
+        "product": {"id": "0"},
+    }
+    return {"id": "evt-1", "event": "PURCHASE_COMPLETE", "data": {**base, **data}}
+
+
+def test_subobjetos_nulos_sao_registrados(db, executar):
+    payload = {"id": "evt-nulo", "event": "PURCHASE_COMPLETE",
+               "data": {"buyer": None, "purchase": None, "subscription": None, "product": None}}
+    resposta = executar(server.webhook_hotmart(payload))
+    assert resposta["status"] == "success"
+    evento = executar(db.eventos_hotmart.find_one({}))
+    assert evento["_id"] == "PURCHASE_COMPLETE:evt-nulo"
+    assert executar(server.aplicar_evento_hotmart(payload)) is False
+
+
+def test_data_nulo(db, executar):
+    payload = {"event": "PURCHASE_CANCELED", "data": None}
+    assert executar(server.webhook_hotmart(payload))["status"] == "success"
+    assert executar(server.aplicar_evento_hotmart(payload)) is False
+
+
+def test_compra_sem_preco_ativa_a_assinatura(usuario, db, executar):
+    payload = compra(purchase={"transaction": "HP123", "price": None})
+    assert executar(server.aplicar_evento_hotmart(payload)) is True
+    assinatura = executar(db.assinaturas.find_one({"hotmart_transaction": "HP123"}))
+    assert assinatura["valor"] == 0
+    assert executar(db.usuarios.find_one({"id": usuario["id"]}))["status_assinatura"] == "active"
+
+
+def test_webhook_repetido_e_descartado(db, executar):
+    executar(server.webhook_hotmart(compra()))
+    resposta = executar(server.webhook_hotmart(compra()))
+    assert resposta["message"] == "Webhook já recebido"
+    assert executar(db.eventos_hotmart.count_documents({})) == 1
@@ -0,0 +1,143 @@
+"""Leitores de arquivos da importação em lote (CSV, JSON e OFX)"""
+import io
+import json
+
+import pytest
+from fastapi import UploadFile
+
+import server
+
+
+def ler(leitor, conteudo: str, encoding="utf-8"):
+    return list(leitor(io.BytesIO(conteudo.encode(encoding))))
+
+
+def test_csv_com_ponto_e_virgula_e_valores_brasileiros():
+    linhas = ler(server.linhas_csv, "﻿Data;Descricao;Valor\n05/01/2024;Aluguel;1.200,50\n\n2024-01-06;Café;R$ 7,00\n")
+    assert linhas == [
+        {"data": "05/01/2024", "descricao": "Aluguel", "valor": "1.200,50"},
+        {"data": "2024-01-06", "descricao": "Café", "valor": "R$ 7,00"},
+    ]
+    assert [server.ler_valor(l["valor"]) for l in linhas] == [1200.5, 7.0]
+
+
+def test_csv_com_virgula_e_campo_entre_aspas():
+    linhas = ler(server.linhas_csv, 'data,descricao,valor\n2024-01-05,"Mercado, feira",35.9\n')
+    assert linhas == [{"data": "2024-01-05", "descricao": "Mercado, feira", "valor": "35.9"}]
+
+
+@pytest.mark.parametrize("conteudo", [
+    '[{"data": "2024-01-05", "valor": 10}, {"data": "2024-01-06", "valor": 20}]',
+    '  \n{"data": "2024-01-05", "valor": 10}\n\n{"data": "2024-01-06", "valor": 20}\n',
+])
+def test_json_array_e_json_lines(conteudo):
+    assert [l["valor"] for l in ler(server.linhas_json, conteudo)] == [10, 20]
+
+
+@pytest.mark.parametrize("bloco", [1, 5, 4096])
+def test_json_array_lido_em_blocos(monkeypatch, bloco):
+    monkeypatch.setattr(server, "IMPORT_BLOCO", bloco)
+    itens = [{"data": "2024-01-05", "valor": 12345, "descricao": "a, ] [ b"}, {"valor": 1.5e3}, {}]
+    assert ler(server.linhas_json, " [\n" + ",\n ".join(json.dumps(i) for i in itens) + "\n]\n") == itens
+    assert ler(server.linhas_json, "[]") == []
+    assert ler(server.linhas_json, "[1, 23]") == [1, 23]
+
+
+@pytest.mark.parametrize("conteudo", ['[{"valor": 1}, {"valor": ', '[{"valor": 1} {"valor": 2}]'])
+def test_json_array_malformado(conteudo):
+    leitor = server.linhas_json(io.BytesIO(conteudo.encode("utf-8")))
+    assert next(leitor) == {"valor": 1}
+    with pytest.raises(ValueError):
+        next(leitor)
+
+
+OFX_SGML = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX>
+<BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN>
+<TRNTYPE>CREDIT
+<DTPOSTED>20240105120000[-3:BRT]
+<TRNAMT>3000.00
+<MEMO>Salário
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20240107
+<TRNAMT>-45,90
+<NAME>Padaria
+</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+OFX_XML_UMA_LINHA = (
+    '<?xml version="1.0"?><?OFX OFXHEADER="200"?><OFX><BANKTRANLIST>'
+    "<STMTTRN><TRNTYPE>DEBIT</TRNTYPE><DTPOSTED>20240210</DTPOSTED><TRNAMT>-120.00</TRNAMT>"
+    "<MEMO>Luz &amp; água</MEMO></STMTTRN>"
+    "<STMTTRN><TRNTYPE>CREDIT</TRNTYPE><DTPOSTED>20240211</DTPOSTED><TRNAMT>50.00</TRNAMT>"
+    "<MEMO>Pix recebido</MEMO></STMTTRN>"
+    "</BANKTRANLIST></OFX>"
+)
+
+
+def test_ofx_sgml_uma_tag_por_linha():
+    assert ler(server.linhas_ofx, OFX_SGML, "latin-1") == [
+        {"tipo": "receita", "data": "20240105", "descricao": "Salário", "valor": 3000.0},
+        {"tipo": "despesa", "data": "20240107", "descricao": "Padaria", "valor": 45.9},
+    ]
+
+
+def test_ofx_xml_em_uma_linha():
+    assert ler(server.linhas_ofx, OFX_XML_UMA_LINHA) == [
+        {"tipo": "despesa", "data": "20240210", "descricao": "Luz & água", "valor": 120.0},
+        {"tipo": "receita", "data": "20240211", "descricao": "Pix recebido", "valor": 50.0},
+    ]
+
+
+@pytest.mark.parametrize("bloco", [1, 7, 64])
+def test_ofx_tags_divididas_entre_blocos(monkeypatch, bloco):
+    monkeypatch.setattr(server, "IMPORT_BLOCO", bloco)
+    assert ler(server.linhas_ofx, OFX_XML_UMA_LINHA) == ler(server.linhas_ofx, OFX_XML_UMA_LINHA.replace("><", ">\n<"))
+    assert len(ler(server.linhas_ofx, OFX_SGML, "latin-1")) == 2
+
+
+def test_ofx_transacao_sem_fechamento_nao_e_descartada():
+    conteudo = "<STMTTRN><DTPOSTED>20240301<TRNAMT>-1.00<STMTTRN><DTPOSTED>20240302<TRNAMT>2.00"
+    assert [t["valor"] for t in ler(server.linhas_ofx, conteudo)] == [1.0, 2.0]
+
+
+def test_importacao_ofx_em_uma_linha(usuario, executar):
+    arquivo = UploadFile(io.BytesIO(OFX_XML_UMA_LINHA.replace("-120.00", "abc").encode("utf-8")), filename="extrato.ofx")
+    relatorio = executar(server.importar_lancamentos(arquivo, None, None, usuario))
+    assert relatorio["importados"] == 1
+    assert relatorio["total_erros"] == 1
+    assert relatorio["erros"][0]["linha"] == 1
+
+
+def test_ofx_sgml_com_encoding_utf8_no_cabecalho():
+    conteudo = OFX_SGML.replace("DATA:OFXSGML", "DATA:OFXSGML\nENCODING:UTF-8")
+    assert ler(server.linhas_ofx, conteudo)[0]["descricao"] == "Salário"
+
+
+@pytest.mark.parametrize("bruto, esperado", [
+    ("1.234,56", 1234.56),
+    ("1,234.56", 1234.56),
+    ("R$ 10,00", 10.0),
+    ("-45,90", -45.9),
+    ("1234.56", 1234.56),
+    ("1.234.567", 1234567.0),
+    ("1,234,567", 1234567.0),
+    ("1.234.567,8", 1234567.8),
+    ("1,234,567.8", 1234567.8),
+    (12, 12.0),
+])
+def test_ler_valor_nos_formatos_brasileiro_e_americano(bruto, esperado):
+    assert server.ler_valor(bruto) == esperado
+
+
+@pytest.mark.parametrize("bruto", ["abc", "", "1,2,3.4.5"])
+def test_ler_valor_invalido(bruto):
+    with pytest.raises(ValueError):
+        server.ler_valor(bruto)
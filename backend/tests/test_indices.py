@@ -0,0 +1,29 @@
+"""Relatório de índices (python manage.py indices)"""
+import argparse
+
+import manage
+import server
+
+
+def test_relatorio_aponta_indices_faltando(db, executar):
+    executar(db.usuarios.create_index([("email", 1)], unique=True))
+
+    relatorio = executar(server.relatorio_indices())
+
+    assert len(relatorio) == len(server.INDICES)
+    email = next(i for i in relatorio if i["colecao"] == "usuarios" and i["chaves"] == "email:1")
+    assert email["unico"] and email["criado"]
+    assert not any(i["criado"] for i in relatorio if i["colecao"] != "usuarios")
+
+
+def test_comando_indices_sai_com_erro_ate_criar_todos(db, executar, capsys):
+    args = argparse.Namespace()
+    assert executar(manage.cmd_indices(args)) == 1
+    assert "FALTANDO" in capsys.readouterr().out
+
+    executar(server.criar_indices())
+
+    assert executar(manage.cmd_indices(args)) == 0
+    saida = capsys.readouterr().out
+    assert "FALTANDO" not in saida
+    assert f"{len(server.INDICES)} índices declarados, 0 faltando" in saida
@@ -0,0 +1,53 @@
+"""Operações em lote sobre receitas e despesas"""
+import server
+
+
+def test_data_alterada_em_lote_e_normalizada(usuario, db, executar):
+    desp = executar(server.criar_despesa(server.DespesaCreate(
+        data="2024-05-01", descricao="Mercado", categoria="Alimentação", forma_pagamento="pix", valor=10.0), usuario))
+    entrada = server.AtualizacaoLote(
+        filtro=server.FiltroLote(ids=[desp.id]),
+        alteracoes=server.AlteracoesLote(data="2024-3-9"),
+    )
+    assert executar(server.atualizar_despesas_lote(entrada, usuario))["modificados"] == 1
+    doc = executar(db.despesas.find_one({"id": desp.id}))
+    assert (doc["data"], doc["mes"], doc["ano"]) == ("2024-03-09", 3, 2024)
+    assert executar(server.verificar_resumos()) == []
+
+
+def despesa(data, valor=10.0, categoria="Alimentação"):
+    return server.DespesaCreate(data=data, descricao="Mercado", categoria=categoria, forma_pagamento="pix", valor=valor)
+
+
+def inserir_durante_a_captura(monkeypatch, usuario, data):
+    """Simula uma despesa criada por outra requisição entre a captura e a escrita do lote"""
+    original = server.capturar_lote
+    
+    async def capturar_e_inserir(colecao, consulta, sessao):
+        capturados = await original(colecao, consulta, sessao)
+        await server.criar_despesa(despesa(data, valor=99.0), usuario)
+        return capturados
+    
+    monkeypatch.setattr(server, "capturar_lote", capturar_e_inserir)
+
+
+def test_atualizacao_em_lote_com_insercao_concorrente(usuario, db, executar, monkeypatch):
+    for dia in (1, 2):
+        executar(server.criar_despesa(despesa(f"2024-05-0{dia}"), usuario))
+    inserir_durante_a_captura(monkeypatch, usuario, "2024-05-03")
+    entrada = server.AtualizacaoLote(
+        filtro=server.FiltroLote(data_inicio="2024-05-01", data_fim="2024-05-31"),
+        alteracoes=server.AlteracoesLote(categoria="Lazer", valor=5.0),
+    )
+    assert executar(server.atualizar_despesas_lote(entrada, usuario))["modificados"] == 2
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_exclusao_em_lote_com_insercao_concorrente(usuario, db, executar, monkeypatch):
+    for dia in (1, 2):
+        executar(server.criar_despesa(despesa(f"2024-05-0{dia}"), usuario))
+    inserir_durante_a_captura(monkeypatch, usuario, "2024-05-03")
+    filtro = server.FiltroLote(data_inicio="2024-05-01", data_fim="2024-05-31")
+    assert executar(server.excluir_despesas_lote(filtro, usuario))["excluidos"] == 2
+    assert executar(db.despesas.count_documents({})) == 1
+    assert executar(server.verificar_resumos()) == []
@@ -0,0 +1,49 @@
+"""Amostragem do profiler de requisições lentas"""
+import threading
+
+import server
+
+
+def perfil_ativo(profiler):
+    perfil = server.PerfilRequisicao(threading.get_ident(), server.MedicaoRequisicao())
+    perfil.inicio -= 1  # já passou do limite
+    profiler._ativos.add(perfil)
+    return perfil
+
+
+def test_amostra_requisicao_acima_do_limite():
+    profiler = server.ProfilerLento(0.5, 0.01)
+    perfil = perfil_ativo(profiler)
+
+    assert profiler._amostrar_ativos()
+    assert profiler._amostrar_ativos()
+
+    assert sum(perfil.amostras.values()) == 2
+    assert all("test_profiler.py:test_amostra_requisicao_acima_do_limite" in pilha for pilha in perfil.amostras)
+
+
+def test_perfil_finalizado_nao_recebe_amostras():
+    profiler = server.ProfilerLento(0.5, 0.01)
+    perfil = perfil_ativo(profiler)
+    profiler._amostrar_ativos()
+
+    profiler.finalizar(perfil, ("GET", "/api/dashboard"), 200, 0.1)
+    amostras = dict(perfil.amostras)
+
+    assert not profiler._amostrar_ativos()
+    assert perfil.amostras == amostras
+
+
+def test_finalizar_espera_a_rodada_de_amostragem_em_andamento():
+    profiler = server.ProfilerLento(0.5, 0.01)
+    perfil = perfil_ativo(profiler)
+    finalizado = threading.Event()
+
+    with profiler._lock:  # simula a thread amostradora no meio de uma rodada
+        thread = threading.Thread(target=lambda: (profiler.finalizar(perfil, ("GET", "/"), 200, 0.1), finalizado.set()))
+        thread.start()
+        assert not finalizado.wait(0.05)
+    thread.join(1)
+
+    assert finalizado.is_set()
+    assert perfil not in profiler._ativos
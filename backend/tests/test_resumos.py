@@ -0,0 +1,85 @@
+"""resumos_mensais devem bater com os lançamentos depois de qualquer escrita"""
+import asyncio
+import io
+
+from fastapi import UploadFile
+
+import server
+
+
+def receita(data="2024-03-10", valor=100.0, categoria="Salário"):
+    return server.ReceitaCreate(data=data, descricao="Pagamento", categoria=categoria,
+                                forma_recebimento="pix", valor=valor)
+
+def despesa(data="2024-03-12", valor=40.0, categoria="Alimentação"):
+    return server.DespesaCreate(data=data, descricao="Mercado", categoria=categoria,
+                                forma_pagamento="cartão", valor=valor)
+
+
+def test_criacao(usuario, executar):
+    executar(server.criar_receita(receita(), usuario))
+    executar(server.criar_despesa(despesa(), usuario))
+    executar(server.criar_despesa(despesa(valor=15.5), usuario))
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_atualizacao_muda_mes_categoria_e_valor(usuario, executar):
+    rec = executar(server.criar_receita(receita(), usuario))
+    desp = executar(server.criar_despesa(despesa(), usuario))
+    executar(server.atualizar_receita(rec.id, receita(data="2024-04-01", valor=250.0), usuario))
+    executar(server.atualizar_despesa(desp.id, despesa(categoria="Transporte", valor=12.0), usuario))
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_exclusao(usuario, executar):
+    rec = executar(server.criar_receita(receita(), usuario))
+    desp = executar(server.criar_despesa(despesa(), usuario))
+    executar(server.criar_despesa(despesa(valor=7.0), usuario))
+    executar(server.deletar_receita(rec.id, usuario))
+    executar(server.deletar_despesa(desp.id, usuario))
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_importacao_em_lote(usuario, executar, monkeypatch):
+    monkeypatch.setattr(server, "IMPORT_BATCH_SIZE", 2)  # força vários lotes
+    csv = (
+        "tipo;data;descricao;categoria;valor\n"
+        "receita;2024-01-05;Salário;Salário;3.000,00\n"
+        "despesa;05/01/2024;Aluguel;Moradia;1.200,00\n"
+        "despesa;2024-02-10;Mercado;Alimentação;350,25\n"
+        "despesa;2024-02-11;Mercado;Alimentação;49,75\n"
+        "despesa;data-ruim;Mercado;Alimentação;10\n"
+    )
+    arquivo = UploadFile(io.BytesIO(csv.encode("utf-8")), filename="extrato.csv")
+    relatorio = executar(server.importar_lancamentos(arquivo, None, None, usuario))
+    assert relatorio["importados"] == 4
+    assert relatorio["total_erros"] == 1
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_operacoes_em_lote(usuario, executar):
+    for dia in (1, 2, 3):
+        executar(server.criar_despesa(despesa(data=f"2024-05-0{dia}"), usuario))
+    entrada = server.AtualizacaoLote(
+        filtro=server.FiltroLote(data_inicio="2024-05-02", data_fim="2024-05-03"),
+        alteracoes=server.AlteracoesLote(categoria="Lazer", valor=80.0),
+    )
+    executar(server.atualizar_despesas_lote(entrada, usuario))
+    executar(server.excluir_despesas_lote(server.FiltroLote(categoria="Lazer", data_inicio="2024-05-03"), usuario))
+    assert executar(server.verificar_resumos()) == []
+
+
+def test_migracao_inclui_historico_anterior_a_primeira_escrita(usuario, db, executar, monkeypatch):
+    monkeypatch.setattr(server, "MIGRACOES", [("resumos_mensais", server.migrar_resumos_mensais)])
+    # Lançamento gravado antes de resumos_mensais existir, seguido de uma escrita nova
+    executar(db.despesas.insert_one({"id": "antiga", "user_id": usuario["id"], "data": "2023-11-20",
+                                     "descricao": "Antiga", "categoria": "Moradia", "forma_pagamento": "pix",
+                                     "valor": 900.0, "mes": 11, "ano": 2023}))
+    executar(server.criar_despesa(despesa(), usuario))
+    assert executar(server.verificar_resumos()) != []
+    
+    async def dois_workers():
+        return await asyncio.gather(server.aplicar_migracoes(), server.aplicar_migracoes())
+    
+    assert sorted(executar(dois_workers())) == [[], ["resumos_mensais"]]
+    assert executar(server.verificar_resumos()) == []
@@ -0,0 +1,17 @@
+"""Ordem dos hooks de startup da API"""
+import server
+
+
+def ordem_startup():
+    return [hook.__name__ for hook in server.app.router.on_startup]
+
+
+def test_banco_preparado_antes_dos_workers_hotmart():
+    ordem = ordem_startup()
+    assert ordem[:2] == ["aquecer_mongo", "preparar_banco"]
+    assert ordem.index("preparar_banco") < ordem.index("iniciar_workers_hotmart")
+
+
+def test_banco_preparado_antes_da_varredura_de_expiracoes():
+    ordem = ordem_startup()
+    assert ordem.index("preparar_banco") < ordem.index("iniciar_varredura_expiracoes")